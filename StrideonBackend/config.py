@@ -7,6 +7,26 @@ APP_NAME = "StrideOn Game Server"
 SUPABASE_URL = os.environ.get("SUPABASE_URL", "")
 SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")
 SUPABASE_ANON_KEY = os.environ.get("SUPABASE_ANON_KEY", SUPABASE_SERVICE_ROLE_KEY)
+# supabase-py is synchronous; queries run on a bounded thread pool (0 = inline on the event loop)
+SUPABASE_MAX_CONCURRENCY = int(os.environ.get("SUPABASE_MAX_CONCURRENCY", "16"))
+SUPABASE_OFFLOAD = os.environ.get("SUPABASE_OFFLOAD", "1").lower() in ("1", "true", "yes")
+# Local JWT verification: HS256 project secret and/or asymmetric keys from the JWKS endpoint
+SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET", "")
+SUPABASE_JWKS_URL = os.environ.get(
+    "SUPABASE_JWKS_URL", f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else ""
+)
+JWT_AUDIENCE = os.environ.get("JWT_AUDIENCE", "authenticated")
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_JWKS_TTL_SEC = float(os.environ.get("AUTH_JWKS_TTL_SEC", "3600"))
+
+# Shared outbound HTTP client (Supabase Auth, JWKS, Very Network RPC)
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY_SEC = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY_SEC", "30.0"))
+HTTP_CONNECT_TIMEOUT_SEC = float(os.environ.get("HTTP_CONNECT_TIMEOUT_SEC", "3.0"))
+HTTP_TIMEOUT_SEC = float(os.environ.get("HTTP_TIMEOUT_SEC", "5.0"))
+HTTP_POOL_TIMEOUT_SEC = float(os.environ.get("HTTP_POOL_TIMEOUT_SEC", "2.0"))  # wait for a free connection
+HTTP_HTTP2 = os.environ.get("HTTP_HTTP2", "1").lower() in ("1", "true", "yes")
 
 # Redis
 REDIS_URL = os.environ.get("REDIS_URL", "")
@@ -18,11 +38,72 @@ ALLOWED_ORIGINS = os.environ.get("ALLOWED_ORIGINS", "*")
 # Debug
 DEBUG_USER_ID = os.environ.get("DEBUG_USER_ID", "")
 
+# Known-profile cache (skips ensure_profile's SELECT once a user's row is seen)
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", "50000"))
+PROFILE_CACHE_TTL_SEC = int(os.environ.get("PROFILE_CACHE_TTL_SEC", "86400"))
+
 # Game Configuration
 PRESENCE_TTL_SEC = int(os.environ.get("PRESENCE_TTL_SEC", "90"))
+NEARBY_DEFAULT_COUNT = int(os.environ.get("NEARBY_DEFAULT_COUNT", "50"))
+NEARBY_MAX_COUNT = int(os.environ.get("NEARBY_MAX_COUNT", "200"))
 GPS_STREAM_MAXLEN = int(os.environ.get("GPS_STREAM_MAXLEN", "1000"))
+GPS_BATCH_MAX_POINTS = int(os.environ.get("GPS_BATCH_MAX_POINTS", "500"))
+# Thinning (off by default): drop pings that stay in the last kept point's cell and moved < X m or came < Y s later (0 disables a rule)
+GPS_THIN_MIN_DISTANCE_M = float(os.environ.get("GPS_THIN_MIN_DISTANCE_M", "0"))
+GPS_THIN_MIN_INTERVAL_SEC = float(os.environ.get("GPS_THIN_MIN_INTERVAL_SEC", "0"))
+GPS_WS_QUEUE_FRAMES = int(os.environ.get("GPS_WS_QUEUE_FRAMES", "64"))  # frames buffered per socket before backpressure
 SESSION_TTL_SEC = int(os.environ.get("SESSION_TTL_SEC", "3600"))  # 1 hour
 TRAIL_TTL_SEC = int(os.environ.get("TRAIL_TTL_SEC", "7200"))  # 2 hours
 H3_RESOLUTION = int(os.environ.get("H3_RESOLUTION", "9"))
 MIN_LOOP_AREA_M2 = float(os.environ.get("MIN_LOOP_AREA_M2", "100.0"))
-MAX_TRAIL_POINTS = int(os.environ.get("MAX_TRAIL_POINTS", "10000"))
\ No newline at end of file
+MAX_TRAIL_POINTS = int(os.environ.get("MAX_TRAIL_POINTS", "10000"))
+MAX_LOOP_BBOX_CELLS = int(os.environ.get("MAX_LOOP_BBOX_CELLS", "250000"))
+GEO_CACHE_SIZE = int(os.environ.get("GEO_CACHE_SIZE", "100000"))  # memoized cell areas
+# Use the resolution's average hexagon area instead of per-cell areas
+GEO_AREA_APPROX = os.environ.get("GEO_AREA_APPROX", "0").lower() in ("1", "true", "yes")
+CUT_EVENT_TTL_SEC = int(os.environ.get("CUT_EVENT_TTL_SEC", "86400"))  # 24 hours
+CUTS_PER_USER_MAX = int(os.environ.get("CUTS_PER_USER_MAX", "500"))
+
+# In-process trail cache with write-behind to Redis (0 disables)
+TRAIL_CACHE_SIZE = int(os.environ.get("TRAIL_CACHE_SIZE", "0"))
+TRAIL_CACHE_FLUSH_EVERY = int(os.environ.get("TRAIL_CACHE_FLUSH_EVERY", "10"))  # points
+TRAIL_CACHE_FLUSH_INTERVAL_SEC = float(os.environ.get("TRAIL_CACHE_FLUSH_INTERVAL_SEC", "2.0"))
+TRAIL_CACHE_FLUSH_RETRIES = int(os.environ.get("TRAIL_CACHE_FLUSH_RETRIES", "3"))
+# Uncached writes re-read and re-apply this many times when another worker updated the trail first, then fail
+TRAIL_WRITE_RETRIES = int(os.environ.get("TRAIL_WRITE_RETRIES", "5"))
+# A worker holding buffered points owns the trail and renews the lease while it buffers;
+# others wait up to the lease for its flush, then fail the call rather than write out of order
+TRAIL_CACHE_LEASE_SEC = float(os.environ.get("TRAIL_CACHE_LEASE_SEC", "10.0"))
+TRAIL_OWNER_POLL_SEC = float(os.environ.get("TRAIL_OWNER_POLL_SEC", "0.05"))
+TRAIL_OUTLINE_CACHE_SIZE = int(os.environ.get("TRAIL_OUTLINE_CACHE_SIZE", "1000"))
+# Stored point encoding: "compact" (versioned fixed-point binary) or "json" (legacy; for rolling back)
+TRAIL_POINT_FORMAT = os.environ.get("TRAIL_POINT_FORMAT", "compact").lower()
+
+# Event-loop stall monitor
+LOOP_MONITOR_INTERVAL_SEC = float(os.environ.get("LOOP_MONITOR_INTERVAL_SEC", "0.1"))
+LOOP_STALL_THRESHOLD_MS = float(os.environ.get("LOOP_STALL_THRESHOLD_MS", "20"))
+
+# Write-behind queue for claims and banked results (Redis stream -> bulk insert)
+WRITE_BEHIND_ENABLED = os.environ.get("WRITE_BEHIND_ENABLED", "0").lower() in ("1", "true", "yes")
+WRITE_BEHIND_BATCH = int(os.environ.get("WRITE_BEHIND_BATCH", "200"))
+WRITE_BEHIND_INTERVAL_SEC = float(os.environ.get("WRITE_BEHIND_INTERVAL_SEC", "1.0"))
+WRITE_BEHIND_MAX_RETRIES = int(os.environ.get("WRITE_BEHIND_MAX_RETRIES", "5"))
+WRITE_BEHIND_CLAIM_IDLE_SEC = float(os.environ.get("WRITE_BEHIND_CLAIM_IDLE_SEC", "30.0"))
+
+# Redis sorted-set leaderboards (updated on bank, snapshotted to leaderboard_daily)
+LEADERBOARD_TTL_SEC = int(os.environ.get("LEADERBOARD_TTL_SEC", str(8 * 24 * 3600)))
+LEADERBOARD_SNAPSHOT_INTERVAL_SEC = float(os.environ.get("LEADERBOARD_SNAPSHOT_INTERVAL_SEC", "60.0"))
+
+# Server push of cut, loop and presence events (Redis pub/sub -> SSE/WebSocket)
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "100"))  # per connected client
+EVENTS_KEEPALIVE_SEC = float(os.environ.get("EVENTS_KEEPALIVE_SEC", "15.0"))
+
+
+# Async ingest: endpoints only XADD; trail workers consume partitioned work streams
+GPS_ASYNC_INGEST = os.environ.get("GPS_ASYNC_INGEST", "0").lower() in ("1", "true", "yes")
+GPS_WORKERS_INPROC = int(os.environ.get("GPS_WORKERS_INPROC", "1"))  # workers run inside each API process (0: only worker.py)
+GPS_WORK_PARTITIONS = int(os.environ.get("GPS_WORK_PARTITIONS", "16"))
+GPS_WORK_BATCH = int(os.environ.get("GPS_WORK_BATCH", "200"))
+GPS_WORK_BLOCK_MS = int(os.environ.get("GPS_WORK_BLOCK_MS", "1000"))
+GPS_WORK_LEASE_SEC = float(os.environ.get("GPS_WORK_LEASE_SEC", "15.0"))
+GPS_WORK_MAX_RETRIES = int(os.environ.get("GPS_WORK_MAX_RETRIES", "5"))
\ No newline at end of file
@@ -1,18 +1,33 @@
 from datetime import datetime, timezone
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from config import APP_NAME, REDIS_URL, ALLOWED_ORIGINS
+import asyncio
+from config import (
+    APP_NAME, REDIS_URL, ALLOWED_ORIGINS, TRAIL_CACHE_SIZE, TRAIL_CACHE_FLUSH_EVERY, TRAIL_CACHE_FLUSH_INTERVAL_SEC,
+    LOOP_MONITOR_INTERVAL_SEC, LOOP_STALL_THRESHOLD_MS, WRITE_BEHIND_ENABLED, WRITE_BEHIND_INTERVAL_SEC,
+    LEADERBOARD_SNAPSHOT_INTERVAL_SEC, GPS_ASYNC_INGEST, GPS_WORKERS_INPROC, GPS_WORK_BLOCK_MS,
+)
 from models import HealthOut
 from services.session import SessionManager
 from services.trail import TrailProcessor
+from services.trail_cache import TrailCache
+from services.http_client import get_http_client, close_http_client
+from services.loop_monitor import LoopLagMonitor
+from services.db import db
+from services.write_queue import WriteBehindQueue
+from services.leaderboard import Leaderboard
+from services.events import EventHub
+from services.trail_worker import TrailWorker
 from routers.auth import router as auth_router, wepin_router
 from routers.profiles import router as profiles_router
 from routers.sessions import router as sessions_router
-from routers.presence import router as presence_router, gps_router
+from routers.presence import router as presence_router, gps_router, point_thinner
 from routers.trails import router as trails_router, sessions_router as trail_sessions_router, cuts_router
 from routers.claims import router as claims_router, bank_router
 from routers.powerups import router as powerups_router, inventory_router, leaderboard_router
-from routers.verynet import router as verinet_router
+from routers.verynet import router as verinet_router, chain as verynet_chain, VERY_BLOCK_POLL_SEC
+from routers.metrics import router as metrics_router
+from routers.events import router as events_router
 
 try:
     import redis.asyncio as aioredis
@@ -23,6 +38,12 @@ except Exception:  # pragma: no cover
 redis = None
 session_manager = None
 trail_processor = None
+write_queue = None
+leaderboard = None
+event_hub = None
+trail_workers = []
+background_tasks = []
+loop_monitor = LoopLagMonitor(LOOP_MONITOR_INTERVAL_SEC, LOOP_STALL_THRESHOLD_MS)
 
 app = FastAPI(title=APP_NAME)
 
@@ -34,6 +55,7 @@ app.add_middleware(
     allow_credentials=(ALLOWED_ORIGINS.strip() != "*"),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # /cuts/mine pagination; browsers hide other headers from JS
 )
 
 # Register routers
@@ -52,15 +74,22 @@ app.include_router(powerups_router)
 app.include_router(inventory_router)
 app.include_router(leaderboard_router)
 app.include_router(verinet_router)
+app.include_router(metrics_router)
+app.include_router(events_router)
 
 
 # ---------- Lifecycle ----------
 @app.on_event("startup")
 async def on_startup() -> None:
-    global redis, session_manager, trail_processor
+    global redis, session_manager, trail_processor, write_queue, leaderboard, event_hub
     # Init Supabase early
     from utils import ensure_supabase
     _ = ensure_supabase()
+    # Shared pooled client for outbound HTTP
+    get_http_client()
+    background_tasks.append(asyncio.create_task(loop_monitor.run()))
+    if VERY_BLOCK_POLL_SEC > 0:
+        background_tasks.append(asyncio.create_task(verynet_chain.run_poller(VERY_BLOCK_POLL_SEC)))
     # Init Redis if available
     if aioredis and REDIS_URL:
         try:
@@ -68,7 +97,26 @@ async def on_startup() -> None:
             await redis.ping()
             # Initialize managers
             session_manager = SessionManager(redis)
-            trail_processor = TrailProcessor(redis)
+            trail_cache = TrailCache(TRAIL_CACHE_SIZE, TRAIL_CACHE_FLUSH_EVERY) if TRAIL_CACHE_SIZE > 0 else None
+            trail_processor = TrailProcessor(redis, cache=trail_cache)
+            if trail_cache:
+                background_tasks.append(asyncio.create_task(trail_processor.run_flusher(TRAIL_CACHE_FLUSH_INTERVAL_SEC)))
+            if WRITE_BEHIND_ENABLED:
+                write_queue = WriteBehindQueue(redis)
+                await write_queue.ensure_group()
+                background_tasks.append(asyncio.create_task(write_queue.run(WRITE_BEHIND_INTERVAL_SEC)))
+            leaderboard = Leaderboard(redis)
+            background_tasks.append(asyncio.create_task(leaderboard.run_snapshots(LEADERBOARD_SNAPSHOT_INTERVAL_SEC)))
+            # One pub/sub connection per worker fans events out to its SSE/WS clients
+            event_hub = EventHub(redis)
+            await event_hub.start()
+            background_tasks.append(asyncio.create_task(event_hub.run()))
+            if GPS_ASYNC_INGEST:
+                # Trail processing off the request path; worker.py runs more of these elsewhere
+                for _ in range(GPS_WORKERS_INPROC):
+                    worker = TrailWorker(redis, trail_processor, point_thinner)
+                    trail_workers.append(worker)
+                    background_tasks.append(asyncio.create_task(worker.run(GPS_WORK_BLOCK_MS)))
         except Exception:
             redis = None
 
@@ -76,11 +124,40 @@ async def on_startup() -> None:
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
     global redis
+    for task in background_tasks:
+        task.cancel()
+    if trail_processor:
+        try:
+            await trail_processor.flush_all()
+        except Exception:
+            pass
+    if write_queue:
+        try:
+            # Drain what is queued now; anything left stays in the stream for the next worker
+            for _ in range(10):
+                if not await write_queue.flush_once():
+                    break
+        except Exception:
+            pass
+    if leaderboard:
+        try:
+            await leaderboard.snapshot_dirty()
+        except Exception:
+            pass
+    for worker in trail_workers:
+        try:
+            await worker.stop()
+        except Exception:
+            pass
+    if event_hub:
+        await event_hub.close()
     if redis:
         try:
             await redis.aclose()
         except Exception:
             pass
+    await close_http_client()
+    db.shutdown()
 
 
 # ---------- Basic Health Endpoints ----------
@@ -97,4 +174,5 @@ async def health() -> HealthOut:
 # Notes:
 # - Run with: uvicorn main:app --reload
 # - Env required: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, REDIS_URL (for presence/gps), SUPABASE_ANON_KEY (for JWT verify)
+# - Optional: SUPABASE_JWT_SECRET (HS256) or SUPABASE_JWKS_URL to verify JWTs locally instead of calling Supabase Auth
 # - For local dev without JWT, set DEBUG_USER_ID to a valid profiles.user_id in your Supabase.
\ No newline at end of file
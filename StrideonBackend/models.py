@@ -24,7 +24,10 @@ class TrailState:
     status: str  # 'active', 'completed', 'cut'
     last_updated: datetime
     total_length_m: float
-    claimed_territory: Set[str]  # H3 cells already owned
+    claimed_territory: Set[int]  # H3 cells already owned (int64 indexes)
+    points_count: int = 0  # total points stored; on the ingest path only the tail is loaded
+    city: str = "unknown"  # scope of the cell -> active trail index
+    outside_count: int = 0  # points since the trail last left claimed territory
 
 @dataclass
 class SessionState:
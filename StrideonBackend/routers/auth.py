@@ -2,7 +2,8 @@ from datetime import datetime, timezone
 from typing import Dict, Any
 from fastapi import APIRouter, HTTPException, Header
 from models import NonceOut, LinkReq
-from utils import get_user_id, ensure_profile, ensure_supabase, set_nonce, get_nonce
+from utils import get_user_id, ensure_profile, ensure_supabase, set_nonce, get_nonce, known_profiles
+from services.db import db_execute
 
 try:
     from eth_account.messages import encode_defunct
@@ -53,11 +54,12 @@ async def link_wepin(req: LinkReq, authorization: str = Header(default="")) -> D
     # Update profile with Wepin linkage
     s = ensure_supabase()
     try:
-        s.table("profiles").upsert({
+        await db_execute(s.table("profiles").upsert({
             "user_id": user_id,
             "wepin_user_id": req.wepinUserId,
             "wepin_address": req.address,
-        }, on_conflict="user_id").execute()
+        }, on_conflict="user_id"))
     except Exception as e:
         raise HTTPException(400, f"DB error: {e}")
+    await known_profiles.mark(user_id, redis)
     return {"ok": True}
\ No newline at end of file
@@ -3,6 +3,7 @@ from typing import List, Optional
 from fastapi import APIRouter, HTTPException, Header, Query
 from models import ClaimIn, ClaimOut, BankIn, BankOut
 from utils import get_user_id, ensure_supabase
+from services.db import db_execute
 
 
 router = APIRouter(prefix="/claims", tags=["claims"])
@@ -18,8 +19,13 @@ async def create_claim(body: ClaimIn, authorization: str = Header(default="")) -
         "area_m2": body.area_m2,
         "h3_cells": body.h3_cells,
     }
+    from main import write_queue
     try:
-        res = s.table("claims").insert(payload).execute()
+        if write_queue:
+            # Acknowledged once durable in Redis; the flusher bulk-inserts it
+            row = await write_queue.enqueue("claims", payload)
+            return ClaimOut(**row, created_at=datetime.now(timezone.utc).isoformat())
+        res = await db_execute(s.table("claims").insert(payload))
         row = (res.data or [])[0]
         return ClaimOut(**row)
     except Exception as e:
@@ -31,7 +37,7 @@ async def list_claims(authorization: str = Header(default="")) -> List[ClaimOut]
     user_id = await get_user_id(authorization)
     s = ensure_supabase()
     try:
-        res = s.table("claims").select("id,session_id,user_id,area_m2,h3_cells,created_at").eq("user_id", user_id).order("created_at", desc=True).limit(100).execute()
+        res = await db_execute(s.table("claims").select("id,session_id,user_id,area_m2,h3_cells,created_at").eq("user_id", user_id).order("created_at", desc=True).limit(100))
         rows = res.data or []
         return [ClaimOut(**r) for r in rows]
     except Exception as e:
@@ -58,11 +64,22 @@ async def bank_result(body: BankIn, authorization: str = Header(default="")) ->
         "ipfs_cid": body.ipfs_cid,
         "signature": body.signature,
     }
+    from main import write_queue, leaderboard
     try:
-        res = s.table("banked_results").insert(payload).execute()
-        row = (res.data or [])[0]
+        if write_queue:
+            # Acknowledged once durable in Redis; the flusher bulk-inserts it
+            row = await write_queue.enqueue("banked_results", payload)
+        else:
+            res = await db_execute(s.table("banked_results").insert(payload))
+            row = (res.data or [])[0]
         # We may not have day populated in returning if trigger runs before return; best-effort cast
         day = row.get("day") or datetime.now(timezone.utc).date().isoformat()
+        if leaderboard:
+            try:
+                await leaderboard.record(user_id, body.score, city=body.city, day=day)
+            except Exception as e:
+                # The bank itself succeeded; don't fail the request over the board
+                print(f"Leaderboard update failed: {e}")
         return BankOut(
             id=row.get("id"), user_id=row.get("user_id"), session_id=row.get("session_id"), city=row.get("city"), ts=row.get("ts"), day=day, area_m2=row.get("area_m2", 0), score=row.get("score", 0), ipfs_cid=row.get("ipfs_cid"), signature=row.get("signature"),
         )
@@ -78,7 +95,7 @@ async def list_banked(authorization: str = Header(default=""), day: Optional[str
         q = s.table("banked_results").select("id,user_id,session_id,city,ts,day,area_m2,score,ipfs_cid,signature").eq("user_id", user_id)
         if day:
             q = q.eq("day", day)
-        res = q.order("ts", desc=True).limit(100).execute()
+        res = await db_execute(q.order("ts", desc=True).limit(100))
         rows = res.data or []
         return [BankOut(**r) for r in rows]
     except Exception as e:
@@ -0,0 +1,130 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi import APIRouter, HTTPException, Header, Query, WebSocket
+from fastapi.responses import StreamingResponse
+from utils import get_user_id
+from services.events import user_channel, city_channel
+from services.geo import haversine_m
+from config import EVENTS_KEEPALIVE_SEC
+
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+
+class EventFilter:
+    """Per-client view of the city feed: drops own presence and runners outside the radius"""
+
+    def __init__(self, user_id: str, lat: Optional[float], lng: Optional[float], radius_m: int):
+        self.user_id = user_id
+        self.lat = lat
+        self.lng = lng
+        self.radius_m = radius_m
+
+    def accepts(self, event: Dict[str, Any]) -> bool:
+        if event.get("type") != "presence":
+            return True
+        if event.get("user_id") == self.user_id:
+            return False
+        if self.lat is None or self.lng is None:
+            return True
+        return haversine_m(self.lat, self.lng, event["lat"], event["lng"]) <= self.radius_m
+
+
+def _channels(user_id: str, city: Optional[str]) -> List[str]:
+    return [user_channel(user_id)] + ([city_channel(city)] if city else [])
+
+
+def _get_hub():
+    from main import event_hub
+    if not event_hub:
+        raise HTTPException(500, "Redis not configured; set REDIS_URL")
+    return event_hub
+
+
+@router.get("/stream")
+async def event_stream(
+    city: Optional[str] = Query(default=None),
+    lat: Optional[float] = Query(default=None, ge=-90, le=90),
+    lng: Optional[float] = Query(default=None, ge=-180, le=180),
+    radius_m: int = Query(1000, ge=10, le=10000),
+    token: str = Query(default=""),
+    authorization: str = Header(default=""),
+) -> StreamingResponse:
+    """Server-sent events: cuts and loops for the caller, plus the city feed when `city` is given.
+
+    EventSource cannot set headers, so the JWT may be passed as ?token=.
+    """
+    user_id = await get_user_id(authorization or token)
+    hub = _get_hub()
+    channels = _channels(user_id, city)
+    event_filter = EventFilter(user_id, lat, lng, radius_m)
+    queue = await hub.subscribe(channels)
+
+    async def body() -> AsyncIterator[str]:
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE_SEC)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event_filter.accepts(event):
+                    yield f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, default=str)}\n\n"
+        finally:
+            await hub.unsubscribe(queue, channels)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def event_ws(
+    websocket: WebSocket,
+    city: Optional[str] = Query(default=None),
+    lat: Optional[float] = Query(default=None),
+    lng: Optional[float] = Query(default=None),
+    radius_m: int = Query(1000),
+    token: str = Query(default=""),
+) -> None:
+    """WebSocket variant of /events/stream; send {"lat": .., "lng": ..} to move the nearby filter"""
+    try:
+        user_id = await get_user_id(websocket.headers.get("authorization") or token)
+        hub = _get_hub()
+    except HTTPException as e:
+        await websocket.close(code=4401 if e.status_code == 401 else 1011)
+        return
+    await websocket.accept()
+    channels = _channels(user_id, city)
+    event_filter = EventFilter(user_id, lat, lng, radius_m)
+    queue = await hub.subscribe(channels)
+
+    async def pump() -> None:
+        while True:
+            event = await queue.get()
+            if event_filter.accepts(event):
+                await websocket.send_text(json.dumps(event, default=str))
+
+    async def receive() -> None:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            try:
+                update = json.loads(message.get("text") or "{}")
+                event_filter.lat = float(update["lat"])
+                event_filter.lng = float(update["lng"])
+            except Exception:
+                continue
+
+    tasks = [asyncio.create_task(pump()), asyncio.create_task(receive())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await hub.unsubscribe(queue, channels)
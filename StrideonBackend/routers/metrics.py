@@ -0,0 +1,110 @@
+from typing import Dict, Any
+from fastapi import APIRouter
+
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/trail-cache")
+async def trail_cache_metrics() -> Dict[str, Any]:
+    from main import trail_processor
+    if not trail_processor or not trail_processor.cache:
+        return {"enabled": False}
+    return {"enabled": True, **trail_processor.cache.stats()}
+
+
+@router.get("/trail-ingest")
+async def trail_ingest_metrics() -> Dict[str, Any]:
+    from main import trail_processor
+    if not trail_processor:
+        return {"enabled": False}
+    return {"enabled": True, **trail_processor.ingest_stats()}
+
+
+@router.get("/auth")
+async def auth_metrics() -> Dict[str, Any]:
+    from utils import token_verifier
+    return token_verifier.stats()
+
+
+@router.get("/http")
+async def http_pool_metrics() -> Dict[str, Any]:
+    from services import http_client
+    if http_client.http_client is None:
+        return {"enabled": False}
+    return {"enabled": True, **http_client.http_client.stats()}
+
+
+@router.get("/geo")
+async def geo_cache_metrics() -> Dict[str, Any]:
+    from services.geo import geo_cache_stats
+    return geo_cache_stats()
+
+
+@router.get("/loop")
+async def loop_metrics(reset: bool = False) -> Dict[str, Any]:
+    """Event-loop stall and Supabase pool usage; `reset` starts a new measurement window"""
+    from main import loop_monitor
+    from services.db import db
+    out = {"loop": loop_monitor.stats(), "db": db.stats()}
+    if reset:
+        loop_monitor.reset()
+    return out
+
+
+@router.get("/profiles")
+async def profile_cache_metrics() -> Dict[str, Any]:
+    from utils import known_profiles
+    return known_profiles.stats()
+
+
+@router.get("/write-queue")
+async def write_queue_metrics() -> Dict[str, Any]:
+    from main import write_queue
+    if not write_queue:
+        return {"enabled": False}
+    return {"enabled": True, **await write_queue.stats()}
+
+
+@router.get("/leaderboard")
+async def leaderboard_metrics() -> Dict[str, Any]:
+    from main import leaderboard
+    if not leaderboard:
+        return {"enabled": False}
+    return {"enabled": True, **leaderboard.stats()}
+
+
+@router.get("/verynet")
+async def verynet_metrics() -> Dict[str, Any]:
+    from routers.verynet import chain
+    return chain.stats()
+
+
+@router.get("/events")
+async def event_hub_metrics() -> Dict[str, Any]:
+    from main import event_hub
+    if not event_hub:
+        return {"enabled": False}
+    return {"enabled": True, **event_hub.stats()}
+
+
+@router.get("/gps-thinning")
+async def gps_thinning_metrics() -> Dict[str, Any]:
+    from routers.presence import point_thinner
+    return point_thinner.stats()
+
+
+@router.get("/trail-workers")
+async def trail_worker_metrics() -> Dict[str, Any]:
+    from main import redis, trail_workers
+    from config import GPS_ASYNC_INGEST, GPS_WORK_PARTITIONS
+    from services.trail_worker import work_stream_key
+    out: Dict[str, Any] = {"enabled": GPS_ASYNC_INGEST, "workers": [w.stats() for w in trail_workers]}
+    if GPS_ASYNC_INGEST and redis:
+        pipe = redis.pipeline(transaction=False)
+        for p in range(GPS_WORK_PARTITIONS):
+            pipe.xlen(work_stream_key(p))
+        depths = await pipe.execute()
+        out["backlog"] = sum(depths)
+        out["partition_depths"] = depths
+    return out
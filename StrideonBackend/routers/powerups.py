@@ -2,6 +2,8 @@ from typing import List, Dict, Any, Optional
 from fastapi import APIRouter, HTTPException, Header, Query
 from models import PowerupUseIn
 from utils import get_user_id, ensure_supabase
+from services.db import db_execute
+from services.leaderboard import today
 
 
 router = APIRouter(prefix="/powerups", tags=["powerups"])
@@ -11,7 +13,7 @@ router = APIRouter(prefix="/powerups", tags=["powerups"])
 async def list_powerups() -> List[Dict[str, Any]]:
     s = ensure_supabase()
     try:
-        res = s.table("powerups").select("id,name,description,base_price,duration_seconds,enabled,updated_at").eq("enabled", True).order("id").execute()
+        res = await db_execute(s.table("powerups").select("id,name,description,base_price,duration_seconds,enabled,updated_at").eq("enabled", True).order("id"))
         return res.data or []
     except Exception as e:
         raise HTTPException(400, f"DB error: {e}")
@@ -23,19 +25,19 @@ async def use_powerup(body: PowerupUseIn, authorization: str = Header(default=""
     s = ensure_supabase()
     # Check inventory
     try:
-        inv = s.table("user_powerups").select("id,quantity").eq("user_id", user_id).eq("powerup_id", body.powerup_id).single().execute().data
+        inv = (await db_execute(s.table("user_powerups").select("id,quantity").eq("user_id", user_id).eq("powerup_id", body.powerup_id).single())).data
         if not inv or inv.get("quantity", 0) <= 0:
             raise HTTPException(400, "Insufficient quantity")
         # Log usage
-        s.table("powerup_uses").insert({
+        await db_execute(s.table("powerup_uses").insert({
             "user_id": user_id,
             "session_id": body.session_id,
             "powerup_id": body.powerup_id,
             "metadata": body.metadata or {},
-        }).execute()
+        }))
         # Decrement inventory (non-atomic; acceptable for MVP)
         new_q = max(0, int(inv.get("quantity", 0)) - 1)
-        s.table("user_powerups").update({"quantity": new_q}).eq("id", inv["id"]).execute()
+        await db_execute(s.table("user_powerups").update({"quantity": new_q}).eq("id", inv["id"]))
         return {"ok": True, "powerup_id": body.powerup_id, "remaining": new_q}
     except HTTPException:
         raise
@@ -52,7 +54,7 @@ async def my_inventory(authorization: str = Header(default="")) -> List[Dict[str
     user_id = await get_user_id(authorization)
     s = ensure_supabase()
     try:
-        res = s.table("user_powerups").select("powerup_id,quantity,updated_at").eq("user_id", user_id).order("powerup_id").execute()
+        res = await db_execute(s.table("user_powerups").select("powerup_id,quantity,updated_at").eq("user_id", user_id).order("powerup_id"))
         return res.data or []
     except Exception as e:
         raise HTTPException(400, f"DB error: {e}")
@@ -63,16 +65,46 @@ leaderboard_router = APIRouter(prefix="/leaderboard", tags=["leaderboard"])
 
 
 @leaderboard_router.get("/daily")
-async def leaderboard_daily(day: Optional[str] = Query(default=None), city: Optional[str] = Query(default=None)) -> List[Dict[str, Any]]:
+async def leaderboard_daily(
+    day: Optional[str] = Query(default=None),
+    city: Optional[str] = Query(default=None),
+    limit: int = Query(default=100, ge=1, le=1000),
+    offset: int = Query(default=0, ge=0),
+) -> List[Dict[str, Any]]:
+    from main import leaderboard
+    if leaderboard:
+        try:
+            rows = await leaderboard.top(day or today(), city, limit=limit, offset=offset)
+            if rows:
+                return rows
+        except Exception:
+            pass  # fall back to the last snapshot
+    if city:
+        return []  # snapshots hold the global board only; city boards live in Redis
     s = ensure_supabase()
     try:
-        q = s.table("leaderboard_daily").select("id,day,city,user_id,score,rank")
+        q = s.table("leaderboard_daily").select("id,day,user_id,score,rank")
         if day:
             q = q.eq("day", day)
-        if city:
-            q = q.eq("city", city)
-        q = q.order("score", desc=True).limit(100)
-        res = q.execute()
+        q = q.order("score", desc=True).range(offset, offset + limit - 1)
+        res = await db_execute(q)
         return res.data or []
     except Exception as e:
-        raise HTTPException(400, f"DB error: {e}")
\ No newline at end of file
+        raise HTTPException(400, f"DB error: {e}")
+
+
+@leaderboard_router.get("/daily/me")
+async def leaderboard_daily_me(
+    authorization: str = Header(default=""),
+    day: Optional[str] = Query(default=None),
+    city: Optional[str] = Query(default=None),
+    radius: int = Query(default=5, ge=0, le=50),
+) -> Dict[str, Any]:
+    user_id = await get_user_id(authorization)
+    from main import leaderboard
+    if not leaderboard:
+        raise HTTPException(500, "Redis not configured; set REDIS_URL")
+    try:
+        return await leaderboard.around(user_id, day or today(), city, radius=radius)
+    except Exception as e:
+        raise HTTPException(500, f"Leaderboard error: {e}")
\ No newline at end of file
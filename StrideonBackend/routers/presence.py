@@ -1,11 +1,20 @@
+import asyncio
 import json
 from datetime import datetime, timezone
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 import h3
-from fastapi import APIRouter, HTTPException, Header, Query
+from fastapi import APIRouter, HTTPException, Header, Query, WebSocket
 from models import PresenceIn, NearbyOut, PointIn, H3Point
 from utils import get_user_id
-from config import PRESENCE_TTL_SEC, GPS_STREAM_MAXLEN, H3_RESOLUTION
+from services.events import queue_publish, city_channel
+from services.point_filter import PointThinner, thin_and_process
+from services.trail_worker import queue_work
+from config import PRESENCE_TTL_SEC, NEARBY_DEFAULT_COUNT, NEARBY_MAX_COUNT, GPS_STREAM_MAXLEN, GPS_BATCH_MAX_POINTS, GPS_WS_QUEUE_FRAMES, GPS_ASYNC_INGEST, H3_RESOLUTION
+
+try:
+    import msgpack
+except Exception:  # pragma: no cover
+    msgpack = None  # type: ignore
 
 
 router = APIRouter(tags=["presence"])
@@ -19,12 +28,14 @@ async def update_presence(p: PresenceIn, authorization: str = Header(default="")
         raise HTTPException(500, "Redis not configured; set REDIS_URL")
     h3_index = h3.latlng_to_cell(p.lat, p.lng, p.h3_res)
     now_iso = datetime.now(timezone.utc).isoformat()
-    # KV for latest presence
+    # KV for latest presence, GEO per city and a push to the city's listeners, one round trip
     val = {"user_id": user_id, "lat": p.lat, "lng": p.lng, "h3_index": h3_index, "updated_at": now_iso, "city": p.city}
-    await redis.setex(f"presence:{user_id}", PRESENCE_TTL_SEC, json.dumps(val))
-    # GEO per city
+    pipe = redis.pipeline(transaction=False)
+    pipe.setex(f"presence:{user_id}", PRESENCE_TTL_SEC, json.dumps(val))
     if p.city:
-        await redis.execute_command("GEOADD", f"presence:city:{p.city}", p.lng, p.lat, user_id)
+        pipe.execute_command("GEOADD", f"presence:city:{p.city}", p.lng, p.lat, user_id)
+        queue_publish(pipe, [city_channel(p.city)], {"type": "presence", **val})
+    await pipe.execute()
     return {"ok": True, "h3_index": h3_index}
 
 
@@ -34,73 +45,278 @@ async def presence_nearby(
     lat: float = Query(..., ge=-90, le=90),
     lng: float = Query(..., ge=-180, le=180),
     radius_m: int = Query(1000, ge=10, le=10000),
+    count: int = Query(NEARBY_DEFAULT_COUNT, ge=1, le=NEARBY_MAX_COUNT),
 ) -> List[NearbyOut]:
     from main import redis
     if not redis:
         raise HTTPException(500, "Redis not configured; set REDIS_URL")
     key = f"presence:city:{city}"
     try:
-        # Use GEOSEARCH for metric radius
+        # Use GEOSEARCH for metric radius, nearest first
         res = await redis.execute_command(
-            "GEOSEARCH", key, "FROMLONLAT", lng, lat, "BYRADIUS", radius_m, "m", "WITHDIST", "COUNT", 50
+            "GEOSEARCH", key, "FROMLONLAT", lng, lat, "BYRADIUS", radius_m, "m", "WITHDIST", "COUNT", count, "ASC"
         )
+        res = res or []
+        # Fetch all presence payloads in one round trip
+        payloads = await redis.mget([f"presence:{item[0]}" for item in res]) if res else []
     except Exception as e:
         raise HTTPException(500, f"Redis error: {e}")
     out: List[NearbyOut] = []
-    for item in res or []:
+    stale: List[str] = []
+    for item, payload in zip(res, payloads):
         uid = item[0]
+        data = json.loads(payload) if payload else None
+        # Presence expired (or runner moved to another city): GEO member is left over
+        if not data or data.get("city") not in (None, city):
+            stale.append(uid)
+            continue
         dist = float(item[1]) if len(item) > 1 else None
-        # Fetch presence payload
-        payload = await redis.get(f"presence:{uid}")
-        data = json.loads(payload) if payload else {}
         out.append(NearbyOut(user_id=uid, dist_m=dist, lat=data.get("lat"), lng=data.get("lng"), h3_index=data.get("h3_index"), updated_at=data.get("updated_at")))
+    if stale:
+        try:
+            await redis.zrem(key, *stale)
+        except Exception:
+            pass
     return out
 
 
 # GPS endpoints
 gps_router = APIRouter(prefix="/gps", tags=["gps"])
+# Drops stationary/jitter pings before trail processing; see /metrics/gps-thinning
+point_thinner = PointThinner()
 
 
-@gps_router.post("/ingest")
-async def gps_ingest(p: PointIn, authorization: str = Header(default="")) -> Dict[str, Any]:
-    user_id = await get_user_id(authorization)
-    from main import redis, trail_processor, session_manager
-    if not redis or not trail_processor:
-        raise HTTPException(500, "Redis or TrailProcessor not configured")
-    
-    # Update session activity
-    if session_manager:
-        await session_manager.update_session_activity(p.session_id)
-    
+def _point_from_input(p: PointIn) -> H3Point:
     ts = p.ts or datetime.now(timezone.utc)
     h3_index = h3.latlng_to_cell(p.lat, p.lng, p.h3_res or H3_RESOLUTION)
-    
-    # Create H3Point for enhanced processing
-    point = H3Point(
+    return H3Point(
         lat=p.lat,
         lng=p.lng,
         h3_index=h3_index,
         timestamp=ts,
         session_id=p.session_id
     )
+
+
+def _stream_fields(p: PointIn, point: H3Point) -> Dict[str, str]:
+    return {
+        "ts": point.timestamp.isoformat(),
+        "lat": str(p.lat),
+        "lng": str(p.lng),
+        "h3_res": str(p.h3_res or H3_RESOLUTION),
+        "h3_index": point.h3_index,
+    }
+
+
+@gps_router.post("/ingest")
+async def gps_ingest(p: PointIn, authorization: str = Header(default="")) -> Dict[str, Any]:
+    user_id = await get_user_id(authorization)
+    from main import redis, trail_processor
+    if not redis or not trail_processor:
+        raise HTTPException(500, "Redis or TrailProcessor not configured")
+    
+    # Create H3Point for enhanced processing
+    point = _point_from_input(p)
     
     try:
-        # Store in GPS stream for audit trail
-        stream_key = f"gps:{p.session_id}:stream"
-        fields = {
-            "ts": ts.isoformat(),
-            "lat": str(p.lat),
-            "lng": str(p.lng),
-            "h3_res": str(p.h3_res or H3_RESOLUTION),
-            "h3_index": h3_index,
-        }
-        msgid = await redis.xadd(stream_key, fields, maxlen=GPS_STREAM_MAXLEN, approximate=True)
-        
-        # Enhanced trail processing
-        result = await trail_processor.add_point_to_trail(p.session_id, user_id, point)
-        result["stream_id"] = msgid
-        
+        batch = await _ingest_points(user_id, p.session_id, [p], [point], defer=GPS_ASYNC_INGEST)
+        if batch.get("queued"):
+            return {"ok": True, "queued": True, "h3_index": point.h3_index, "stream_id": batch["stream_ids"][0]}
+        result = trail_processor.point_result(point, batch)
+        result["stream_id"] = batch["stream_ids"][0]
+        result["thinned"] = bool(batch["thinned"])
         return result
         
     except Exception as e:
-        raise HTTPException(500, f"Processing error: {e}")
\ No newline at end of file
+        raise HTTPException(500, f"Processing error: {e}")
+
+
+async def _ingest_points(user_id: str, session_id: str, points: List[PointIn], h3_points: Optional[List[H3Point]] = None, defer: bool = False) -> Dict[str, Any]:
+    """Audit-log, touch, thin and trail-process an ordered batch of one session's points.
+
+    With `defer` the points are queued for the trail workers instead and
+    results arrive as `trail_update` events (see services.trail_worker).
+    """
+    from main import redis, trail_processor, session_manager
+    h3_points = h3_points or [_point_from_input(p) for p in points]
+    city = next((p.city for p in reversed(points) if p.city), None)
+    
+    if defer:
+        stream_key = f"gps:{session_id}:stream"
+        pipe = redis.pipeline(transaction=False)
+        for p, point in zip(points, h3_points):
+            pipe.xadd(stream_key, _stream_fields(p, point), maxlen=GPS_STREAM_MAXLEN, approximate=True)
+        for p, point in zip(points, h3_points):
+            queue_work(pipe, session_id, user_id, p.city or city, point)
+        if session_manager:
+            session_manager.queue_activity_touch(pipe, session_id)
+        msgids = (await pipe.execute())[:len(points)]
+        return {"ok": True, "queued": True, "count": len(points), "stream_ids": msgids}
+    
+    # Store raw points in GPS stream for audit trail, touch session activity and
+    # read the trail's last point for thinning, one round trip for the batch
+    stream_key = f"gps:{session_id}:stream"
+    pipe = redis.pipeline(transaction=False)
+    for p, point in zip(points, h3_points):
+        pipe.xadd(stream_key, _stream_fields(p, point), maxlen=GPS_STREAM_MAXLEN, approximate=True)
+    trail_processor.queue_tail_read(pipe, session_id)
+    if session_manager:
+        session_manager.queue_activity_touch(pipe, session_id)
+    res = await pipe.execute()
+    msgids, tail_raw = res[:len(points)], res[len(points)]
+    
+    result = await thin_and_process(trail_processor, point_thinner, user_id, session_id, h3_points, tail_raw, city)
+    for event in result["events"]:
+        event["stream_id"] = msgids[event["index"]]
+    result["stream_ids"] = msgids
+    return result
+
+
+@gps_router.post("/ingest/batch")
+async def gps_ingest_batch(points: List[PointIn], authorization: str = Header(default="")) -> Dict[str, Any]:
+    """Ingest an ordered batch of buffered points for one session"""
+    user_id = await get_user_id(authorization)
+    from main import redis, trail_processor
+    if not redis or not trail_processor:
+        raise HTTPException(500, "Redis or TrailProcessor not configured")
+    if not points:
+        raise HTTPException(400, "Empty batch")
+    if len(points) > GPS_BATCH_MAX_POINTS:
+        raise HTTPException(400, f"Batch exceeds {GPS_BATCH_MAX_POINTS} points")
+    session_id = points[0].session_id
+    if any(p.session_id != session_id for p in points):
+        raise HTTPException(400, "All points in a batch must belong to one session")
+    
+    try:
+        return await _ingest_points(user_id, session_id, points, defer=GPS_ASYNC_INGEST)
+    except Exception as e:
+        raise HTTPException(500, f"Processing error: {e}")
+
+
+def _decode_frame(message: Dict[str, Any], session_id: str) -> Tuple[Optional[int], List[PointIn]]:
+    """Parse one WebSocket frame into (client seq, points).
+
+    A frame is a point, a list of points, or {"seq": n, "points": [...]},
+    as JSON text or msgpack bytes. A point is an object with PointIn fields
+    or a compact [lat, lng, ts_ms] array; session_id comes from the URL.
+    """
+    if message.get("bytes") is not None:
+        if msgpack is None:
+            raise ValueError("msgpack frames are not supported on this server")
+        body = msgpack.unpackb(message["bytes"], raw=False)
+    else:
+        body = json.loads(message.get("text") or "null")
+    seq = None
+    if isinstance(body, dict) and "points" in body:
+        seq = body.get("seq")
+        body = body["points"]
+    if body is None or body == []:
+        raise ValueError("Empty frame")
+    items = body if isinstance(body, list) and body and isinstance(body[0], (dict, list)) else [body]
+    if len(items) > GPS_BATCH_MAX_POINTS:
+        raise ValueError(f"Frame exceeds {GPS_BATCH_MAX_POINTS} points")
+    points = []
+    for item in items:
+        if isinstance(item, list):
+            lat, lng, ts_ms = (item + [None])[:3]
+            ts = datetime.fromtimestamp(ts_ms / 1000, timezone.utc) if ts_ms is not None else None
+            points.append(PointIn(session_id=session_id, lat=lat, lng=lng, ts=ts))
+        elif isinstance(item, dict):
+            points.append(PointIn(**{**item, "session_id": session_id}))
+        else:
+            raise ValueError("Point must be an object or [lat, lng, ts_ms]")
+    return seq, points
+
+
+@gps_router.websocket("/ws/{session_id}")
+async def gps_ws(websocket: WebSocket, session_id: str, token: str = Query(default=""), encoding: str = Query(default="json")) -> None:
+    """Streaming ingest for one session: authenticate once, then send point frames.
+
+    The server replies with {"type": "ack"} per processed batch and
+    {"type": "event"} for each loop closure or cut. Frames that pile up
+    while a batch is processed are coalesced into the next one. When
+    GPS_WS_QUEUE_FRAMES are waiting, the server sends {"type": "backpressure"}
+    and stops reading, so TCP flow control slows the client down.
+    Replies use msgpack when connected with ?encoding=msgpack.
+    """
+    from main import redis, trail_processor
+    try:
+        # Browsers cannot set headers on a WebSocket; accept ?token= too
+        user_id = await get_user_id(websocket.headers.get("authorization") or token)
+    except HTTPException:
+        await websocket.close(code=4401)
+        return
+    if not redis or not trail_processor:
+        await websocket.close(code=1011, reason="Redis or TrailProcessor not configured")
+        return
+    use_msgpack = encoding == "msgpack"
+    if use_msgpack and msgpack is None:
+        await websocket.close(code=1003, reason="msgpack not installed on server")
+        return
+    await websocket.accept()
+    
+    queue: asyncio.Queue = asyncio.Queue(maxsize=GPS_WS_QUEUE_FRAMES)
+    send_lock = asyncio.Lock()
+    closed = object()  # queued by the reader on disconnect
+    
+    async def send(msg: Dict[str, Any]) -> None:
+        try:
+            async with send_lock:
+                if use_msgpack:
+                    await websocket.send_bytes(msgpack.packb(msg, default=str))
+                else:
+                    await websocket.send_text(json.dumps(msg, default=str))
+        except Exception:
+            pass  # client gone; the reader sees the disconnect
+    
+    async def reader() -> None:
+        frames = 0
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                frames += 1
+                try:
+                    seq, points = _decode_frame(message, session_id)
+                except Exception as e:
+                    await send({"type": "error", "seq": frames, "detail": f"Bad frame: {e}"})
+                    continue
+                if queue.full():
+                    await send({"type": "backpressure", "queued": queue.qsize()})
+                await queue.put((seq if seq is not None else frames, points))
+        finally:
+            await queue.put(closed)
+    
+    async def processor() -> None:
+        carry = None
+        while True:
+            item = carry if carry is not None else await queue.get()
+            carry = None
+            if item is closed:
+                return
+            frames = [item]
+            count = len(item[1])
+            # Coalesce whatever queued up while the previous batch was processed
+            while not queue.empty():
+                nxt = queue.get_nowait()
+                if nxt is closed or count + len(nxt[1]) > GPS_BATCH_MAX_POINTS:
+                    carry = nxt
+                    break
+                frames.append(nxt)
+                count += len(nxt[1])
+            await process_frames(frames)
+    
+    async def process_frames(frames: List[Tuple[int, List[PointIn]]]) -> None:
+        points = [p for _, pts in frames for p in pts]
+        seqs = [seq for seq, pts in frames for _ in pts]
+        try:
+            result = await _ingest_points(user_id, session_id, points)
+        except Exception as e:
+            await send({"type": "error", "seq": frames[-1][0], "detail": f"Processing error: {e}"})
+            return
+        for event in result["events"]:
+            await send({"type": "event", "seq": seqs[event["index"]], **event})
+        await send({"type": "ack", "seq": frames[-1][0], "count": result["count"], "thinned": result["thinned"], "trail": result["trail"], "queued": queue.qsize()})
+    
+    await asyncio.gather(reader(), processor())
\ No newline at end of file
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, Header
 from models import ProfileOut, ProfilePatch
-from utils import get_user_id, ensure_profile, ensure_supabase
+from utils import get_user_id, ensure_profile, ensure_supabase, known_profiles
+from services.db import db_execute
 
 
 router = APIRouter(prefix="/profiles", tags=["profiles"])
@@ -12,7 +13,7 @@ async def get_me(authorization: str = Header(default="")) -> ProfileOut:
     await ensure_profile(user_id)
     s = ensure_supabase()
     try:
-        res = s.table("profiles").select("user_id, username, avatar_url, city, wepin_user_id, wepin_address").eq("user_id", user_id).single().execute()
+        res = await db_execute(s.table("profiles").select("user_id, username, avatar_url, city, wepin_user_id, wepin_address").eq("user_id", user_id).single())
         row = res.data or {"user_id": user_id}
     except Exception:
         row = {"user_id": user_id}
@@ -22,14 +23,17 @@ async def get_me(authorization: str = Header(default="")) -> ProfileOut:
 @router.patch("/me", response_model=ProfileOut)
 async def patch_me(body: ProfilePatch, authorization: str = Header(default="")) -> ProfileOut:
     user_id = await get_user_id(authorization)
-    await ensure_profile(user_id)
-    s = ensure_supabase()
     updates = {k: v for k, v in body.model_dump().items() if v is not None}
     if not updates:
         # return current
         return await get_me(authorization)
+    s = ensure_supabase()
     try:
-        s.table("profiles").update(updates).eq("user_id", user_id).execute()
-        return await get_me(authorization)
+        # Upsert creates the row if needed and returns it, so no separate existence check or re-read
+        res = await db_execute(s.table("profiles").upsert({"user_id": user_id, **updates}, on_conflict="user_id"))
+        row = (res.data or [{"user_id": user_id, **updates}])[0]
     except Exception as e:
-        raise HTTPException(400, f"DB error: {e}")
\ No newline at end of file
+        raise HTTPException(400, f"DB error: {e}")
+    from main import redis
+    await known_profiles.mark(user_id, redis)
+    return ProfileOut(**row)
\ No newline at end of file
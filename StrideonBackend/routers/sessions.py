@@ -3,6 +3,7 @@ from typing import List
 from fastapi import APIRouter, HTTPException, Header, Path
 from models import SessionCreate, SessionOut, SessionEndOut
 from utils import get_user_id, ensure_profile, ensure_supabase
+from services.db import db_execute
 
 
 router = APIRouter(prefix="/sessions", tags=["sessions"])
@@ -15,7 +16,7 @@ async def create_session(body: SessionCreate, authorization: str = Header(defaul
     s = ensure_supabase()
     payload = {"user_id": user_id, "city": body.city}
     try:
-        res = s.table("sessions").insert(payload).execute()
+        res = await db_execute(s.table("sessions").insert(payload))
         row = (res.data or [])[0]
         
         # Create enhanced session state in Redis
@@ -35,7 +36,7 @@ async def list_sessions(authorization: str = Header(default="")) -> List[Session
     user_id = await get_user_id(authorization)
     s = ensure_supabase()
     try:
-        res = s.table("sessions").select("id,user_id,city,started_at,ended_at,status").eq("user_id", user_id).order("started_at", desc=True).limit(50).execute()
+        res = await db_execute(s.table("sessions").select("id,user_id,city,started_at,ended_at,status").eq("user_id", user_id).order("started_at", desc=True).limit(50))
         rows = res.data or []
     except Exception as e:
         raise HTTPException(400, f"DB error: {e}")
@@ -49,13 +50,15 @@ async def end_session(session_id: str = Path(...), authorization: str = Header(d
     ended_at = datetime.now(timezone.utc).isoformat()
     try:
         # enforce ownership in app layer
-        own = s.table("sessions").select("id,user_id").eq("id", session_id).single().execute().data
+        own = (await db_execute(s.table("sessions").select("id,user_id").eq("id", session_id).single())).data
         if not own or own.get("user_id") != user_id:
             raise HTTPException(404, "Session not found")
-        s.table("sessions").update({"ended_at": ended_at, "status": "ended"}).eq("id", session_id).execute()
+        await db_execute(s.table("sessions").update({"ended_at": ended_at, "status": "ended"}).eq("id", session_id))
         
         # Clean up Redis session state
-        from main import session_manager
+        from main import session_manager, trail_processor
+        if trail_processor:
+            await trail_processor.flush_trail(session_id, evict=True)
         if session_manager:
             await session_manager.end_session(session_id)
             
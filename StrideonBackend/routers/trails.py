@@ -1,7 +1,9 @@
 from typing import Dict, Any, List, Optional
-from fastapi import APIRouter, HTTPException, Header, Path, Query
+from fastapi import APIRouter, HTTPException, Header, Path, Query, Response
 from models import TrailStateOut, SessionStateOut
 from utils import get_user_id
+from services.trail import cut_event_key, user_cuts_key
+from services.geo import zoom_to_tolerance_m
 
 
 router = APIRouter(prefix="/trails", tags=["trails"])
@@ -26,7 +28,7 @@ async def get_trail_state(session_id: str = Path(...), authorization: str = Head
         session_id=trail_state.session_id,
         user_id=trail_state.user_id,
         status=trail_state.status,
-        points_count=len(trail_state.points),
+        points_count=trail_state.points_count,
         h3_cells_count=len(trail_state.h3_cells),
         total_length_m=trail_state.total_length_m,
         last_updated=trail_state.last_updated.isoformat(),
@@ -35,25 +37,41 @@ async def get_trail_state(session_id: str = Path(...), authorization: str = Head
 
 
 @router.get("/{session_id}/cells")
-async def get_trail_cells(session_id: str = Path(...), authorization: str = Header(default="")) -> Dict[str, Any]:
+async def get_trail_cells(
+    session_id: str = Path(...),
+    authorization: str = Header(default=""),
+    tolerance_m: Optional[float] = Query(None, ge=0, le=5000, description="Outline simplification tolerance in meters"),
+    zoom: Optional[int] = Query(None, ge=0, le=22, description="Map zoom; simplifies to about one pixel"),
+    include_cells: bool = Query(True),
+) -> Dict[str, Any]:
     user_id = await get_user_id(authorization)
     from main import trail_processor
     if not trail_processor:
         raise HTTPException(500, "TrailProcessor not configured")
     
-    trail_state = await trail_processor.get_trail_state(session_id)
-    if not trail_state or trail_state.user_id != user_id:
+    if tolerance_m is None:
+        tolerance_m = zoom_to_tolerance_m(zoom) if zoom is not None else 0.0
+    # Coarse steps keep the per-version cache small across clients
+    tolerance_m = round(tolerance_m, 1)
+    
+    trail = await trail_processor.get_trail_outline(session_id, tolerance_m)
+    if not trail or trail["user_id"] != user_id:
         raise HTTPException(404, "Trail not found")
     
-    # Convert H3 cells to polygon for visualization
-    polygon_coords = trail_processor.geo_processor.cells_to_polygon(trail_state.h3_cells)
+    # Outline as GeoJSON MultiPolygon ([lng, lat], closed rings, holes after each outer ring)
+    outline = trail["outline"]
+    outer_rings = [polygon[0] for polygon in outline["coordinates"]]
+    largest = max(outer_rings, key=len) if outer_rings else []
     
     return {
         "session_id": session_id,
-        "h3_cells": list(trail_state.h3_cells),
-        "polygon_coords": polygon_coords,
-        "status": trail_state.status,
-        "area_m2": trail_processor.geo_processor.calculate_area_m2(trail_state.h3_cells)
+        "h3_cells": trail["h3_cells"] if include_cells else [],
+        "outline": outline,
+        "tolerance_m": tolerance_m,
+        # Outer ring of the largest polygon as (lat, lng), kept for older clients
+        "polygon_coords": [(lat, lng) for lng, lat in largest],
+        "status": trail["status"],
+        "area_m2": trail["area_m2"]
     }
 
 
@@ -93,40 +111,50 @@ cuts_router = APIRouter(prefix="/cuts", tags=["cuts"])
 
 
 @cuts_router.get("/mine")
-async def get_my_cuts(authorization: str = Header(default=""), limit: int = Query(50, ge=1, le=100)) -> List[Dict[str, Any]]:
+async def get_my_cuts(
+    response: Response,
+    authorization: str = Header(default=""),
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+) -> List[Dict[str, Any]]:
+    """Newest cuts first; when more remain, the next page's cursor is in the X-Next-Cursor header"""
     user_id = await get_user_id(authorization)
     from main import redis
     if not redis:
         raise HTTPException(500, "Redis not configured")
+    if cursor is not None and not cursor.isdigit():
+        raise HTTPException(400, "Invalid cursor")
     
     try:
-        # Get recent cuts for user
-        cut_ids = await redis.lrange(f"cuts:user:{user_id}", 0, limit - 1)
-        if not cut_ids:
+        # Page of cut IDs strictly older than the cursor
+        max_score = f"({cursor}" if cursor else "+inf"
+        page = await redis.zrevrangebyscore(
+            user_cuts_key(user_id), max_score, "-inf", start=0, num=limit, withscores=True
+        )
+        if not page:
             return []
         
-        # Fetch cut details from the events stream
+        # Fetch cut details by ID, one round trip
+        pipe = redis.pipeline(transaction=False)
+        for cut_id, _ in page:
+            pipe.hgetall(cut_event_key(cut_id))
+        rows = await pipe.execute()
+        
         cuts = []
-        for cut_id in cut_ids:
-            # Search for the cut event in the stream
-            cut_stream = "cuts:events:stream"
-            try:
-                # Get recent entries from stream
-                entries = await redis.xrevrange(cut_stream, count=1000)
-                for entry_id, fields in entries:
-                    if fields.get("cut_id") == cut_id:
-                        cuts.append({
-                            "cut_id": cut_id,
-                            "attacker_id": fields.get("attacker_id"),
-                            "victim_id": fields.get("victim_id"),
-                            "session_id": fields.get("session_id"),
-                            "cut_location": fields.get("cut_location"),
-                            "occurred_at": fields.get("occurred_at"),
-                            "role": "attacker" if fields.get("attacker_id") == user_id else "victim"
-                        })
-                        break
-            except Exception:
+        for fields in rows:
+            if not fields:
                 continue
+            cuts.append({
+                "cut_id": fields.get("cut_id"),
+                "attacker_id": fields.get("attacker_id"),
+                "victim_id": fields.get("victim_id"),
+                "session_id": fields.get("session_id"),
+                "cut_location": fields.get("cut_location"),
+                "occurred_at": fields.get("occurred_at"),
+                "role": "attacker" if fields.get("attacker_id") == user_id else "victim"
+            })
+        if len(page) == limit:
+            response.headers["X-Next-Cursor"] = str(int(page[-1][1]))
         
         return cuts
         
@@ -1,6 +1,7 @@
 from typing import List, Dict, Any
 import os
 from fastapi import APIRouter, HTTPException, Query, Path
+from services.chain_reader import ChainReader
 
 try:
     from web3 import Web3
@@ -17,6 +18,10 @@ VERY_CONTRACT_ADDR = os.environ.get(
     "VERY_CONTRACT_ADDR",
     "0x9fE46736679d2D9a65F0992F2272dE9f3c7fa6e0",
 )
+# Latest-block poll interval (0 disables the poller; blocks are then fetched on demand)
+VERY_BLOCK_POLL_SEC = float(os.environ.get("VERY_BLOCK_POLL_SEC", "2.0"))
+VERY_CALL_CACHE_SIZE = int(os.environ.get("VERY_CALL_CACHE_SIZE", "10000"))
+VERY_SCORES_MAX = 100
 
 # Minimal ABI for read methods to avoid external file dependency
 STRIDEON_SCORES_ABI = [
@@ -41,6 +46,8 @@ STRIDEON_SCORES_ABI = [
 
 _w3 = None
 _contract = None
+# Cached eth_call reads keyed by block; main starts its block poller
+chain = ChainReader(VERY_RPC_URL, VERY_CALL_CACHE_SIZE, block_max_age_sec=max(VERY_BLOCK_POLL_SEC * 2, 1.0))
 
 
 def _ensure_web3():
@@ -48,7 +55,8 @@ def _ensure_web3():
     if Web3 is None:
         raise HTTPException(500, "web3 is not installed on the server")
     if _w3 is None:
-        _w3 = Web3(Web3.HTTPProvider(VERY_RPC_URL))
+        # Used only for ABI encoding/decoding; RPC goes through the shared async client
+        _w3 = Web3()
     if _contract is None:
         try:
             _contract = _w3.eth.contract(address=VERY_CONTRACT_ADDR, abi=STRIDEON_SCORES_ABI)
@@ -57,11 +65,24 @@ def _ensure_web3():
     return _w3, _contract
 
 
+async def _call_many(w3, fns) -> List[tuple]:
+    """eth_call bound contract functions at the latest block (cached, one batch) and decode outputs"""
+    results = await chain.call_many(VERY_CONTRACT_ADDR, [fn._encode_transaction_data() for fn in fns])
+    return [
+        w3.codec.decode([o["type"] for o in fn.abi["outputs"]], bytes.fromhex(result[2:]))
+        for fn, result in zip(fns, results)
+    ]
+
+
+async def _call(w3, fn) -> tuple:
+    return (await _call_many(w3, [fn]))[0]
+
+
 @router.get("/health")
 async def verinet_health() -> Dict[str, Any]:
     try:
         w3, _ = _ensure_web3()
-        latest = w3.eth.block_number
+        latest = await chain.refresh_block()
         return {
             "ok": True,
             "rpc": VERY_RPC_URL,
@@ -79,7 +100,7 @@ async def verinet_health() -> Dict[str, Any]:
 async def verinet_leaderboard(count: int = Query(default=10, ge=1, le=100)) -> List[Dict[str, Any]]:
     try:
         w3, contract = _ensure_web3()
-        addrs, scores = contract.functions.getLeaderboard(int(count)).call()
+        addrs, scores = await _call(w3, contract.functions.getLeaderboard(int(count)))
         out: List[Dict[str, Any]] = []
         for i, (addr, score) in enumerate(zip(addrs, scores)):
             # web3 returns HexBytes for addresses sometimes; normalize to checksum
@@ -108,9 +129,31 @@ async def verinet_score(address: str = Path(..., description="EVM address")) ->
             addr = w3.to_checksum_address(address)
         except Exception:
             raise HTTPException(400, "Invalid address format")
-        score = contract.functions.getPlayerScore(addr).call()
+        (score,) = await _call(w3, contract.functions.getPlayerScore(addr))
         return {"address": addr, "score": int(score)}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(500, f"Failed to read score: {e}")
+
+
+@router.get("/scores")
+async def verinet_scores(addresses: str = Query(..., description="Comma-separated EVM addresses")) -> List[Dict[str, Any]]:
+    """Scores for many addresses in one batched RPC round trip"""
+    try:
+        w3, contract = _ensure_web3()
+        raw = [a.strip() for a in addresses.split(",") if a.strip()]
+        if not raw:
+            raise HTTPException(400, "No addresses given")
+        if len(raw) > VERY_SCORES_MAX:
+            raise HTTPException(400, f"At most {VERY_SCORES_MAX} addresses per request")
+        try:
+            addrs = [w3.to_checksum_address(a) for a in raw]
+        except Exception:
+            raise HTTPException(400, "Invalid address format")
+        results = await _call_many(w3, [contract.functions.getPlayerScore(a) for a in addrs])
+        return [{"address": a, "score": int(score)} for a, (score,) in zip(addrs, results)]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, f"Failed to read scores: {e}")
\ No newline at end of file
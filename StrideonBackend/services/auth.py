@@ -0,0 +1,169 @@
+import base64
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from config import (
+    SUPABASE_URL, SUPABASE_ANON_KEY, SUPABASE_JWT_SECRET, SUPABASE_JWKS_URL,
+    JWT_AUDIENCE, AUTH_TOKEN_CACHE_SIZE, AUTH_JWKS_TTL_SEC,
+)
+from services.http_client import get_http_client
+
+try:
+    import jwt
+except Exception:  # pragma: no cover
+    jwt = None  # type: ignore
+
+# Algorithms a JWKS key may use when the JWK does not name its own `alg`
+JWKS_DEFAULT_ALGORITHMS = ["RS256", "ES256"]
+
+
+class TokenVerifier:
+    """Resolves Supabase JWTs to user IDs, locally when possible.
+
+    HS256 tokens are checked against SUPABASE_JWT_SECRET and RS256/ES256
+    tokens against the project's JWKS (fetched and cached); any other
+    algorithm is rejected outright. The remote `/auth/v1/user` call is used
+    only when no local key applies. Verified tokens are cached until their
+    `exp`.
+    """
+
+    def __init__(self, max_size: int = AUTH_TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self.tokens: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # sha256(token) -> (user_id, exp)
+        self.jwks: Dict[str, Tuple[Any, List[str]]] = {}  # kid -> (public key, allowed algorithms)
+        self.jwks_fetched_at = 0.0
+        self.hits = 0
+        self.local = 0
+        self.remote = 0
+        self.rejected = 0
+
+    async def verify(self, token: str) -> Optional[str]:
+        """Return the user ID for a valid token, or None"""
+        key = hashlib.sha256(token.encode()).hexdigest()
+        now = time.time()
+        cached = self.tokens.get(key)
+        if cached:
+            if cached[1] > now:
+                self.tokens.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            del self.tokens[key]
+
+        try:
+            verified = await self._verify_locally(token)
+        except Exception:
+            # Signature, expiry or audience check failed; the remote check would fail too
+            self.rejected += 1
+            return None
+        if verified is None:
+            verified = await self._verify_remotely(token)
+        if verified is None:
+            self.rejected += 1
+            return None
+
+        user_id, exp = verified
+        self.tokens[key] = (user_id, exp)
+        while len(self.tokens) > self.max_size:
+            self.tokens.popitem(last=False)
+        return user_id
+
+    async def _verify_locally(self, token: str) -> Optional[Tuple[str, float]]:
+        """Verify signature and expiry; None if no local key applies, raises if invalid"""
+        if jwt is None:
+            return None
+        # The header only picks the key; the allowed algorithms come from our config
+        header = jwt.get_unverified_header(token)
+        alg = header.get("alg", "")
+        if alg == "HS256":
+            if not SUPABASE_JWT_SECRET:
+                return None
+            signing_key: Any = SUPABASE_JWT_SECRET
+            algorithms = ["HS256"]
+        elif alg in JWKS_DEFAULT_ALGORITHMS:
+            entry = await self._jwks_key(header.get("kid"))
+            if entry is None:
+                return None
+            signing_key, algorithms = entry
+        else:
+            raise jwt.InvalidAlgorithmError(f"Algorithm not allowed: {alg!r}")
+
+        claims = jwt.decode(
+            token,
+            signing_key,
+            algorithms=algorithms,
+            audience=JWT_AUDIENCE or None,
+            options={"require": ["exp", "sub"], "verify_aud": bool(JWT_AUDIENCE)},
+        )
+        self.local += 1
+        return claims["sub"], float(claims["exp"])
+
+    async def _jwks_key(self, kid: Optional[str]) -> Optional[Tuple[Any, List[str]]]:
+        """(public key, algorithms) for `kid`, refreshing the JWKS when it is stale or the kid is unknown"""
+        stale = time.monotonic() - self.jwks_fetched_at > AUTH_JWKS_TTL_SEC
+        if kid not in self.jwks or stale:
+            await self._refresh_jwks()
+        return self.jwks.get(kid)
+
+    async def _refresh_jwks(self) -> None:
+        if not SUPABASE_JWKS_URL:
+            return
+        # Never refetch more than once a minute, even for unknown kids
+        if time.monotonic() - self.jwks_fetched_at < 60 and self.jwks_fetched_at:
+            return
+        self.jwks_fetched_at = time.monotonic()
+        try:
+            resp = await get_http_client().get(SUPABASE_JWKS_URL)
+            if resp.status_code != 200:
+                return
+            jwks = {}
+            for data in resp.json().get("keys", []):
+                try:
+                    jwk = jwt.PyJWK.from_dict(data)
+                except Exception:
+                    continue  # key type this PyJWT build cannot use
+                jwks[jwk.key_id] = (jwk.key, [data["alg"]] if data.get("alg") else JWKS_DEFAULT_ALGORITHMS)
+            self.jwks = jwks
+        except Exception:
+            pass
+
+    async def _verify_remotely(self, token: str) -> Optional[Tuple[str, float]]:
+        """Ask Supabase Auth who the token belongs to (fallback)"""
+        if not SUPABASE_URL:
+            return None
+        try:
+            headers = {"Authorization": f"Bearer {token}", "apikey": SUPABASE_ANON_KEY}
+            resp = await get_http_client().get(f"{SUPABASE_URL}/auth/v1/user", headers=headers)
+            if resp.status_code != 200:
+                return None
+            data = resp.json()
+            uid = data.get("id") or (data.get("user") or {}).get("id")
+        except Exception:
+            return None
+        if not uid:
+            return None
+        self.remote += 1
+        # Cache no longer than the token itself lives
+        return uid, _unverified_exp(token) or time.time() + 60
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cached_tokens": len(self.tokens),
+            "max_size": self.max_size,
+            "cache_hits": self.hits,
+            "verified_locally": self.local,
+            "verified_remotely": self.remote,
+            "rejected": self.rejected,
+            "jwks_keys": len(self.jwks),
+        }
+
+
+def _unverified_exp(token: str) -> Optional[float]:
+    """`exp` claim read without verification (the remote check vouched for the token)"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return None
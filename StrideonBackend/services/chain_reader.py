@@ -0,0 +1,162 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from services.http_client import get_http_client
+
+
+class ChainReader:
+    """Block-aware cache for read-only contract calls over JSON-RPC.
+
+    Results of `eth_call` are cached under (to, data, block), so a popular
+    read costs one RPC per block no matter how many requests ask for it.
+    The latest block number comes from a background poller (or is fetched
+    on demand when stale); calls are pinned to that block so a cached value
+    always matches its key. Cache misses are sent as one JSON-RPC batch, and
+    concurrent misses for the same key share one in-flight request.
+    """
+
+    def __init__(self, rpc_url: str, cache_size: int = 10000, block_max_age_sec: float = 2.0):
+        self.rpc_url = rpc_url
+        self.cache_size = cache_size
+        self.block_max_age_sec = block_max_age_sec
+        self.cache: "OrderedDict[Tuple[str, str, int], str]" = OrderedDict()
+        self.inflight: Dict[Tuple[str, str, int], asyncio.Future] = {}
+        self.latest_block: Optional[int] = None
+        self.block_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.rpc_requests = 0
+        self.poll_errors = 0
+
+    async def _post(self, payload: Any) -> Any:
+        self.rpc_requests += 1
+        resp = await get_http_client().post(self.rpc_url, json=payload)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def rpc(self, method: str, params: list) -> Any:
+        body = await self._post({"jsonrpc": "2.0", "id": 1, "method": method, "params": params})
+        if body.get("error"):
+            raise RuntimeError(body["error"].get("message", body["error"]))
+        return body["result"]
+
+    async def rpc_batch(self, calls: Sequence[Tuple[str, list]]) -> List[Any]:
+        """Send several calls as one JSON-RPC batch; results in call order"""
+        if len(calls) == 1:
+            return [await self.rpc(*calls[0])]
+        body = await self._post([
+            {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+            for i, (method, params) in enumerate(calls)
+        ])
+        if isinstance(body, dict):  # node rejected the batch as a whole
+            raise RuntimeError((body.get("error") or {}).get("message", body))
+        by_id = {item.get("id"): item for item in body}
+        out = []
+        for i in range(len(calls)):
+            item = by_id.get(i) or {}
+            if "result" not in item:
+                raise RuntimeError((item.get("error") or {}).get("message", "missing batch result"))
+            out.append(item["result"])
+        return out
+
+    async def refresh_block(self) -> int:
+        self.latest_block = int(await self.rpc("eth_blockNumber", []), 16)
+        self.block_at = time.monotonic()
+        return self.latest_block
+
+    async def block(self) -> int:
+        if self.latest_block is not None and time.monotonic() - self.block_at < self.block_max_age_sec:
+            return self.latest_block
+        return await self.refresh_block()
+
+    async def run_poller(self, interval_sec: float) -> None:
+        """Keep `latest_block` fresh so request paths never wait on eth_blockNumber"""
+        failing = False
+        while True:
+            try:
+                await self.refresh_block()
+                failing = False
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.poll_errors += 1
+                if not failing:
+                    print(f"Block poller error ({self.rpc_url}): {e}")
+                failing = True
+            await asyncio.sleep(interval_sec)
+
+    async def call_many(self, to: str, datas: Sequence[str]) -> List[str]:
+        """eth_call `to` with each calldata at the latest block; returns raw hex results"""
+        block = await self.block()
+        keys = [(to, data, block) for data in datas]
+        results: Dict[Tuple[str, str, int], Any] = {}
+        fetch: List[Tuple[str, str, int]] = []
+        waits: List[Tuple[Tuple[str, str, int], asyncio.Future]] = []
+        for key in keys:
+            if key in results:
+                continue
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                results[key] = cached
+            elif key in self.inflight:
+                self.hits += 1
+                waits.append((key, self.inflight[key]))
+                results[key] = None
+            else:
+                self.misses += 1
+                fetch.append(key)
+                results[key] = None
+
+        if fetch:
+            loop = asyncio.get_running_loop()
+            futures = {key: loop.create_future() for key in fetch}
+            self.inflight.update(futures)
+            try:
+                values = await self.rpc_batch([("eth_call", [{"to": to, "data": data}, hex(block)]) for _, data, _ in fetch])
+                if len(values) != len(fetch):
+                    raise RuntimeError(f"eth_call batch returned {len(values)} results for {len(fetch)} calls")
+                for key, value in zip(fetch, values):
+                    if not futures[key].done():
+                        futures[key].set_result(value)
+                    results[key] = value
+                    self._remember(key, value)
+            except BaseException as e:
+                # Includes cancellation: waiters sharing these futures must not hang
+                error = e if isinstance(e, Exception) else RuntimeError("eth_call cancelled")
+                for fut in futures.values():
+                    if not fut.done():
+                        fut.set_exception(error)
+                        fut.exception()  # mark retrieved; waiters still see it
+                raise
+            finally:
+                for key in fetch:
+                    self.inflight.pop(key, None)
+
+        for key, fut in waits:
+            # Shielded: a waiter giving up must not cancel the future other callers share
+            results[key] = await asyncio.shield(fut)
+        return [results[key] for key in keys]
+
+    def _remember(self, key: Tuple[str, str, int], value: str) -> None:
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "rpc_url": self.rpc_url,
+            "latest_block": self.latest_block,
+            "block_age_sec": (time.monotonic() - self.block_at) if self.latest_block is not None else None,
+            "cache_size": len(self.cache),
+            "max_size": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "rpc_requests": self.rpc_requests,
+            "poll_errors": self.poll_errors,
+        }
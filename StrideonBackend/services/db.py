@@ -0,0 +1,69 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+from config import SUPABASE_MAX_CONCURRENCY, SUPABASE_OFFLOAD
+
+
+class DbExecutor:
+    """Runs blocking supabase-py queries off the event loop.
+
+    Queries are built as usual (`s.table(...).select(...)`) and handed to
+    `execute`, which calls `.execute()` on a bounded thread pool. With
+    SUPABASE_OFFLOAD=0 the call runs inline on the loop (the old behaviour),
+    which is useful for comparing loop stall with /metrics/loop.
+    """
+
+    def __init__(self, max_workers: int = SUPABASE_MAX_CONCURRENCY, offload: bool = SUPABASE_OFFLOAD):
+        self.max_workers = max_workers
+        self.offload = offload
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="supabase")
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.total_sec = 0.0
+        self.max_sec = 0.0
+
+    async def execute(self, query: Any) -> Any:
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            if not self.offload:
+                return query.execute()
+            return await asyncio.get_running_loop().run_in_executor(self.pool, query.execute)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            elapsed = time.perf_counter() - started
+            self.total_sec += elapsed
+            self.max_sec = max(self.max_sec, elapsed)
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "offload": self.offload,
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            # Calls beyond the pool size wait for a free thread
+            "queued": max(0, self.in_flight - self.max_workers) if self.offload else 0,
+            "max_in_flight": self.max_in_flight,
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": (self.total_sec / self.calls * 1000) if self.calls else 0.0,
+            "max_ms": self.max_sec * 1000,
+        }
+
+
+db = DbExecutor()
+
+
+async def db_execute(query: Any) -> Any:
+    """`await db_execute(s.table("x").select("*"))` instead of `.execute()`"""
+    return await db.execute(query)
@@ -0,0 +1,122 @@
+import asyncio
+import json
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Set
+from config import EVENTS_QUEUE_SIZE
+
+BROADCAST_CHANNEL = "events:broadcast"
+
+
+def user_channel(user_id: str) -> str:
+    return f"events:user:{user_id}"
+
+
+def city_channel(city: str) -> str:
+    return f"events:city:{city}"
+
+
+def queue_publish(pipe, channels: Iterable[str], event: Dict[str, Any]) -> None:
+    """Add PUBLISH commands for `event` to a pipeline the caller already executes"""
+    payload = json.dumps(event, default=str)
+    for channel in channels:
+        pipe.publish(channel, payload)
+
+
+class EventHub:
+    """Per-worker fan-out of Redis pub/sub events to connected clients.
+
+    The worker holds one PubSub connection. A channel is SUBSCRIBEd when its
+    first local listener arrives and UNSUBSCRIBEd when the last one leaves,
+    so Redis sends each worker only the channels its own clients watch.
+    Each listener gets a bounded queue; a slow client drops its oldest
+    events rather than stalling the others.
+    """
+
+    def __init__(self, redis_client, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.redis = redis_client
+        self.queue_size = queue_size
+        self.pubsub = None
+        self.listeners: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self.lock = asyncio.Lock()
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    async def start(self) -> None:
+        self.pubsub = self.redis.pubsub()
+        # Always-on channel keeps the connection subscribed while no client is
+        await self.pubsub.subscribe(BROADCAST_CHANNEL)
+
+    async def subscribe(self, channels: List[str]) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        async with self.lock:
+            new = [ch for ch in channels if not self.listeners.get(ch)]
+            for ch in channels:
+                self.listeners[ch].add(queue)
+            if new:
+                await self.pubsub.subscribe(*new)
+        return queue
+
+    async def unsubscribe(self, queue: asyncio.Queue, channels: List[str]) -> None:
+        async with self.lock:
+            idle = []
+            for ch in channels:
+                listeners = self.listeners.get(ch)
+                if listeners is None:
+                    continue
+                listeners.discard(queue)
+                if not listeners:
+                    del self.listeners[ch]
+                    idle.append(ch)
+            if idle:
+                try:
+                    await self.pubsub.unsubscribe(*idle)
+                except Exception:
+                    pass
+
+    async def run(self) -> None:
+        """Read the shared subscription and hand each message to local listeners"""
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Event hub read error: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if not message or message.get("type") != "message":
+                continue
+            self.received += 1
+            channel = message["channel"]
+            targets = set(self.listeners.get(channel, ()))
+            if channel == BROADCAST_CHANNEL:
+                targets = {q for qs in self.listeners.values() for q in qs}
+            if not targets:
+                continue
+            try:
+                event = json.loads(message["data"])
+            except ValueError:
+                continue
+            for queue in targets:
+                if queue.full():
+                    queue.get_nowait()
+                    self.dropped += 1
+                queue.put_nowait(event)
+                self.delivered += 1
+
+    async def close(self) -> None:
+        if self.pubsub is not None:
+            try:
+                await self.pubsub.aclose()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "channels": len(self.listeners),
+            "listeners": len({q for qs in self.listeners.values() for q in qs}),
+            "received": self.received,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
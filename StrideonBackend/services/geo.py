@@ -1,6 +1,203 @@
+import math
+from bisect import bisect_left
+from functools import lru_cache
 import h3
-from typing import Optional, List, Set, Tuple
-from config import H3_RESOLUTION
+from h3.api import basic_int as h3i
+from typing import Optional, List, Sequence, Set, Tuple, Iterable, Any
+from config import H3_RESOLUTION, MAX_LOOP_BBOX_CELLS, GEO_CACHE_SIZE, GEO_AREA_APPROX
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover
+    np = None  # type: ignore
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE_LAT = 111320.0
+# Web Mercator ground resolution at the equator, zoom 0, in m/px
+WEB_MERCATOR_M_PER_PX_Z0 = 156543.03
+# Below this many points the scalar formula beats NumPy's per-call overhead
+PATH_VECTORIZE_MIN_POINTS = 16
+
+# Neighbor offsets of a hexagon in H3 local IJ coordinates
+_IJ_NEIGHBOR_OFFSETS = ((1, 0), (0, 1), (1, 1), (-1, 0), (0, -1), (-1, -1))
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in meters between two points"""
+    lat1, lng1, lat2, lng2 = map(math.radians, [lat1, lng1, lat2, lng2])
+    dlat = lat2 - lat1
+    dlng = lng2 - lng1
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlng/2)**2
+    return 2 * math.asin(math.sqrt(a)) * EARTH_RADIUS_M
+
+
+def path_length_m(lats: Sequence[float], lngs: Sequence[float]) -> float:
+    """Total Haversine length of a path; vectorized with NumPy for long paths.
+
+    Ingest passes only the new segments (last stored point plus the batch),
+    so large uploads take the vectorized path; legacy migrations recompute
+    whole trails with it.
+    """
+    if len(lats) < 2:
+        return 0.0
+    if np is None or len(lats) < PATH_VECTORIZE_MIN_POINTS:
+        return sum(haversine_m(lats[i-1], lngs[i-1], lats[i], lngs[i]) for i in range(1, len(lats)))
+    
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lng = np.radians(np.asarray(lngs, dtype=np.float64))
+    dlat = np.diff(lat)
+    dlng = np.diff(lng)
+    a = np.sin(dlat/2)**2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlng/2)**2
+    return float(np.sum(2 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))) * EARTH_RADIUS_M)
+
+
+# ---------- Integer H3 cells ----------
+# Territory is handled as 64-bit H3 indexes (sorted int64 arrays, packed
+# int64 buffers in Redis); hex strings are produced only at the API edge.
+
+def cell_to_int(cell: Any) -> int:
+    """H3 index as int from hex, decimal string or int"""
+    if isinstance(cell, str):
+        # Decimal int64 indexes are 18-19 digits; hex strings are 15
+        return int(cell) if len(cell) > 16 else h3.str_to_int(cell)
+    return int(cell)
+
+
+def cells_to_ints(cells: Iterable[Any]) -> Any:
+    """Sorted unique int64 cells (NumPy array, or a sorted list without NumPy)"""
+    cells = list(cells)
+    if np is None:
+        return sorted({cell_to_int(c) for c in cells})
+    if cells and all(isinstance(c, str) and len(c) > 16 for c in cells):
+        # Decimal members as stored in Redis parse in C
+        return np.unique(np.array(cells).astype(np.int64))
+    return np.unique(np.fromiter((cell_to_int(c) for c in cells), dtype=np.int64, count=len(cells)))
+
+
+def ints_to_cells(cells: Iterable[Any]) -> List[str]:
+    """Hex strings for the API"""
+    return [h3.int_to_str(int(c)) for c in cells]
+
+
+def cells_contain(sorted_cells: Any, cells: Sequence[int]) -> List[bool]:
+    """Membership of `cells` in a sorted int64 array/list from `cells_to_ints`"""
+    if len(sorted_cells) == 0:
+        return [False] * len(cells)
+    if np is None:
+        out = []
+        for c in cells:
+            i = bisect_left(sorted_cells, c)
+            out.append(i < len(sorted_cells) and sorted_cells[i] == c)
+        return out
+    query = np.asarray(cells, dtype=np.int64)
+    idx = np.minimum(np.searchsorted(sorted_cells, query), len(sorted_cells) - 1)
+    return (sorted_cells[idx] == query).tolist()
+
+
+def pack_cells(cells: Any) -> bytes:
+    """Little-endian int64 buffer of sorted cells"""
+    if np is None:
+        import struct
+        return struct.pack(f"<{len(cells)}q", *cells)
+    return np.asarray(cells, dtype="<i8").tobytes()
+
+
+def unpack_cells(buf: bytes) -> Any:
+    if np is None:
+        import struct
+        return list(struct.unpack(f"<{len(buf) // 8}q", buf))
+    return np.frombuffer(buf, dtype="<i8").astype(np.int64)
+
+
+# ---------- Outlines ----------
+
+def zoom_to_tolerance_m(zoom: int, pixels: float = 1.0) -> float:
+    """Ground distance of `pixels` at a web-map zoom level (equator; smaller toward the poles)"""
+    return WEB_MERCATOR_M_PER_PX_Z0 / (2 ** zoom) * pixels
+
+
+def simplify_ring(ring: Sequence[Tuple[float, float]], tolerance_m: float) -> List[Tuple[float, float]]:
+    """Douglas-Peucker on a closed (lng, lat) ring; keeps it closed with at least 3 vertices"""
+    ring = list(ring)
+    if tolerance_m <= 0 or len(ring) <= 5:
+        return ring
+    # Local equirectangular projection in meters
+    k = math.cos(math.radians(ring[0][1])) * METERS_PER_DEGREE_LAT
+    xy = [(lng * k, lat * METERS_PER_DEGREE_LAT) for lng, lat in ring[:-1]]
+    n = len(xy)
+    
+    def dist2(p, a, b):
+        dx, dy = b[0] - a[0], b[1] - a[1]
+        if dx == 0 and dy == 0:
+            return (p[0] - a[0]) ** 2 + (p[1] - a[1]) ** 2
+        t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / (dx * dx + dy * dy)))
+        return (p[0] - a[0] - t * dx) ** 2 + (p[1] - a[1] - t * dy) ** 2
+    
+    # Split the ring at the vertex farthest from the first one, then simplify both chains
+    far = max(range(n), key=lambda i: (xy[i][0] - xy[0][0]) ** 2 + (xy[i][1] - xy[0][1]) ** 2)
+    keep = {0, far}
+    tol2 = tolerance_m * tolerance_m
+    stack = [(0, far), (far, n)]  # index n is vertex 0 again
+    while stack:
+        lo, hi = stack.pop()
+        a, b = xy[lo % n], xy[hi % n]
+        best, best_d = None, tol2
+        for i in range(lo + 1, hi):
+            d = dist2(xy[i], a, b)
+            if d > best_d:
+                best, best_d = i, d
+        if best is not None:
+            keep.add(best)
+            stack.append((lo, best))
+            stack.append((best, hi))
+    
+    if len(keep) < 3:
+        return ring
+    out = [ring[i] for i in sorted(keep)]
+    out.append(out[0])
+    return out
+
+
+def cells_to_multipolygon(cells: Iterable[Any], tolerance_m: float = 0.0) -> dict:
+    """GeoJSON MultiPolygon outlining a cell set: ordered rings, holes kept, optionally simplified"""
+    cells = [c if isinstance(c, str) else h3.int_to_str(int(c)) for c in cells]
+    if not cells:
+        return {"type": "MultiPolygon", "coordinates": []}
+    geo = h3.h3shape_to_geo(h3.cells_to_h3shape(cells))
+    # A single connected area comes back as a Polygon
+    polygons = [geo["coordinates"]] if geo["type"] == "Polygon" else geo["coordinates"]
+    coordinates = [
+        [[list(pt) for pt in simplify_ring(ring, tolerance_m)] for ring in polygon]
+        for polygon in polygons
+    ]
+    return {"type": "MultiPolygon", "coordinates": coordinates}
+
+
+# ---------- Memoized per-cell primitives ----------
+# Loop and outline areas revisit the same few thousand cells; cell area is a
+# pure function of the cell, so a bounded LRU cache is safe.
+
+@lru_cache(maxsize=GEO_CACHE_SIZE)
+def cell_area_m2(cell: int) -> float:
+    return h3i.cell_area(cell, unit='m^2')
+
+
+@lru_cache(maxsize=16)
+def average_cell_area_m2(resolution: int) -> float:
+    return h3.average_hexagon_area(resolution, unit='m^2')
+
+
+def geo_cache_stats() -> dict:
+    stats = {"area_mode": "approx" if GEO_AREA_APPROX else "exact", "max_size": GEO_CACHE_SIZE}
+    info = cell_area_m2.cache_info()
+    lookups = info.hits + info.misses
+    stats["area"] = {
+        "size": info.currsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": (info.hits / lookups) if lookups else 0.0,
+    }
+    return stats
 
 
 class H3GeoProcessor:
@@ -17,57 +214,143 @@ class H3GeoProcessor:
         """Get neighboring H3 cells"""
         return set(h3.grid_disk(h3_index, 1))
     
-    def cells_to_polygon(self, h3_cells: Set[str]) -> List[Tuple[float, float]]:
-        """Convert H3 cells to polygon boundary"""
-        if not h3_cells:
+    def cells_to_polygon(self, h3_cells: Set[str], tolerance_m: float = 0.0) -> List[Tuple[float, float]]:
+        """Ordered outer ring (lat, lng) of the largest polygon covering the cells"""
+        outline = cells_to_multipolygon(h3_cells, tolerance_m)
+        if not outline["coordinates"]:
             return []
+        outer = max((polygon[0] for polygon in outline["coordinates"]), key=len)
+        return [(lat, lng) for lng, lat in outer]
+    
+    def cells_to_multipolygon(self, h3_cells: Iterable[Any], tolerance_m: float = 0.0) -> dict:
+        return cells_to_multipolygon(h3_cells, tolerance_m)
+    
+    def calculate_area_m2(self, h3_cells: Iterable[Any], approx: bool = GEO_AREA_APPROX) -> float:
+        """Calculate area in square meters for H3 cells (hex strings or ints).
+
+        With `approx`, every cell counts as the average hexagon area of its
+        resolution (within a few percent away from pentagons and the poles).
+        """
+        cells = [cell_to_int(c) for c in h3_cells]
+        if approx:
+            total_area = 0.0
+            for cell in cells:
+                total_area += average_cell_area_m2(h3i.get_resolution(cell))
+            return total_area
+        return sum(cell_area_m2(cell) for cell in cells)
+    
+    def detect_loop_closure(self, trail_cells: List[Any], claimed_territory: Any) -> Optional[Set[int]]:
+        """Detect if an excursion forms a loop with existing territory and return the claimed area.
+
+        `trail_cells` is the ordered path from the last cell inside the
+        territory, out and back in. The loop wall is that path plus the
+        territory; every cell the wall cuts off from the outside is enclosed.
+        `claimed_territory` is a sorted int64 array from `cells_to_ints`.
+        Returns the new cells as ints (path outside the territory plus
+        enclosed cells), or None if the path does not leave and re-enter
+        territory.
+        """
+        if len(trail_cells) < 3:
+            return None
+        trail_cells = [cell_to_int(c) for c in trail_cells]
+        if not all(cells_contain(claimed_territory, [trail_cells[0], trail_cells[-1]])):
+            return None
         
-        # Get boundary cells
-        boundary_cells = set()
-        for cell in h3_cells:
-            neighbors = self.get_h3_neighbors(cell)
-            # Cell is on boundary if it has neighbors not in the set
-            if not neighbors.issubset(h3_cells):
-                boundary_cells.add(cell)
+        path = self._connect_cells(trail_cells)
+        loop_cells = {c for c, inside in zip(path, cells_contain(claimed_territory, path)) if not inside}
+        if not loop_cells:
+            return None
         
-        # Convert to lat/lng coordinates
-        coords = []
-        for cell in boundary_cells:
-            lat, lng = h3.cell_to_latlng(cell)
-            coords.append((lat, lng))
+        enclosed = self._enclosed_cells(path, claimed_territory)
+        if enclosed is None:
+            return None
         
-        return coords
+        claimed = loop_cells | enclosed
+        return claimed if len(claimed) >= 3 else None
     
-    def calculate_area_m2(self, h3_cells: Set[str]) -> float:
-        """Calculate area in square meters for H3 cells"""
-        total_area = 0.0
-        for cell in h3_cells:
-            # Get cell area in square meters
-            cell_area = h3.cell_area(cell, unit='m^2')
-            total_area += cell_area
-        return total_area
+    def _connect_cells(self, cells: List[int]) -> List[int]:
+        """Fill gaps between consecutive cells so the path has no holes"""
+        path = [cells[0]]
+        for cell in cells[1:]:
+            if cell == path[-1]:
+                continue
+            try:
+                path.extend(h3i.grid_path_cells(path[-1], cell)[1:])
+            except Exception:
+                path.append(cell)
+        return path
     
-    def detect_loop_closure(self, trail_cells: List[str], claimed_territory: Set[str]) -> Optional[Set[str]]:
-        """Detect if trail forms a loop with existing territory and return enclosed area"""
+    def loop_lookup_cells(self, trail_cells: List[Any]) -> List[int]:
+        """Cells whose territory membership `detect_loop_closure` reads for this excursion.
+
+        The connected path plus its bounding box, so callers can look up just
+        these (e.g. with SMISMEMBER) instead of loading the whole territory.
+        Empty if the excursion is too short or its box is too large to fill.
+        """
         if len(trail_cells) < 3:
-            return None
+            return []
+        path = self._connect_cells([cell_to_int(c) for c in trail_cells])
+        box = self._loop_box(path)
+        return [] if box is None else path + box[2]
+    
+    def _loop_box(self, path: List[int]) -> Optional[Tuple[Set[Tuple[int, int]], Tuple[int, int, int, int], List[int], List[Tuple[int, int]]]]:
+        """(wall IJs, IJ bounds, box cells, box IJs) for the box around `path`, or None"""
+        origin = path[0]
+        try:
+            wall = {h3i.cell_to_local_ij(origin, cell) for cell in path}
+        except Exception:
+            return None  # path crosses a pentagon or is too far to unfold
         
-        trail_set = set(trail_cells)
+        min_i = min(i for i, _ in wall) - 1
+        max_i = max(i for i, _ in wall) + 1
+        min_j = min(j for _, j in wall) - 1
+        max_j = max(j for _, j in wall) + 1
+        if (max_i - min_i + 1) * (max_j - min_j + 1) > MAX_LOOP_BBOX_CELLS:
+            return None
         
-        # Check if trail intersects with claimed territory
-        intersection = trail_set.intersection(claimed_territory)
-        if not intersection:
+        # Cells inside the box off the path
+        box_ij = []
+        box_cells = []
+        for i in range(min_i, max_i + 1):
+            for j in range(min_j, max_j + 1):
+                if (i, j) in wall:
+                    continue
+                try:
+                    box_cells.append(h3i.local_ij_to_cell(origin, i, j))
+                except Exception:
+                    continue
+                box_ij.append((i, j))
+        return wall, (min_i, max_i, min_j, max_j), box_cells, box_ij
+    
+    def _enclosed_cells(self, path: List[int], claimed_territory: Any) -> Optional[Set[int]]:
+        """Flood fill from outside the path's bounding box; cells not reached are enclosed.
+
+        Works in H3 local IJ coordinates anchored at the first path cell, so
+        the fill is bounded by the loop's bounding box (plus a one-cell ring)
+        rather than by the size of the territory. Territory outside that box
+        is ignored, which can only under-claim, never over-claim.
+        """
+        box = self._loop_box(path)
+        if box is None:
             return None
+        _, (min_i, max_i, min_j, max_j), box_cells, box_ij = box
         
-        # Find enclosed area using flood fill from trail boundary
-        # This is a simplified version - in production would use proper polygon algorithms
-        all_cells = trail_set.union(claimed_territory)
-        enclosed_cells = set()
+        # Territory cells join the wall; one vectorized lookup for the whole box
+        open_cells = {
+            ij: cell
+            for ij, cell, owned in zip(box_ij, box_cells, cells_contain(claimed_territory, box_cells))
+            if not owned
+        }
         
-        # For MVP, consider the trail itself as the claimed area
-        # In production, implement proper flood-fill algorithm
-        for cell in trail_set:
-            neighbors = self.get_h3_neighbors(cell)
-            enclosed_cells.update(neighbors.intersection(all_cells))
+        # Flood from the outer ring
+        stack = [ij for ij in open_cells if ij[0] in (min_i, max_i) or ij[1] in (min_j, max_j)]
+        outside = set(stack)
+        while stack:
+            i, j = stack.pop()
+            for di, dj in _IJ_NEIGHBOR_OFFSETS:
+                nxt = (i + di, j + dj)
+                if nxt in open_cells and nxt not in outside:
+                    outside.add(nxt)
+                    stack.append(nxt)
         
-        return enclosed_cells if len(enclosed_cells) >= 3 else None
\ No newline at end of file
+        return {cell for ij, cell in open_cells.items() if ij not in outside}
\ No newline at end of file
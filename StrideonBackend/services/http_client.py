@@ -0,0 +1,113 @@
+from typing import Optional, Dict, Any
+import httpx
+from config import (
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY_SEC,
+    HTTP_CONNECT_TIMEOUT_SEC, HTTP_TIMEOUT_SEC, HTTP_POOL_TIMEOUT_SEC, HTTP_HTTP2,
+)
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+except Exception:  # pragma: no cover
+    h2 = None  # type: ignore
+
+
+class PooledHttpClient:
+    """App-scoped httpx.AsyncClient with connection-pool accounting.
+
+    Counters come from `request` itself and httpcore's public trace
+    extension, not from the transport's private pool state.
+
+    Created in main.on_startup and closed in on_shutdown; every outbound call
+    (Supabase Auth, JWKS, Very Network RPC) goes through `request`.
+    """
+
+    def __init__(self):
+        self.http2 = bool(HTTP_HTTP2 and h2 is not None)
+        self.client = httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SEC,
+            ),
+            timeout=httpx.Timeout(HTTP_TIMEOUT_SEC, connect=HTTP_CONNECT_TIMEOUT_SEC, pool=HTTP_POOL_TIMEOUT_SEC),
+        )
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.requests = 0
+        self.new_connections = 0
+        self.errors = 0
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        waiting = True  # until httpcore starts sending on a connection
+
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            nonlocal waiting
+            # httpcore emits connect_tcp only when it opens a socket; reused connections skip it
+            if event_name == "connection.connect_tcp.complete":
+                self.new_connections += 1
+            elif waiting and event_name.endswith(".send_request_headers.started"):
+                waiting = False
+                self.waiting -= 1
+
+        extensions["trace"] = trace
+        self.in_flight += 1
+        self.waiting += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        self.requests += 1
+        try:
+            return await self.client.request(method, url, extensions=extensions, **kwargs)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            if waiting:
+                self.waiting -= 1
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2": self.http2,
+            "max_connections": HTTP_MAX_CONNECTIONS,
+            "max_keepalive": HTTP_MAX_KEEPALIVE,
+            "requests_in_flight": self.in_flight,
+            "requests_waiting": self.waiting,  # queued for a pooled connection
+            "max_in_flight": self.max_in_flight,
+            "max_waiting": self.max_waiting,
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reuse_ratio": (1 - self.new_connections / self.requests) if self.requests else 0.0,
+            "errors": self.errors,
+        }
+
+
+# Set by main.on_startup; None outside the app (scripts, tests)
+http_client: Optional[PooledHttpClient] = None
+
+
+def get_http_client() -> PooledHttpClient:
+    """Shared client, created lazily if the app lifecycle has not run"""
+    global http_client
+    if http_client is None:
+        http_client = PooledHttpClient()
+    return http_client
+
+
+async def close_http_client() -> None:
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
@@ -0,0 +1,122 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from services.db import db_execute
+from config import LEADERBOARD_TTL_SEC
+
+SNAPSHOT_CHUNK = 500
+
+
+def leaderboard_key(day: str, city: Optional[str] = None) -> str:
+    """Sorted set of user_id -> banked score for one UTC day, optionally one city"""
+    key = f"lb:daily:{day}"
+    return f"{key}:city:{city}" if city else key
+
+
+def today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+class Leaderboard:
+    """Daily leaderboards kept incrementally in Redis sorted sets.
+
+    `record` runs on every bank; reads (top N, rank and neighbors) never
+    touch Postgres. The global board of each changed day is periodically
+    snapshotted into `leaderboard_daily` (the table has no city column, so
+    city boards live in Redis only).
+    """
+
+    dirty_key = "lb:dirty_days"
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self.snapshots = 0
+        self.snapshot_rows = 0
+        self.snapshot_failures = 0
+        self.last_snapshot_at: Optional[str] = None
+
+    async def record(self, user_id: str, score: int, city: Optional[str] = None, day: Optional[str] = None) -> None:
+        day = day or today()
+        pipe = self.redis.pipeline(transaction=False)
+        for key in filter(None, (leaderboard_key(day), city and leaderboard_key(day, city))):
+            pipe.zincrby(key, score, user_id)
+            pipe.expire(key, LEADERBOARD_TTL_SEC)
+        pipe.sadd(self.dirty_key, day)
+        await pipe.execute()
+
+    async def top(self, day: str, city: Optional[str] = None, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        rows = await self.redis.zrevrange(leaderboard_key(day, city), offset, offset + limit - 1, withscores=True)
+        return self._rows(rows, day, city, offset)
+
+    async def around(self, user_id: str, day: str, city: Optional[str] = None, radius: int = 5) -> Dict[str, Any]:
+        """The user's rank with `radius` entries above and below"""
+        key = leaderboard_key(day, city)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrevrank(key, user_id)
+        pipe.zscore(key, user_id)
+        pipe.zcard(key)
+        rank, score, total = await pipe.execute()
+        if rank is None:
+            return {"day": day, "city": city, "user_id": user_id, "rank": None, "score": 0, "total": total, "neighbors": []}
+        start = max(0, rank - radius)
+        rows = await self.redis.zrevrange(key, start, rank + radius, withscores=True)
+        return {
+            "day": day,
+            "city": city,
+            "user_id": user_id,
+            "rank": rank + 1,
+            "score": int(score),
+            "total": total,
+            "neighbors": self._rows(rows, day, city, start),
+        }
+
+    @staticmethod
+    def _rows(rows, day: str, city: Optional[str], offset: int) -> List[Dict[str, Any]]:
+        return [
+            {"day": day, "city": city, "user_id": uid, "score": int(score), "rank": offset + i + 1}
+            for i, (uid, score) in enumerate(rows)
+        ]
+
+    async def snapshot(self, day: str) -> int:
+        """Upsert the day's global board into leaderboard_daily; returns rows written"""
+        from utils import ensure_supabase
+        rows = await self.redis.zrevrange(leaderboard_key(day), 0, -1, withscores=True)
+        rows = self._rows(rows, day, None, 0)
+        s = ensure_supabase()
+        for i in range(0, len(rows), SNAPSHOT_CHUNK):
+            chunk = [
+                {"day": r["day"], "user_id": r["user_id"], "score": r["score"], "rank": r["rank"]}
+                for r in rows[i:i + SNAPSHOT_CHUNK]
+            ]
+            await db_execute(s.table("leaderboard_daily").upsert(chunk, on_conflict="day,user_id"))
+        self.snapshots += 1
+        self.snapshot_rows += len(rows)
+        self.last_snapshot_at = datetime.now(timezone.utc).isoformat()
+        return len(rows)
+
+    async def snapshot_dirty(self) -> None:
+        """Snapshot every day banked into since the last run"""
+        days = await self.redis.spop(self.dirty_key, 100) or []
+        for day in days:
+            try:
+                await self.snapshot(day)
+            except Exception as e:
+                self.snapshot_failures += 1
+                await self.redis.sadd(self.dirty_key, day)  # retry next round
+                print(f"Leaderboard snapshot for {day} failed: {e}")
+
+    async def run_snapshots(self, interval_sec: float) -> None:
+        while True:
+            await asyncio.sleep(interval_sec)
+            try:
+                await self.snapshot_dirty()
+            except Exception as e:
+                print(f"Leaderboard snapshot error: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "snapshots": self.snapshots,
+            "snapshot_rows": self.snapshot_rows,
+            "snapshot_failures": self.snapshot_failures,
+            "last_snapshot_at": self.last_snapshot_at,
+        }
@@ -0,0 +1,49 @@
+import asyncio
+import time
+from typing import Any, Dict
+
+
+class LoopLagMonitor:
+    """Measures event-loop stall: how late a periodic sleep wakes up.
+
+    Any blocking call on the loop (sync DB client, CPU-heavy geometry) shows
+    up as lag. Stall time is the lag summed over ticks above `threshold_ms`.
+    """
+
+    def __init__(self, interval_sec: float = 0.1, threshold_ms: float = 20.0):
+        self.interval_sec = interval_sec
+        self.threshold_ms = threshold_ms
+        self.started_at = time.monotonic()
+        self.ticks = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.stalls = 0
+        self.stall_ms = 0.0
+
+    async def run(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval_sec
+            await asyncio.sleep(self.interval_sec)
+            lag_ms = max(0.0, (time.perf_counter() - expected) * 1000)
+            self.ticks += 1
+            self.last_lag_ms = lag_ms
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            if lag_ms >= self.threshold_ms:
+                self.stalls += 1
+                self.stall_ms += lag_ms
+
+    def reset(self) -> None:
+        self.__init__(self.interval_sec, self.threshold_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        uptime = time.monotonic() - self.started_at
+        return {
+            "interval_ms": self.interval_sec * 1000,
+            "threshold_ms": self.threshold_ms,
+            "ticks": self.ticks,
+            "last_lag_ms": self.last_lag_ms,
+            "max_lag_ms": self.max_lag_ms,
+            "stalls": self.stalls,
+            "stall_ms": self.stall_ms,
+            "stall_ratio": (self.stall_ms / 1000 / uptime) if uptime else 0.0,
+        }
@@ -0,0 +1,94 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from models import H3Point
+from services.geo import haversine_m
+from config import GPS_THIN_MIN_DISTANCE_M, GPS_THIN_MIN_INTERVAL_SEC
+
+
+def _seconds_between(a: datetime, b: datetime) -> float:
+    # Client timestamps may be naive; stored ones are UTC
+    if a.tzinfo is None:
+        a = a.replace(tzinfo=timezone.utc)
+    if b.tzinfo is None:
+        b = b.replace(tzinfo=timezone.utc)
+    return (b - a).total_seconds()
+
+
+class PointThinner:
+    """Drops GPS pings that add nothing to the trail before trail processing.
+
+    A point is dropped only when it stays in the H3 cell of the last kept
+    point and either moved less than `min_distance_m` or arrived less than
+    `min_interval_sec` after it. Cell changes are always kept, so loop and
+    cut detection (which work on cells) see the same transitions. Raw points
+    still go to the audit stream; this only skips trail work.
+    """
+
+    def __init__(self, min_distance_m: float = GPS_THIN_MIN_DISTANCE_M, min_interval_sec: float = GPS_THIN_MIN_INTERVAL_SEC):
+        self.min_distance_m = min_distance_m
+        self.min_interval_sec = min_interval_sec
+        self.received = 0
+        self.kept = 0
+        self.dropped_distance = 0
+        self.dropped_interval = 0
+        self.skipped_batches = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_distance_m > 0 or self.min_interval_sec > 0
+
+    def thin(self, last: Optional[H3Point], points: List[H3Point]) -> List[int]:
+        """Indexes of `points` to keep, given the trail's last stored point"""
+        self.received += len(points)
+        if not self.enabled:
+            self.kept += len(points)
+            return list(range(len(points)))
+        kept = []
+        for idx, point in enumerate(points):
+            if last is not None and point.h3_index == last.h3_index:
+                if self.min_distance_m > 0 and haversine_m(last.lat, last.lng, point.lat, point.lng) < self.min_distance_m:
+                    self.dropped_distance += 1
+                    continue
+                if self.min_interval_sec > 0 and _seconds_between(last.timestamp, point.timestamp) < self.min_interval_sec:
+                    self.dropped_interval += 1
+                    continue
+            kept.append(idx)
+            last = point
+        self.kept += len(kept)
+        if not kept:
+            self.skipped_batches += 1
+        return kept
+
+    def stats(self) -> Dict[str, Any]:
+        dropped = self.dropped_distance + self.dropped_interval
+        return {
+            "min_distance_m": self.min_distance_m,
+            "min_interval_sec": self.min_interval_sec,
+            "received": self.received,
+            "kept": self.kept,
+            "dropped": dropped,
+            "dropped_distance": self.dropped_distance,
+            "dropped_interval": self.dropped_interval,
+            "skipped_batches": self.skipped_batches,
+            "drop_ratio": (dropped / self.received) if self.received else 0.0,
+        }
+
+
+async def thin_and_process(trail_processor, thinner: PointThinner, user_id: str, session_id: str, points: List[H3Point], tail_raw: List[Optional[str]], city: Optional[str]) -> Dict[str, Any]:
+    """Thin `points` against the trail's last point and run trail processing on the rest.
+
+    `tail_raw` is the result of `TrailProcessor.queue_tail_read`. Event
+    indexes refer to `points`, not to the kept subset.
+    """
+    tail = trail_processor.trail_tail(session_id, tail_raw)
+    kept = thinner.thin(tail[0] if tail else None, points)
+    if kept:
+        result = await trail_processor.add_points_to_trail(session_id, user_id, [points[i] for i in kept], city=city)
+        for event in result["events"]:
+            event["index"] = kept[event["index"]]
+    else:
+        # Nothing new for the trail; report it as stored
+        result = {"ok": True, "events": [], "trail": tail[1]}
+    result["count"] = len(points)
+    result["thinned"] = len(points) - len(kept)
+    return result
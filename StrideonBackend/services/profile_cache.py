@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+from config import PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL_SEC
+
+
+class KnownProfileCache:
+    """Positive cache of user IDs whose `profiles` row is known to exist.
+
+    Profiles are never deleted by the app, so a hit needs no invalidation;
+    the TTL only bounds how long a row deleted out of band goes unnoticed.
+    In-process LRU first, then an optional Redis tier shared by workers.
+    """
+
+    def __init__(self, max_size: int = PROFILE_CACHE_SIZE, ttl_sec: int = PROFILE_CACHE_TTL_SEC):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self.entries: "OrderedDict[str, float]" = OrderedDict()  # user_id -> expires_at (monotonic)
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"profile:known:{user_id}"
+
+    async def is_known(self, user_id: str, redis=None) -> bool:
+        expires_at = self.entries.get(user_id)
+        if expires_at is not None:
+            if expires_at > time.monotonic():
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return True
+            del self.entries[user_id]
+        if redis is not None:
+            try:
+                if await redis.exists(self._key(user_id)):
+                    self.redis_hits += 1
+                    self._remember(user_id)
+                    return True
+            except Exception:
+                pass
+        self.misses += 1
+        return False
+
+    async def mark(self, user_id: str, redis=None) -> None:
+        self._remember(user_id)
+        if redis is not None:
+            try:
+                await redis.set(self._key(user_id), "1", ex=self.ttl_sec)
+            except Exception:
+                pass
+
+    def _remember(self, user_id: str) -> None:
+        self.entries[user_id] = time.monotonic() + self.ttl_sec
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl_sec": self.ttl_sec,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": ((self.hits + self.redis_hits) / lookups) if lookups else 0.0,
+        }
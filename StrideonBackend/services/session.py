@@ -2,6 +2,8 @@ from datetime import datetime, timezone
 from typing import Optional
 from models import SessionState
 from services.geo import H3GeoProcessor
+from services.trail import trail_keys, queue_index_removal
+from services.trail_worker import work_done_key
 from config import SESSION_TTL_SEC
 
 
@@ -26,9 +28,11 @@ class SessionManager:
             total_area_claimed=0.0
         )
         
-        # Store in Redis
+        # Store in Redis, one transaction for state and user index
         session_key = f"session:{session_id}"
-        await self.redis.hset(session_key, mapping={
+        sessions_key = f"user:{user_id}:sessions"
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(session_key, mapping={
             "user_id": user_id,
             "city": city,
             "status": state.status,
@@ -37,11 +41,10 @@ class SessionManager:
             "trail_count": str(state.trail_count),
             "total_area_claimed": str(state.total_area_claimed)
         })
-        await self.redis.expire(session_key, SESSION_TTL_SEC)
-        
-        # Add to user's active sessions
-        await self.redis.sadd(f"user:{user_id}:sessions", session_id)
-        await self.redis.expire(f"user:{user_id}:sessions", SESSION_TTL_SEC)
+        pipe.expire(session_key, SESSION_TTL_SEC)
+        pipe.sadd(sessions_key, session_id)
+        pipe.expire(sessions_key, SESSION_TTL_SEC)
+        await pipe.execute()
         
         return state
     
@@ -66,24 +69,35 @@ class SessionManager:
     
     async def update_session_activity(self, session_id: str) -> None:
         """Update last activity timestamp"""
+        pipe = self.redis.pipeline(transaction=False)
+        self.queue_activity_touch(pipe, session_id)
+        await pipe.execute()
+    
+    def queue_activity_touch(self, pipe, session_id: str) -> None:
+        """Queue the last-activity update onto a caller's pipeline (e.g. the GPS ingest one)"""
         session_key = f"session:{session_id}"
-        now = datetime.now(timezone.utc).isoformat()
-        await self.redis.hset(session_key, "last_activity", now)
-        await self.redis.expire(session_key, SESSION_TTL_SEC)
+        pipe.hset(session_key, "last_activity", datetime.now(timezone.utc).isoformat())
+        pipe.expire(session_key, SESSION_TTL_SEC)
     
     async def end_session(self, session_id: str) -> None:
         """End session and clean up Redis state"""
         session_key = f"session:{session_id}"
-        trail_key = f"trail:{session_id}"
-        
-        # Update status
-        await self.redis.hset(session_key, "status", "ended")
+        trail_key, _, cells_key, _ = trail_keys(session_id)
         
-        # Clean up trail data
-        await self.redis.delete(trail_key)
-        await self.redis.delete(f"gps:{session_id}:stream")
+        # Read what the cleanup needs in one round trip
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hget(session_key, "user_id")
+        pipe.hget(trail_key, "city")
+        pipe.hkeys(cells_key)
+        user_id, city, cells = await pipe.execute()
         
-        # Remove from user's active sessions
-        state = await self.get_session_state(session_id)
-        if state:
-            await self.redis.srem(f"user:{state.user_id}:sessions", session_id)
\ No newline at end of file
+        # Then mark ended and drop trail, index, stream and user entries atomically
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(session_key, "status", "ended")
+        if cells:
+            queue_index_removal(pipe, session_id, city, cells)
+        # The write lease and worker watermark are kept out of trail_keys, whose TTLs are refreshed on every write
+        pipe.delete(*trail_keys(session_id), f"{trail_key}:owner", work_done_key(session_id), f"gps:{session_id}:stream")
+        if user_id:
+            pipe.srem(f"user:{user_id}:sessions", session_id)
+        await pipe.execute()
@@ -1,260 +1,1010 @@
+import asyncio
+import binascii
 import json
-import math
-from datetime import datetime, timezone
-from typing import Optional, Dict, Any, List, Set
+import struct
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Set, Tuple
+from redis.client import NEVER_DECODE
+from redis.exceptions import WatchError
 from models import H3Point, TrailState
-from services.geo import H3GeoProcessor
-from config import MAX_TRAIL_POINTS, MIN_LOOP_AREA_M2, TRAIL_TTL_SEC
+from services.geo import (
+    H3GeoProcessor, path_length_m,
+    cell_to_int, cells_to_ints, ints_to_cells, cells_contain, pack_cells, unpack_cells,
+)
+from services.trail_cache import CachedTrail, TrailCache
+from services.db import db_execute
+from services.events import queue_publish, user_channel, city_channel
+from config import (
+    MAX_TRAIL_POINTS, MIN_LOOP_AREA_M2, TRAIL_TTL_SEC,
+    TRAIL_CACHE_FLUSH_RETRIES, TRAIL_CACHE_LEASE_SEC, TRAIL_OWNER_POLL_SEC,
+    CUT_EVENT_TTL_SEC, CUTS_PER_USER_MAX, TRAIL_OUTLINE_CACHE_SIZE, TRAIL_POINT_FORMAT, TRAIL_WRITE_RETRIES,
+)
+
+
+def trail_keys(session_id: str) -> List[str]:
+    """All Redis keys that make up one trail"""
+    trail_key = f"trail:{session_id}"
+    return [trail_key, f"{trail_key}:points", f"{trail_key}:cells", f"{trail_key}:territory"]
+
+
+# Value of the `territory_format` meta field once trail:{sid}:territory holds int64 members
+TERRITORY_FORMAT = "i64"
+
+# Members per SMISMEMBER when checking a loop's bounding box against the territory
+TERRITORY_LOOKUP_CHUNK = 5000
+
+# Stored point format, tagged by its first character. "1": base64 of
+# little-endian (lat, lng as int32 1e-7 degrees, unix ms int64 truncated
+# from microseconds, H3 int64);
+# "{": the legacy JSON object. Every list element stays independently
+# decodable so tail reads (LRANGE) and trims (LPOP) need no context.
+POINT_FORMAT_V1 = "1"
+POINT_STRUCT_V1 = struct.Struct("<iiqq")
+COORD_SCALE = 10_000_000
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def trail_cell_index_key(city: str, h3_index: str) -> str:
+    """Set of active trail session IDs that occupy `h3_index` in `city`"""
+    return f"trails:city:{city}:cell:{h3_index}"
+
+
+def cut_event_key(cut_id: str) -> str:
+    """Hash holding one cut event, readable by ID"""
+    return f"cut:{cut_id}"
+
+
+def user_cuts_key(user_id: str) -> str:
+    """Sorted set of a user's cut IDs (as attacker or victim), scored by microsecond timestamp"""
+    return f"cuts:by_user:{user_id}"
+
+
+async def remove_trail_from_index(redis, session_id: str) -> None:
+    """Drop every cell of a trail from the cell -> active trail index"""
+    trail_key = f"trail:{session_id}"
+    pipe = redis.pipeline(transaction=False)
+    pipe.hget(trail_key, "city")
+    pipe.hkeys(f"{trail_key}:cells")
+    city, cells = await pipe.execute()
+    if not cells:
+        return
+    
+    pipe = redis.pipeline(transaction=False)
+    queue_index_removal(pipe, session_id, city, cells)
+    await pipe.execute()
+
+
+def queue_index_removal(pipe, session_id: str, city: Optional[str], cells) -> None:
+    """Queue SREMs of a trail's cells from the index onto `pipe`"""
+    for cell in cells:
+        pipe.srem(trail_cell_index_key(city or "unknown", cell), session_id)
+
+
+def _as_utc(ts: datetime) -> datetime:
+    # Client timestamps may be naive; decoded ones are UTC
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
 
 
 class TrailProcessor:
     """Processes trails, detects loops and cuts"""
     
-    def __init__(self, redis_client):
+    def __init__(self, redis_client, cache: Optional[TrailCache] = None):
         self.redis = redis_client
         self.geo_processor = H3GeoProcessor()
+        self.cache = cache
+        self.worker_id = uuid.uuid4().hex  # owner of buffered trail writes
+        # (session_id, version, tolerance_m) -> outline; a new version makes old entries unreachable
+        self.outline_cache: "OrderedDict[Tuple[str, int, float], Dict[str, Any]]" = OrderedDict()
+        # session_id -> calls waiting while that session's trail is being updated
+        self.session_queues: Dict[str, List[Tuple[str, List[H3Point], Optional[str], asyncio.Future]]] = {}
+        self.coalesced_calls = 0
+        self.write_conflicts = 0
     
-    async def add_point_to_trail(self, session_id: str, user_id: str, point: H3Point) -> Dict[str, Any]:
+    async def add_point_to_trail(self, session_id: str, user_id: str, point: H3Point, city: Optional[str] = None) -> Dict[str, Any]:
         """Add point to active trail and check for events"""
+        batch = await self.add_points_to_trail(session_id, user_id, [point], city=city)
+        return self.point_result(point, batch)
+    
+    @staticmethod
+    def point_result(point: H3Point, batch: Dict[str, Any]) -> Dict[str, Any]:
+        """Single-point response from an `add_points_to_trail` result"""
+        trail = batch["trail"]
+        result = {
+            "ok": True,
+            "h3_index": point.h3_index,
+            "trail_length_m": trail["trail_length_m"],
+            "points_count": trail["points_count"]
+        }
+        for event in batch["events"]:
+            for name in ("loop_closure", "cut_detected"):
+                if name in event:
+                    result[name] = event[name]
+        return result
+    
+    @staticmethod
+    def queue_tail_read(pipe, session_id: str) -> None:
+        """Queue a read of the stored last point and trail summary (see `trail_tail`)"""
+        pipe.hmget(f"trail:{session_id}", "last_point", "status", "total_length_m", "points_count")
+    
+    def trail_tail(self, session_id: str, raw: List[Optional[str]]) -> Optional[Tuple[H3Point, Dict[str, Any]]]:
+        """Last point and summary of a trail; a cached (unflushed) copy wins over the stored one"""
+        entry = self.cache.get(session_id) if self.cache is not None else None
+        if entry is not None and entry.state.points:
+            state = entry.state
+            last, status, length, count = state.points[-1], state.status, state.total_length_m, state.points_count
+        elif raw and raw[0]:
+            last = self._decode_point(raw[0], session_id)
+            status, length, count = raw[1] or "active", float(raw[2] or 0.0), int(raw[3] or 0)
+        else:
+            return None
+        return last, {"status": status, "h3_index": last.h3_index, "trail_length_m": length, "points_count": count}
+    
+    async def add_points_to_trail(self, session_id: str, user_id: str, points: List[H3Point], city: Optional[str] = None) -> Dict[str, Any]:
+        """Append an ordered batch of points to the trail and check each for events.
+
+        Calls for one session are serialized in this worker: while a batch
+        is being applied, later calls queue up and are then applied together
+        as a single trail update (each caller gets its own events back).
+        Uncached writes from other workers are caught by the version check
+        in `_write_points`; after TRAIL_WRITE_RETRIES lost races the call
+        fails rather than overwrite them. Cached trails rely on the owner
+        lease instead.
+        """
+        future = asyncio.get_running_loop().create_future()
+        queue = self.session_queues.get(session_id)
+        if queue is not None:
+            queue.append((user_id, points, city, future))
+            return await future
+        
+        self.session_queues[session_id] = queue = [(user_id, points, city, future)]
+        batch = []
+        try:
+            while queue:
+                batch = queue[:]
+                del queue[:]
+                await self._apply_queued(session_id, batch)
+        finally:
+            del self.session_queues[session_id]
+            # If this leader was cancelled mid-apply, nobody else will resolve the callers it took on
+            for *_, waiting in batch + queue:
+                if waiting is not future and not waiting.done():
+                    waiting.set_exception(RuntimeError("Trail update cancelled"))
+        return await future
+    
+    def ingest_stats(self) -> Dict[str, Any]:
+        return {
+            "sessions_in_flight": len(self.session_queues),
+            "coalesced_calls": self.coalesced_calls,
+            "write_conflicts": self.write_conflicts,
+        }
+    
+    async def _apply_queued(self, session_id: str, batch: List[Tuple[str, List[H3Point], Optional[str], asyncio.Future]]) -> None:
+        """Apply queued calls as one update per run of the same user; split results per caller"""
+        start = 0
+        while start < len(batch):
+            end = start + 1
+            while end < len(batch) and batch[end][0] == batch[start][0]:
+                end += 1
+            group = batch[start:end]
+            start = end
+            if len(group) > 1:
+                self.coalesced_calls += len(group) - 1
+            points = [p for _, pts, _, _ in group for p in pts]
+            city = next((c for _, _, c, _ in reversed(group) if c), None)
+            try:
+                result = await self._apply_points(session_id, group[0][0], points, city)
+            except Exception as e:
+                for *_, future in group:
+                    if not future.done():  # a caller may have given up (cancelled) meanwhile
+                        future.set_exception(e)
+                continue
+            offset = 0
+            for _, pts, _, future in group:
+                events = [
+                    {**event, "index": event["index"] - offset}
+                    for event in result["events"]
+                    if offset <= event["index"] < offset + len(pts)
+                ]
+                if not future.done():
+                    future.set_result({**result, "events": events})
+                offset += len(pts)
+    
+    async def _apply_points(self, session_id: str, user_id: str, points: List[H3Point], city: Optional[str] = None, attempt: int = 0) -> Dict[str, Any]:
+        """Append an ordered batch of points to the trail and check each for events.
+
+        Points are appended to `trail:{session_id}:points` and the derived
+        fields (cell counts, length, status) are updated in place, so the
+        Redis work per point does not grow with the trail length. The whole
+        batch costs one metadata read and one write pipeline. With a
+        `TrailCache` the metadata read shrinks to a version check and the
+        writes are buffered and flushed every few points.
+        """
         trail_key = f"trail:{session_id}"
+        batch_cells = [p.h3_index for p in points]
         
-        # Get current trail state
-        trail_data = await self.redis.hgetall(trail_key)
+        trail_state = None
+        is_new = False
+        entry = self.cache.get(session_id) if self.cache is not None else None
+        if entry is not None and (entry.state.user_id != user_id or (city and entry.state.city == "unknown")):
+            # Reload through `_load_trail`, which also re-scopes a trail whose city is now known
+            await self.flush_trail(session_id, evict=True)
+            entry = None
+        if entry is not None:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hget(trail_key, "version")
+            pipe.smismember(f"{trail_key}:territory", [cell_to_int(c) for c in batch_cells])
+            pipe.set(f"{trail_key}:owner", self.worker_id, nx=True, px=int(TRAIL_CACHE_LEASE_SEC * 1000))
+            pipe.get(f"{trail_key}:owner")
+            if entry.state.status == 'active':
+                # The cut index is never deferred; other runners must see this trail now
+                self._queue_index_writes(pipe, entry.state.city, session_id, batch_cells)
+            version, inside_flags, acquired, owner = (await pipe.execute())[:4]
+            if owner == self.worker_id and int(version or 0) == entry.version and await self._keep_lease(entry, bool(acquired)):
+                self.cache.hits += 1
+                trail_state = entry.state
+            else:
+                # Another writer changed or holds the trail; never build on a stale copy
+                await self.flush_trail(session_id, evict=True)
+                entry = None
         
-        if not trail_data:
-            # Initialize new trail
-            claimed_territory = await self.get_user_claimed_territory(user_id)
-            trail_state = TrailState(
-                session_id=session_id,
-                user_id=user_id,
-                points=[point],
-                h3_cells={point.h3_index},
-                status='active',
-                last_updated=point.timestamp,
-                total_length_m=0.0,
-                claimed_territory=claimed_territory
-            )
+        if trail_state is None:
+            if self.cache is not None:
+                self.cache.misses += 1
+            trail_state, inside_flags, is_new, version = await self._load_trail(session_id, user_id, city, batch_cells)
+        
+        status = trail_state.status
+        first_count = trail_state.points_count
+        loop_candidates, cell_counts = self._advance_trail(trail_state, points, inside_flags)
+        
+        if self.cache is not None:
+            if entry is None:
+                if status == 'active':
+                    await self._index_cells(trail_state.city, session_id, list(cell_counts))
+                entry = await self._cache_put(trail_state, version, first_count)
+            entry.add(points, cell_counts)
+            # Loop checks read stored points, so flush before them
+            if is_new or loop_candidates or len(entry.pending_points) >= self.cache.flush_every:
+                await self._flush_entry(entry)
         else:
-            # Update existing trail
-            points_json = trail_data.get("points", "[]")
-            points_data = json.loads(points_json)
-            points = [H3Point(**p) for p in points_data]
-            points.append(point)
-            
-            # Limit trail length
-            if len(points) > MAX_TRAIL_POINTS:
-                points = points[-MAX_TRAIL_POINTS:]
-            
-            h3_cells = {p.h3_index for p in points}
-            
-            # Calculate length
-            total_length = self._calculate_trail_length(points)
-            
-            claimed_territory_json = trail_data.get("claimed_territory", "[]")
-            claimed_territory = set(json.loads(claimed_territory_json))
-            
-            trail_state = TrailState(
-                session_id=session_id,
-                user_id=user_id,
-                points=points,
-                h3_cells=h3_cells,
-                status=trail_data.get("status", "active"),
-                last_updated=point.timestamp,
-                total_length_m=total_length,
-                claimed_territory=claimed_territory
-            )
+            if await self._write_points(trail_state, points, cell_counts, first_count, version) is None:
+                self.write_conflicts += 1
+                if attempt >= TRAIL_WRITE_RETRIES:
+                    # Writing without the check could overwrite a concurrent cut or length
+                    raise RuntimeError(f"Trail {session_id} kept changing during the update; retry")
+                return await self._apply_points(session_id, user_id, points, city, attempt + 1)
+        
+        events: Dict[int, Dict[str, Any]] = {}
         
         # Check for loop closure
-        loop_area = None
-        if len(trail_state.points) >= 3:
-            enclosed_cells = self.geo_processor.detect_loop_closure(
-                list(trail_state.h3_cells), 
-                trail_state.claimed_territory
-            )
-            if enclosed_cells and len(enclosed_cells) > 0:
-                area_m2 = self.geo_processor.calculate_area_m2(enclosed_cells)
-                if area_m2 >= MIN_LOOP_AREA_M2:
-                    loop_area = {"cells": list(enclosed_cells), "area_m2": area_m2}
+        for idx, excursion_len in loop_candidates:
+            loop_area = await self._check_loop_closure(session_id, excursion_len, len(points) - 1 - idx)
+            if loop_area:
+                events.setdefault(idx, {})["loop_closure"] = loop_area
+        if loop_candidates and events:
+            await self._publish_loops(trail_state, points, events)
         
-        # Check for cuts from other active trails
-        cut_detected = await self._check_trail_cuts(trail_state)
+        # Check for cuts from other active trails on each new point's cell
+        occupied = await self._occupied_cells(trail_state.city, session_id, list(cell_counts))
+        for idx, point in enumerate(points):
+            if first_count + idx + 1 < 2 or point.h3_index not in occupied:
+                continue
+            cut_detected = await self._check_trail_cuts(trail_state, point)
+            if cut_detected:
+                events.setdefault(idx, {})["cut_detected"] = cut_detected
+                trail_state.status = 'cut'
         
-        # Update Redis
-        await self._save_trail_state(trail_state)
+        if trail_state.status != status:
+            await self.flush_trail(session_id)  # index cleanup reads the stored cells
+            version = await self._set_status(session_id, trail_state.status)
+            entry = self.cache.get(session_id) if self.cache is not None else None
+            if entry is not None:
+                entry.version = version
         
-        result = {
+        return {
             "ok": True,
-            "h3_index": point.h3_index,
-            "trail_length_m": trail_state.total_length_m,
-            "points_count": len(trail_state.points)
+            "events": [
+                {"index": idx, "h3_index": points[idx].h3_index, **event}
+                for idx, event in sorted(events.items())
+            ],
+            "trail": {
+                "status": trail_state.status,
+                "h3_index": points[-1].h3_index,
+                "trail_length_m": trail_state.total_length_m,
+                "points_count": trail_state.points_count
+            }
         }
+    
+    async def _load_trail(self, session_id: str, user_id: str, city: Optional[str], batch_cells: List[str]) -> Tuple[TrailState, List[Any], bool, int]:
+        """Read the trail header from Redis, creating a new trail if none exists"""
+        trail_key = f"trail:{session_id}"
+        territory_key = f"{trail_key}:territory"
+        owner_key = f"{trail_key}:owner"
         
-        if loop_area:
-            result["loop_closure"] = loop_area
+        batch_ints = [cell_to_int(c) for c in batch_cells]
         
-        if cut_detected:
-            result["cut_detected"] = cut_detected
-            trail_state.status = 'cut'
-            await self._save_trail_state(trail_state)
+        deadline = time.monotonic() + TRAIL_CACHE_LEASE_SEC
+        while True:
+            # Only the small metadata hash and the new cells' territory membership are read on the hot path
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hgetall(trail_key)
+            pipe.smismember(territory_key, batch_ints)
+            if self.cache is not None:
+                pipe.set(owner_key, self.worker_id, nx=True, px=int(TRAIL_CACHE_LEASE_SEC * 1000))
+            pipe.get(owner_key)
+            results = await pipe.execute()
+            meta, inside_flags, owner = results[0], results[1], results[-1]
+            # Another worker has points for this trail buffered; wait for its flush
+            if not owner or owner == self.worker_id:
+                break
+            if time.monotonic() >= deadline:
+                # The owner kept renewing its lease; writing now would land before its buffered points
+                raise RuntimeError(f"Trail {session_id} is being written by another worker; retry")
+            await asyncio.sleep(TRAIL_OWNER_POLL_SEC)
         
-        return result
+        if meta.get("points") is not None:
+            meta = await self._migrate_legacy_trail(session_id, meta, city)
+            inside_flags = await self.redis.smismember(territory_key, batch_ints)
+        elif meta and meta.get("territory_format") != TERRITORY_FORMAT:
+            await self._migrate_territory_format(session_id)
+            inside_flags = await self.redis.smismember(territory_key, batch_ints)
+        
+        if meta:
+            trail_state = self._state_from_meta(session_id, meta)
+            version = int(meta.get("version", "0"))
+            if trail_state.city in ("", "unknown"):
+                resolved = await self._resolve_city(session_id, city)
+                if resolved != "unknown":
+                    version = await self._rescope_trail(trail_state, resolved)
+                trail_state.city = resolved
+            return trail_state, inside_flags, False, version
+        
+        # Initialize new trail
+        claimed_territory = await self.get_user_claimed_territory(user_id)
+        if len(claimed_territory):
+            await self.redis.sadd(territory_key, *[int(c) for c in claimed_territory])
+        trail_state = TrailState(
+            session_id=session_id,
+            user_id=user_id,
+            points=[],
+            h3_cells=set(),
+            status='active',
+            last_updated=datetime.now(timezone.utc),
+            total_length_m=0.0,
+            claimed_territory={int(c) for c in claimed_territory},
+            points_count=0,
+            city=await self._resolve_city(session_id, city)
+        )
+        return trail_state, cells_contain(claimed_territory, batch_ints), True, 0
+    
+    def _state_from_meta(self, session_id: str, meta: Dict[str, str]) -> TrailState:
+        """Trail header from the metadata hash; only the last point is loaded"""
+        last_point = self._decode_point(meta["last_point"], session_id) if meta.get("last_point") else None
+        tail = [last_point] if last_point else []
+        return TrailState(
+            session_id=session_id,
+            user_id=meta.get("user_id", ""),
+            points=tail,
+            h3_cells={p.h3_index for p in tail},
+            status=meta.get("status", "active"),
+            last_updated=datetime.fromisoformat(meta.get("last_updated", datetime.now(timezone.utc).isoformat())),
+            total_length_m=float(meta.get("total_length_m", "0.0")),
+            claimed_territory=set(),  # loaded in full only when a loop may have closed
+            points_count=int(meta.get("points_count", "0")),
+            city=meta.get("city", ""),
+            outside_count=int(meta.get("outside_count", "0"))
+        )
+    
+    def _advance_trail(self, trail_state: TrailState, points: List[H3Point], inside_flags: List[Any]) -> Tuple[List[Tuple[int, int]], Dict[str, int]]:
+        """Apply points to the in-memory header; returns loop candidates and per-cell counts"""
+        # Only the new segments contribute to the running length
+        new_path = trail_state.points[-1:] + points
+        trail_state.total_length_m += self._calculate_trail_length(new_path)
+        loop_candidates = []  # (batch index, excursion length)
+        cell_counts: Dict[str, int] = {}
+        for idx, point in enumerate(points):
+            cell_counts[point.h3_index] = cell_counts.get(point.h3_index, 0) + 1
+            
+            # A loop can only close when the trail comes back into territory
+            inside = bool(int(inside_flags[idx]))
+            if inside and trail_state.outside_count > 0:
+                # last point inside, the points outside, this point
+                loop_candidates.append((idx, trail_state.outside_count + 2))
+            trail_state.outside_count = 0 if inside else trail_state.outside_count + 1
+        
+        tail = [p for p in (trail_state.points[-1] if trail_state.points else None, points[-1]) if p]
+        trail_state.points = tail
+        trail_state.h3_cells = {p.h3_index for p in tail}
+        trail_state.last_updated = points[-1].timestamp
+        trail_state.points_count = min(trail_state.points_count + len(points), MAX_TRAIL_POINTS)
+        return loop_candidates, cell_counts
+    
+    def _queue_trail_writes(self, pipe, trail_state: TrailState, points: List[H3Point], cell_counts: Dict[str, int], index: bool = True) -> None:
+        """Queue the append of `points` and the header update; the new version is the first result"""
+        session_id = trail_state.session_id
+        trail_key = f"trail:{session_id}"
+        pipe.hincrby(trail_key, "version", 1)
+        pipe.rpush(f"{trail_key}:points", *[self._encode_point(p) for p in points])
+        for cell, count in cell_counts.items():
+            pipe.hincrby(f"{trail_key}:cells", cell, count)
+        pipe.hset(trail_key, mapping={
+            "user_id": trail_state.user_id,
+            "city": trail_state.city,
+            "status": trail_state.status,
+            "last_updated": trail_state.last_updated.isoformat(),
+            "total_length_m": str(trail_state.total_length_m),
+            "points_count": str(trail_state.points_count),
+            "outside_count": str(trail_state.outside_count),
+            "last_point": self._encode_point(points[-1]),
+            "territory_format": TERRITORY_FORMAT,
+        })
+        if index and trail_state.status == 'active':
+            self._queue_index_writes(pipe, trail_state.city, session_id, list(cell_counts))
+        for key in trail_keys(session_id):
+            pipe.expire(key, TRAIL_TTL_SEC)
+    
+    @staticmethod
+    def _queue_index_writes(pipe, city: str, session_id: str, cells: List[str]) -> None:
+        for cell in set(cells):
+            index_key = trail_cell_index_key(city, cell)
+            pipe.sadd(index_key, session_id)
+            pipe.expire(index_key, TRAIL_TTL_SEC)
+    
+    async def _index_cells(self, city: str, session_id: str, cells: List[str]) -> None:
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_index_writes(pipe, city, session_id, cells)
+        await pipe.execute()
+    
+    async def _write_points(self, trail_state: TrailState, points: List[H3Point], cell_counts: Dict[str, int], stored_count: int, expected_version: Optional[int] = None) -> Optional[int]:
+        """Write points and header straight to Redis in one transaction; returns the new version.
+
+        With `expected_version`, nothing is written and None is returned if
+        another writer bumped the trail version since it was read.
+        """
+        trail_key = f"trail:{trail_state.session_id}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                if expected_version is not None:
+                    await pipe.watch(trail_key)
+                    if int(await pipe.hget(trail_key, "version") or 0) != expected_version:
+                        return None
+                    pipe.multi()
+                self._queue_trail_writes(pipe, trail_state, points, cell_counts)
+                results = await pipe.execute()
+            except WatchError:
+                return None
+        
+        # Limit trail length
+        overflow = max(0, stored_count + len(points) - MAX_TRAIL_POINTS)
+        if overflow:
+            await self._trim_trail(trail_state.session_id, trail_state.city, overflow)
+        return int(results[0])
+    
+    async def _set_status(self, session_id: str, status: str) -> int:
+        """Change a trail's status, keeping the cut index in step; returns the new version"""
+        trail_key = f"trail:{session_id}"
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(trail_key, "status", status)
+        pipe.hincrby(trail_key, "version", 1)
+        _, version = await pipe.execute()
+        if status != 'active':
+            await remove_trail_from_index(self.redis, session_id)
+        return int(version)
+    
+    # ---------- Write-behind cache ----------
+    async def _cache_put(self, trail_state: TrailState, version: int, stored_count: int) -> CachedTrail:
+        entry, evicted = self.cache.put(trail_state, version, stored_count)
+        entry.lease_renew_at = time.monotonic() + TRAIL_CACHE_LEASE_SEC / 2
+        for old in evicted:
+            await self._flush_entry(old)
+        return entry
+    
+    async def _keep_lease(self, entry: CachedTrail, acquired: bool) -> bool:
+        """Keep the owner lease alive while points are buffered; False if it was lost"""
+        now = time.monotonic()
+        if not acquired and now >= entry.lease_renew_at:
+            owner_key = f"trail:{entry.state.session_id}:owner"
+            async with self.redis.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(owner_key)
+                    if await pipe.get(owner_key) != self.worker_id:
+                        return False
+                    pipe.multi()
+                    pipe.pexpire(owner_key, int(TRAIL_CACHE_LEASE_SEC * 1000))
+                    await pipe.execute()
+                except WatchError:
+                    return False
+            self.cache.lease_renewals += 1
+        if acquired or now >= entry.lease_renew_at:
+            entry.lease_renew_at = now + TRAIL_CACHE_LEASE_SEC / 2
+        return True
+    
+    async def flush_trail(self, session_id: str, evict: bool = False) -> None:
+        """Write any buffered points of one trail to Redis"""
+        if self.cache is None:
+            return
+        entry = self.cache.pop(session_id) if evict else self.cache.get(session_id)
+        if entry is not None:
+            await self._flush_entry(entry)
+    
+    async def flush_due(self, max_age_sec: float) -> None:
+        """Flush trails whose oldest buffered point is older than `max_age_sec`"""
+        if self.cache is None:
+            return
+        for entry in self.cache.due(max_age_sec):
+            await self._flush_entry(entry)
+    
+    async def flush_all(self) -> None:
+        """Flush every buffered trail (shutdown)"""
+        if self.cache is None:
+            return
+        for entry in list(self.cache.entries.values()):
+            await self._flush_entry(entry)
+    
+    async def run_flusher(self, interval_sec: float) -> None:
+        """Background loop bounding how long points stay buffered"""
+        while True:
+            await asyncio.sleep(interval_sec)
+            try:
+                await self.flush_due(interval_sec)
+            except Exception as e:
+                print(f"Trail flush error: {e}")
+    
+    async def _flush_entry(self, entry: CachedTrail) -> None:
+        """Write buffered points, guarded by the trail version (WATCH/MULTI)"""
+        if not entry.pending_points:
+            return
+        session_id = entry.state.session_id
+        trail_key = f"trail:{session_id}"
+        owner_key = f"{trail_key}:owner"
+        
+        results = None
+        for _ in range(TRAIL_CACHE_FLUSH_RETRIES):
+            async with self.redis.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(trail_key, owner_key)
+                    version = await pipe.hget(trail_key, "version")
+                    owner = await pipe.get(owner_key)
+                    if int(version or 0) != entry.version:
+                        # Someone else wrote the trail; replay our points on top of their state
+                        self.cache.conflicts += 1
+                        if not await self._rebase_entry(pipe, entry):
+                            self._drop_entry(entry)
+                            return
+                    pipe.multi()
+                    self._queue_trail_writes(pipe, entry.state, entry.pending_points, entry.pending_cells, index=False)
+                    if owner == self.worker_id:
+                        pipe.delete(owner_key)  # nothing buffered any more; release the lease
+                    results = await pipe.execute()
+                    break
+                except WatchError:
+                    self.cache.conflicts += 1
+        
+        if results is None:
+            # Still contended: fall back to a plain write and stop caching this trail
+            self._drop_entry(entry)
+            await self._write_points(entry.state, entry.pending_points, entry.pending_cells, entry.stored_count)
+            entry.clear_pending()
+            if await self.redis.get(owner_key) == self.worker_id:
+                await self.redis.delete(owner_key)
+            return
+        
+        overflow = max(0, entry.stored_count + len(entry.pending_points) - MAX_TRAIL_POINTS)
+        entry.version = int(results[0])
+        entry.stored_count = min(entry.stored_count + len(entry.pending_points), MAX_TRAIL_POINTS)
+        self.cache.record_flush(entry)
+        entry.clear_pending()
+        if overflow:
+            await self._trim_trail(session_id, entry.state.city, overflow)
+    
+    def _drop_entry(self, entry: CachedTrail) -> None:
+        session_id = entry.state.session_id
+        if self.cache.entries.get(session_id) is entry:
+            self.cache.pop(session_id)
+    
+    async def _rebase_entry(self, pipe, entry: CachedTrail) -> bool:
+        """Reload the header inside a WATCH and re-apply pending points.
+
+        Returns False if the trail is gone or another worker already stored
+        newer points (our lease lapsed); the buffer is then dropped, since
+        appending it would put older points after newer ones.
+        """
+        session_id = entry.state.session_id
+        trail_key = f"trail:{session_id}"
+        meta = await pipe.hgetall(trail_key)
+        if not meta or meta.get("points") is not None:
+            return False
+        if meta.get("last_point"):
+            stored_last = self._decode_point(meta["last_point"], session_id)
+            if _as_utc(stored_last.timestamp) > _as_utc(entry.pending_points[0].timestamp):
+                self.cache.dropped_points += len(entry.pending_points)
+                return False
+        inside_flags = await pipe.smismember(f"{trail_key}:territory", [cell_to_int(p.h3_index) for p in entry.pending_points])
+        fresh = self._state_from_meta(session_id, meta)
+        fresh.city = fresh.city or entry.state.city
+        stored_count = fresh.points_count
+        self._advance_trail(fresh, entry.pending_points, inside_flags)
+        entry.state = fresh
+        entry.version = int(meta.get("version", "0"))
+        entry.stored_count = stored_count
+        return True
+    
+    async def _check_loop_closure(self, session_id: str, excursion_len: int, end_offset: int = 0) -> Optional[Dict[str, Any]]:
+        """Find the area enclosed by an excursion out of territory and back.
+
+        The excursion is the `excursion_len` stored points ending
+        `end_offset` points before the newest one.
+        """
+        trail_key = f"trail:{session_id}"
+        points_raw = await self.redis.lrange(f"{trail_key}:points", -(excursion_len + end_offset), -(end_offset + 1))
+        excursion = [self._decode_point(raw, session_id).h3_index for raw in points_raw]
+        
+        # Only the loop's path and bounding box matter, not the whole territory
+        lookup = self.geo_processor.loop_lookup_cells(excursion)
+        if not lookup:
+            return None
+        pipe = self.redis.pipeline(transaction=False)
+        for start in range(0, len(lookup), TERRITORY_LOOKUP_CHUNK):
+            pipe.smismember(f"{trail_key}:territory", lookup[start:start + TERRITORY_LOOKUP_CHUNK])
+        inside_flags = [flag for chunk in await pipe.execute() for flag in chunk]
+        owned = [cell for cell, inside in zip(lookup, inside_flags) if inside]
+        
+        enclosed_cells = self.geo_processor.detect_loop_closure(excursion, cells_to_ints(owned))
+        if not enclosed_cells:
+            return None
+        
+        area_m2 = self.geo_processor.calculate_area_m2(enclosed_cells)
+        if area_m2 < MIN_LOOP_AREA_M2:
+            return None
+        
+        # Later loops in this run build on the area just enclosed
+        await self.redis.sadd(f"{trail_key}:territory", *enclosed_cells)
+        return {"cells": ints_to_cells(enclosed_cells), "area_m2": area_m2}
+    
+    async def _publish_loops(self, trail_state: TrailState, points: List[H3Point], events: Dict[int, Dict[str, Any]]) -> None:
+        """Push loop closures to the runner and their city"""
+        channels = [user_channel(trail_state.user_id), city_channel(trail_state.city)]
+        pipe = self.redis.pipeline(transaction=False)
+        for idx, event in sorted(events.items()):
+            loop = event["loop_closure"]
+            queue_publish(pipe, channels, {
+                "type": "loop_closure",
+                "session_id": trail_state.session_id,
+                "user_id": trail_state.user_id,
+                "city": trail_state.city,
+                "h3_index": points[idx].h3_index,
+                "area_m2": loop["area_m2"],
+                "cells_count": len(loop["cells"]),
+            })
+        try:
+            await pipe.execute()
+        except Exception as e:
+            print(f"Loop event publish error: {e}")
+    
+    async def _occupied_cells(self, city: str, session_id: str, cells: List[str]) -> Set[str]:
+        """Cells that some other trail in `city` is indexed under"""
+        pipe = self.redis.pipeline(transaction=False)
+        for cell in cells:
+            pipe.smembers(trail_cell_index_key(city, cell))
+        members = await pipe.execute()
+        return {cell for cell, sids in zip(cells, members) if set(sids) - {session_id}}
+    
+    async def get_trail_outline(self, session_id: str, tolerance_m: float = 0.0) -> Optional[Dict[str, Any]]:
+        """Cells, outline and area of a trail, computed once per trail version and tolerance"""
+        await self.flush_trail(session_id)
+        trail_key = f"trail:{session_id}"
+        user_id, status, version, legacy_points = await self.redis.hmget(trail_key, "user_id", "status", "version", "points")
+        if user_id is None:
+            return None
+        
+        cache_key = (session_id, int(version or 0), tolerance_m)
+        cached = self.outline_cache.get(cache_key) if legacy_points is None else None
+        if cached is not None:
+            self.outline_cache.move_to_end(cache_key)
+            return cached
+        
+        if legacy_points is not None:
+            trail_state = await self.get_trail_state(session_id)
+            cells = list(trail_state.h3_cells) if trail_state else []
+        else:
+            cells = await self.redis.hkeys(f"{trail_key}:cells")
+        outline = {
+            "user_id": user_id,
+            "status": status or "active",
+            "h3_cells": cells,
+            "outline": self.geo_processor.cells_to_multipolygon(cells, tolerance_m),
+            "area_m2": self.geo_processor.calculate_area_m2(cells),
+        }
+        if legacy_points is None:
+            self.outline_cache[cache_key] = outline
+            while len(self.outline_cache) > TRAIL_OUTLINE_CACHE_SIZE:
+                self.outline_cache.popitem(last=False)
+        return outline
     
     async def get_trail_state(self, session_id: str) -> Optional[TrailState]:
         """Get current trail state"""
+        await self.flush_trail(session_id)
         trail_key = f"trail:{session_id}"
         trail_data = await self.redis.hgetall(trail_key)
         
         if not trail_data:
             return None
         
-        points_json = trail_data.get("points", "[]")
-        points_data = json.loads(points_json)
-        points = [H3Point(**p) for p in points_data]
+        if trail_data.get("points") is not None:
+            return self._parse_legacy_trail(session_id, trail_data)
         
-        claimed_territory_json = trail_data.get("claimed_territory", "[]")
-        claimed_territory = set(json.loads(claimed_territory_json))
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lrange(f"{trail_key}:points", 0, -1)
+        pipe.hkeys(f"{trail_key}:cells")
+        pipe.smembers(f"{trail_key}:territory")
+        points_raw, h3_cells, claimed_territory = await pipe.execute()
+        points = [self._decode_point(raw, session_id) for raw in points_raw]
         
         return TrailState(
             session_id=session_id,
             user_id=trail_data.get("user_id", ""),
             points=points,
-            h3_cells=set(trail_data.get("h3_cells", "").split(",")) if trail_data.get("h3_cells") else set(),
+            h3_cells=set(h3_cells),
             status=trail_data.get("status", "active"),
             last_updated=datetime.fromisoformat(trail_data.get("last_updated", datetime.now(timezone.utc).isoformat())),
             total_length_m=float(trail_data.get("total_length_m", "0.0")),
-            claimed_territory=claimed_territory
+            claimed_territory={int(c) for c in cells_to_ints(claimed_territory)},
+            points_count=len(points),
+            city=trail_data.get("city", "unknown")
         )
     
-    async def get_user_claimed_territory(self, user_id: str) -> Set[str]:
-        """Get user's claimed H3 cells from previous claims"""
-        # Get from Redis cache first
+    async def get_user_claimed_territory(self, user_id: str) -> Any:
+        """Get user's claimed H3 cells from previous claims, as a sorted int64 array"""
+        # Get from Redis cache first (packed int64 buffer)
         territory_key = f"territory:{user_id}"
-        cached = await self.redis.smembers(territory_key)
+        try:
+            cached = await self.redis.execute_command("GET", territory_key, **{NEVER_DECODE: []})
+        except Exception:
+            cached = None  # pre-int64 cache entries were sets; overwritten below
         if cached:
-            return set(cached)
+            return unpack_cells(cached)
         
         # Fallback: query from Postgres claims
         try:
             from utils import ensure_supabase
             s = ensure_supabase()
-            res = s.table("claims").select("h3_cells").eq("user_id", user_id).execute()
-            all_cells = set()
+            res = await db_execute(s.table("claims").select("h3_cells").eq("user_id", user_id))
+            all_cells = []
             for row in res.data or []:
-                all_cells.update(row.get("h3_cells", []))
+                all_cells.extend(row.get("h3_cells", []))
+            territory = cells_to_ints(all_cells)
             
             # Cache in Redis
-            if all_cells:
-                await self.redis.sadd(territory_key, *all_cells)
-                await self.redis.expire(territory_key, 3600)  # 1 hour cache
+            if len(territory):
+                await self.redis.set(territory_key, pack_cells(territory), ex=3600)  # 1 hour cache
             
-            return all_cells
+            return territory
         except Exception:
-            return set()
-    
-    def _calculate_trail_length(self, points: List[H3Point]) -> float:
-        """Calculate trail length in meters"""
-        if len(points) < 2:
-            return 0.0
-        
-        total_length = 0.0
-        for i in range(1, len(points)):
-            # Use Haversine distance
-            lat1, lng1 = points[i-1].lat, points[i-1].lng
-            lat2, lng2 = points[i].lat, points[i].lng
-            
-            # Convert to radians
-            lat1, lng1, lat2, lng2 = map(math.radians, [lat1, lng1, lat2, lng2])
-            
-            # Haversine formula
-            dlat = lat2 - lat1
-            dlng = lng2 - lng1
-            a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlng/2)**2
-            c = 2 * math.asin(math.sqrt(a))
-            r = 6371000  # Earth radius in meters
-            total_length += c * r
-        
-        return total_length
+            return cells_to_ints([])
+    
+    @staticmethod
+    def _calculate_trail_length(points: List[H3Point]) -> float:
+        """Calculate trail length in meters along `points`"""
+        return path_length_m([p.lat for p in points], [p.lng for p in points])
     
     async def _save_trail_state(self, trail_state: TrailState) -> None:
-        """Save trail state to Redis"""
-        trail_key = f"trail:{trail_state.session_id}"
+        """Rewrite the full trail state to Redis (rebuilds and migrations only)"""
+        session_id = trail_state.session_id
+        trail_key = f"trail:{session_id}"
+        points = trail_state.points[-MAX_TRAIL_POINTS:]
         
-        # Serialize points
-        points_data = []
-        for p in trail_state.points:
-            points_data.append({
-                "lat": p.lat,
-                "lng": p.lng,
-                "h3_index": p.h3_index,
-                "timestamp": p.timestamp.isoformat(),
-                "session_id": p.session_id
-            })
+        cell_counts: Dict[str, int] = {}
+        for p in points:
+            cell_counts[p.h3_index] = cell_counts.get(p.h3_index, 0) + 1
         
-        await self.redis.hset(trail_key, mapping={
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(*trail_keys(session_id))
+        if points:
+            pipe.rpush(f"{trail_key}:points", *[self._encode_point(p) for p in points])
+            pipe.hset(f"{trail_key}:cells", mapping=cell_counts)
+        if trail_state.claimed_territory:
+            pipe.sadd(f"{trail_key}:territory", *[cell_to_int(c) for c in trail_state.claimed_territory])
+        meta = {
             "user_id": trail_state.user_id,
+            "city": trail_state.city,
             "status": trail_state.status,
-            "points": json.dumps(points_data),
-            "h3_cells": ",".join(trail_state.h3_cells),
             "last_updated": trail_state.last_updated.isoformat(),
             "total_length_m": str(trail_state.total_length_m),
-            "claimed_territory": json.dumps(list(trail_state.claimed_territory))
-        })
-        await self.redis.expire(trail_key, TRAIL_TTL_SEC)
+            "points_count": str(len(points)),
+            "territory_format": TERRITORY_FORMAT,
+        }
+        if points:
+            meta["last_point"] = self._encode_point(points[-1])
+        pipe.hset(trail_key, mapping=meta)
+        pipe.hincrby(trail_key, "version", 1)
+        for key in trail_keys(session_id):
+            pipe.expire(key, TRAIL_TTL_SEC)
+        if trail_state.status == 'active':
+            for cell in cell_counts:
+                index_key = trail_cell_index_key(trail_state.city, cell)
+                pipe.sadd(index_key, session_id)
+                pipe.expire(index_key, TRAIL_TTL_SEC)
+        await pipe.execute()
+    
+    async def _trim_trail(self, session_id: str, city: str, count: int) -> Set[str]:
+        """Drop the oldest points and return cells no longer on the trail"""
+        cells_key = f"trail:{session_id}:cells"
+        dropped = await self.redis.lpop(f"trail:{session_id}:points", count) or []
+        
+        pipe = self.redis.pipeline(transaction=False)
+        dropped_cells = [self._decode_point(raw, session_id).h3_index for raw in dropped]
+        for cell in dropped_cells:
+            pipe.hincrby(cells_key, cell, -1)
+        counts = await pipe.execute()
+        
+        gone = {cell for cell, remaining in zip(dropped_cells, counts) if int(remaining) <= 0}
+        if gone:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hdel(cells_key, *gone)
+            for cell in gone:
+                pipe.srem(trail_cell_index_key(city, cell), session_id)
+            await pipe.execute()
+        return gone
+    
+    async def _resolve_city(self, session_id: str, city: Optional[str]) -> str:
+        """City scope for the cut index; falls back to the session's city"""
+        if city:
+            return city
+        return await self.redis.hget(f"session:{session_id}", "city") or "unknown"
+    
+    async def _rescope_trail(self, trail_state: TrailState, city: str) -> int:
+        """Move a trail created before its city was known into `city`'s cut index; returns the new version"""
+        session_id = trail_state.session_id
+        trail_key = f"trail:{session_id}"
+        cells = await self.redis.hkeys(f"{trail_key}:cells")
+        pipe = self.redis.pipeline(transaction=True)
+        queue_index_removal(pipe, session_id, trail_state.city, cells)
+        if trail_state.status == 'active':
+            self._queue_index_writes(pipe, city, session_id, cells)
+        pipe.hset(trail_key, "city", city)
+        pipe.hincrby(trail_key, "version", 1)  # cached copies still carry the old city
+        version = (await pipe.execute())[-1]
+        trail_state.city = city
+        return int(version)
+    
+    async def _migrate_legacy_trail(self, session_id: str, trail_data: Dict[str, str], city: Optional[str] = None) -> Dict[str, str]:
+        """Convert a trail stored as one JSON blob into the append-only layout"""
+        trail_state = self._parse_legacy_trail(session_id, trail_data)
+        trail_state.city = await self._resolve_city(session_id, city)
+        # Recompute over the points that will be kept rather than trusting the blob's total
+        trail_state.total_length_m = self._calculate_trail_length(trail_state.points[-MAX_TRAIL_POINTS:])
+        await self._save_trail_state(trail_state)
+        return await self.redis.hgetall(f"trail:{session_id}")
+    
+    async def _migrate_territory_format(self, session_id: str) -> None:
+        """Rewrite a trail's territory set from hex strings to int64 members"""
+        trail_key = f"trail:{session_id}"
+        territory_key = f"{trail_key}:territory"
+        members = await self.redis.smembers(territory_key)
+        pipe = self.redis.pipeline(transaction=True)
+        if members:
+            pipe.delete(territory_key)
+            pipe.sadd(territory_key, *[cell_to_int(c) for c in members])
+            pipe.expire(territory_key, TRAIL_TTL_SEC)
+        pipe.hset(trail_key, "territory_format", TERRITORY_FORMAT)
+        await pipe.execute()
     
-    async def _check_trail_cuts(self, trail_state: TrailState) -> Optional[Dict[str, Any]]:
-        """Check if current trail intersects with other active trails"""
-        if len(trail_state.points) < 2:
+    def _parse_legacy_trail(self, session_id: str, trail_data: Dict[str, str]) -> TrailState:
+        """Parse the pre-append-only layout with `points` as a JSON list"""
+        points = [self._point_from_dict(p, session_id) for p in json.loads(trail_data.get("points", "[]"))]
+        claimed_territory = {cell_to_int(c) for c in json.loads(trail_data.get("claimed_territory", "[]"))}
+        
+        return TrailState(
+            session_id=session_id,
+            user_id=trail_data.get("user_id", ""),
+            points=points,
+            h3_cells={p.h3_index for p in points},
+            status=trail_data.get("status", "active"),
+            last_updated=datetime.fromisoformat(trail_data.get("last_updated", datetime.now(timezone.utc).isoformat())),
+            total_length_m=float(trail_data.get("total_length_m", "0.0")),
+            claimed_territory=claimed_territory,
+            points_count=len(points),
+            city=trail_data.get("city", "unknown")
+        )
+    
+    @staticmethod
+    def _encode_point(point: H3Point) -> str:
+        if TRAIL_POINT_FORMAT == "json":
+            return json.dumps({
+                "lat": point.lat,
+                "lng": point.lng,
+                "h3_index": point.h3_index,
+                "timestamp": point.timestamp.isoformat(),
+                "session_id": point.session_id
+            })
+        ts = _as_utc(point.timestamp)
+        buf = POINT_STRUCT_V1.pack(
+            round(point.lat * COORD_SCALE),
+            round(point.lng * COORD_SCALE),
+            (ts - UNIX_EPOCH) // timedelta(milliseconds=1),  # exact; float timestamps can round up
+            cell_to_int(point.h3_index),
+        )
+        return POINT_FORMAT_V1 + binascii.b2a_base64(buf, newline=False).decode("ascii")
+    
+    @classmethod
+    def _decode_point(cls, raw: str, session_id: str) -> H3Point:
+        tag = raw[:1]
+        if tag == POINT_FORMAT_V1:
+            lat, lng, ts_ms, cell = POINT_STRUCT_V1.unpack(binascii.a2b_base64(raw[1:]))
+            return H3Point(
+                lat=lat / COORD_SCALE,
+                lng=lng / COORD_SCALE,
+                h3_index=format(cell, "x"),  # same as h3.int_to_str
+                timestamp=datetime.fromtimestamp(ts_ms / 1000, timezone.utc),
+                session_id=session_id
+            )
+        if tag == "{":
+            return cls._point_from_dict(json.loads(raw), session_id)
+        raise ValueError(f"Unknown trail point format {tag!r}")
+    
+    @staticmethod
+    def _point_from_dict(data: Dict[str, Any], session_id: str) -> H3Point:
+        ts = data.get("timestamp")
+        return H3Point(
+            lat=float(data["lat"]),
+            lng=float(data["lng"]),
+            h3_index=data["h3_index"],
+            timestamp=datetime.fromisoformat(ts) if isinstance(ts, str) else ts,
+            session_id=data.get("session_id", session_id)
+        )
+    
+    async def _check_trail_cuts(self, trail_state: TrailState, point: H3Point) -> Optional[Dict[str, Any]]:
+        """Check if the new point lands on another player's active trail"""
+        if trail_state.points_count < 2:
             return None
         
-        # Get all active trails that might intersect
-        active_trails_pattern = "trail:*"
         try:
-            trail_keys = await self.redis.keys(active_trails_pattern)
+            # Only trails indexed under the new point's cell can be cut by it
+            index_key = trail_cell_index_key(trail_state.city, point.h3_index)
+            candidates = [sid for sid in await self.redis.smembers(index_key) if sid != trail_state.session_id]
+            if not candidates:
+                return None
             
-            current_trail_cells = trail_state.h3_cells
-            latest_point = trail_state.points[-1]
+            pipe = self.redis.pipeline(transaction=False)
+            for sid in candidates:
+                pipe.hmget(f"trail:{sid}", "user_id", "status")
+            rows = await pipe.execute()
             
-            for trail_key in trail_keys:
-                if trail_key == f"trail:{trail_state.session_id}":
-                    continue  # Skip own trail
-                
-                other_trail_data = await self.redis.hgetall(trail_key)
-                if not other_trail_data or other_trail_data.get("status") != "active":
+            stale = []
+            for other_session_id, (other_user_id, other_status) in zip(candidates, rows):
+                if other_user_id is None:
+                    stale.append(other_session_id)  # trail expired without cleanup
                     continue
+                if other_status != "active" or other_user_id == trail_state.user_id:
+                    continue  # Skip inactive and own trails
                 
-                other_user_id = other_trail_data.get("user_id")
-                if other_user_id == trail_state.user_id:
-                    continue  # Skip own trails
+                # Record cut event
+                cut_id = await self._record_cut_event(
+                    attacker_id=trail_state.user_id,
+                    victim_id=other_user_id,
+                    session_id=trail_state.session_id,
+                    cut_location=point.h3_index,
+                    city=trail_state.city,
+                )
                 
-                other_h3_cells = set(other_trail_data.get("h3_cells", "").split(","))
-                if not other_h3_cells:
-                    continue
+                # Invalidate the victim's trail
+                await self._set_status(other_session_id, "cut")
                 
-                # Check for intersection
-                intersection = current_trail_cells.intersection(other_h3_cells)
-                if intersection:
-                    # Record cut event
-                    cut_id = await self._record_cut_event(
-                        attacker_id=trail_state.user_id,
-                        victim_id=other_user_id,
-                        session_id=trail_state.session_id,
-                        cut_location=latest_point.h3_index
-                    )
-                    
-                    # Invalidate the victim's trail
-                    await self.redis.hset(trail_key.replace("trail:", "trail:"), "status", "cut")
-                    
-                    return {
-                        "cut_id": cut_id,
-                        "victim_id": other_user_id,
-                        "intersection_cells": list(intersection),
-                        "cut_location": {
-                            "lat": latest_point.lat,
-                            "lng": latest_point.lng,
-                            "h3_index": latest_point.h3_index
-                        }
+                return {
+                    "cut_id": cut_id,
+                    "victim_id": other_user_id,
+                    "intersection_cells": [point.h3_index],
+                    "cut_location": {
+                        "lat": point.lat,
+                        "lng": point.lng,
+                        "h3_index": point.h3_index
                     }
+                }
             
+            if stale:
+                await self.redis.srem(index_key, *stale)
             return None
             
         except Exception as e:
@@ -262,10 +1012,11 @@ class TrailProcessor:
             print(f"Cut detection error: {e}")
             return None
     
-    async def _record_cut_event(self, attacker_id: str, victim_id: str, session_id: str, cut_location: str) -> str:
-        """Record cut event in Redis stream"""
+    async def _record_cut_event(self, attacker_id: str, victim_id: str, session_id: str, cut_location: str, city: Optional[str] = None) -> str:
+        """Record cut event in Redis stream, a per-cut hash and both users' cut indexes, and push it to both users and the city"""
         cut_stream = f"cuts:events:stream"
-        cut_id = f"cut_{int(datetime.now(timezone.utc).timestamp() * 1000)}"
+        score = time.time_ns() // 1000  # microseconds; also the /cuts/mine cursor
+        cut_id = f"cut_{score // 1000}_{uuid.uuid4().hex[:6]}"
         
         fields = {
             "cut_id": cut_id,
@@ -276,12 +1027,18 @@ class TrailProcessor:
             "occurred_at": datetime.now(timezone.utc).isoformat()
         }
         
-        await self.redis.xadd(cut_stream, fields, maxlen=1000, approximate=True)
-        
-        # Also store in user-specific cut lists for quick access
-        await self.redis.lpush(f"cuts:user:{attacker_id}", cut_id)
-        await self.redis.lpush(f"cuts:user:{victim_id}", cut_id)
-        await self.redis.expire(f"cuts:user:{attacker_id}", 86400)  # 24 hours
-        await self.redis.expire(f"cuts:user:{victim_id}", 86400)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xadd(cut_stream, fields, maxlen=1000, approximate=True)
+        # Keyed copy so /cuts/mine can fetch by ID instead of scanning the stream
+        pipe.hset(cut_event_key(cut_id), mapping=fields)
+        pipe.expire(cut_event_key(cut_id), CUT_EVENT_TTL_SEC)
+        for user_id in {attacker_id, victim_id}:
+            key = user_cuts_key(user_id)
+            pipe.zadd(key, {cut_id: score})
+            pipe.zremrangebyrank(key, 0, -(CUTS_PER_USER_MAX + 1))
+            pipe.expire(key, CUT_EVENT_TTL_SEC)
+        channels = [user_channel(victim_id), user_channel(attacker_id)] + ([city_channel(city)] if city else [])
+        queue_publish(pipe, channels, {"type": "cut", **fields, "city": city})
+        await pipe.execute()
         
         return cut_id
\ No newline at end of file
@@ -0,0 +1,104 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Tuple
+from models import H3Point, TrailState
+
+
+@dataclass
+class CachedTrail:
+    """Live trail state held by this worker plus points not yet written to Redis"""
+    state: TrailState
+    version: int  # `version` field of trail:{session_id} after our last write
+    stored_count: int  # points in trail:{session_id}:points after our last write
+    pending_points: List[H3Point] = field(default_factory=list)
+    pending_cells: Dict[str, int] = field(default_factory=dict)
+    pending_since: Optional[float] = None  # monotonic time of the oldest pending point
+    lease_renew_at: float = 0.0  # monotonic time after which the owner lease is renewed
+
+    def add(self, points: List[H3Point], cell_counts: Dict[str, int]) -> None:
+        if not self.pending_points:
+            self.pending_since = time.monotonic()
+        self.pending_points.extend(points)
+        for cell, count in cell_counts.items():
+            self.pending_cells[cell] = self.pending_cells.get(cell, 0) + count
+
+    def clear_pending(self) -> None:
+        self.pending_points = []
+        self.pending_cells = {}
+        self.pending_since = None
+
+
+class TrailCache:
+    """Bounded LRU of live trail states with write-behind buffers"""
+
+    def __init__(self, max_size: int, flush_every: int):
+        self.max_size = max_size
+        self.flush_every = flush_every
+        self.entries: "OrderedDict[str, CachedTrail]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.conflicts = 0
+        self.lease_renewals = 0
+        self.dropped_points = 0  # buffered points discarded because newer ones were stored first
+        self.last_flush_lag_sec = 0.0
+        self.max_flush_lag_sec = 0.0
+
+    def get(self, session_id: str) -> Optional[CachedTrail]:
+        entry = self.entries.get(session_id)
+        if entry is not None:
+            self.entries.move_to_end(session_id)
+        return entry
+
+    def put(self, state: TrailState, version: int, stored_count: int) -> Tuple[CachedTrail, List[CachedTrail]]:
+        """Cache `state`; returns the entry and any evicted entries (which may need a flush)"""
+        evicted = []
+        replaced = self.entries.get(state.session_id)
+        if replaced is not None and replaced.pending_points:
+            evicted.append(replaced)
+        entry = CachedTrail(state=state, version=version, stored_count=stored_count)
+        self.entries[state.session_id] = entry
+        self.entries.move_to_end(state.session_id)
+        while len(self.entries) > self.max_size:
+            _, old = self.entries.popitem(last=False)
+            self.evictions += 1
+            evicted.append(old)
+        return entry, evicted
+
+    def pop(self, session_id: str) -> Optional[CachedTrail]:
+        return self.entries.pop(session_id, None)
+
+    def due(self, max_age_sec: float) -> List[CachedTrail]:
+        """Entries whose oldest pending point has waited at least `max_age_sec`"""
+        now = time.monotonic()
+        return [e for e in self.entries.values() if e.pending_since is not None and now - e.pending_since >= max_age_sec]
+
+    def record_flush(self, entry: CachedTrail) -> None:
+        if entry.pending_since is not None:
+            self.last_flush_lag_sec = time.monotonic() - entry.pending_since
+            self.max_flush_lag_sec = max(self.max_flush_lag_sec, self.last_flush_lag_sec)
+        self.flushes += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        now = time.monotonic()
+        pending = [e for e in self.entries.values() if e.pending_since is not None]
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "flushes": self.flushes,
+            "conflicts": self.conflicts,
+            "lease_renewals": self.lease_renewals,
+            "dropped_points": self.dropped_points,
+            "pending_trails": len(pending),
+            "pending_points": sum(len(e.pending_points) for e in pending),
+            "oldest_pending_sec": max((now - e.pending_since for e in pending), default=0.0),
+            "last_flush_lag_sec": self.last_flush_lag_sec,
+            "max_flush_lag_sec": self.max_flush_lag_sec,
+        }
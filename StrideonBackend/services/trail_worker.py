@@ -0,0 +1,309 @@
+import asyncio
+import math
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+from redis.exceptions import ResponseError, WatchError
+from models import H3Point
+from services.events import queue_publish, user_channel
+from services.point_filter import PointThinner, thin_and_process
+from config import GPS_WORK_PARTITIONS, GPS_WORK_BATCH, GPS_WORK_LEASE_SEC, GPS_WORK_MAX_RETRIES, TRAIL_TTL_SEC
+
+WORKERS_KEY = "gps:workers"
+WORK_GROUP = "trail-workers"
+
+
+def work_partition(session_id: str) -> int:
+    return zlib.crc32(session_id.encode()) % GPS_WORK_PARTITIONS
+
+
+def work_stream_key(partition: int) -> str:
+    return f"gps:work:{partition}"
+
+
+def work_done_key(session_id: str) -> str:
+    """Stream ID of the last entry applied for a session (the redelivery watermark)"""
+    return f"gps:work:done:{session_id}"
+
+
+def queue_work(pipe, session_id: str, user_id: str, city: Optional[str], point: H3Point) -> None:
+    """Queue a point for the trail workers onto a caller's pipeline (the ingest one)"""
+    pipe.xadd(work_stream_key(work_partition(session_id)), {
+        "session_id": session_id,
+        "user_id": user_id,
+        "city": city or "",
+        "lat": repr(point.lat),
+        "lng": repr(point.lng),
+        "h3_index": point.h3_index,
+        "ts": point.timestamp.isoformat(),
+    })
+
+
+def _stream_id(entry_id: str) -> Tuple[int, int]:
+    ms, seq = entry_id.split("-")
+    return int(ms), int(seq)
+
+
+class TrailWorker:
+    """Trail processing off the request path (GPS_ASYNC_INGEST mode).
+
+    Ingest XADDs each point to one of GPS_WORK_PARTITIONS work streams,
+    chosen by session. Workers split the partitions between them through
+    leases (a fair share each, rebalanced as workers join and leave) and
+    read their partitions through a consumer group. One owner per partition
+    and in-order processing keep each session's points in order. Entries are
+    acked after processing (at-least-once); a per-session watermark skips
+    entries already processed when a batch is redelivered after a crash.
+    Results are published to the runner's event channel.
+    """
+
+    def __init__(self, redis_client, trail_processor, thinner: Optional[PointThinner] = None,
+                 partitions: int = GPS_WORK_PARTITIONS, batch_size: int = GPS_WORK_BATCH):
+        self.redis = redis_client
+        self.trail_processor = trail_processor
+        self.thinner = thinner or PointThinner()
+        self.partitions = partitions
+        self.batch_size = batch_size
+        self.worker_id = uuid.uuid4().hex
+        self.owned: Set[int] = set()
+        self.retry_pending = False
+        self.attempts: Dict[str, int] = {}
+        self.next_rebalance = 0.0
+        self.processed = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.adopted = 0
+
+    @staticmethod
+    def _lease_key(partition: int) -> str:
+        return f"{work_stream_key(partition)}:lease"
+
+    async def run(self, block_ms: int = 1000) -> None:
+        while True:
+            try:
+                if time.monotonic() >= self.next_rebalance:
+                    await self.rebalance()
+                if not self.owned:
+                    await asyncio.sleep(block_ms / 1000)
+                    continue
+                await self.process_once(block_ms)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Trail worker error: {e}")
+                await asyncio.sleep(block_ms / 1000)
+
+    async def rebalance(self) -> None:
+        """Heartbeat, renew leases, then give up or take partitions to reach a fair share"""
+        self.next_rebalance = time.monotonic() + GPS_WORK_LEASE_SEC / 3
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zadd(WORKERS_KEY, {self.worker_id: now})
+        pipe.zremrangebyscore(WORKERS_KEY, "-inf", now - GPS_WORK_LEASE_SEC)
+        pipe.zcard(WORKERS_KEY)
+        live = max(1, (await pipe.execute())[2])
+        share = math.ceil(self.partitions / live)
+
+        for partition in sorted(self.owned):
+            if not await self._renew(partition):
+                self.owned.discard(partition)
+            else:
+                await self._claim_orphans(partition)  # entries too recent to claim at adoption
+        while len(self.owned) > share:
+            await self.release(max(self.owned))
+
+        if len(self.owned) < share:
+            # Start at a worker-specific offset so new workers don't race for the same partitions
+            offset = zlib.crc32(self.worker_id.encode()) % self.partitions
+            for i in range(self.partitions):
+                partition = (offset + i) % self.partitions
+                if partition in self.owned:
+                    continue
+                if await self.redis.set(self._lease_key(partition), self.worker_id, nx=True, px=int(GPS_WORK_LEASE_SEC * 1000)):
+                    await self._adopt(partition)
+                    if len(self.owned) >= share:
+                        break
+
+    async def _renew(self, partition: int) -> bool:
+        key = self._lease_key(partition)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if await pipe.get(key) != self.worker_id:
+                    return False
+                pipe.multi()
+                pipe.pexpire(key, int(GPS_WORK_LEASE_SEC * 1000))
+                await pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    async def release(self, partition: int) -> None:
+        self.owned.discard(partition)
+        key = self._lease_key(partition)
+        if await self.redis.get(key) == self.worker_id:
+            await self.redis.delete(key)
+
+    async def _adopt(self, partition: int) -> None:
+        """Take a newly leased partition, including entries its previous owner left unacked"""
+        stream = work_stream_key(partition)
+        try:
+            await self.redis.xgroup_create(stream, WORK_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self.adopted += 1
+        self.owned.add(partition)
+        await self._claim_orphans(partition)
+
+    async def _claim_orphans(self, partition: int) -> None:
+        """Claim entries other consumers have held unacked for a lease period, then drop dead consumers.
+
+        An entry idle for less than GPS_WORK_LEASE_SEC may still be in a
+        batch its previous owner is finishing, so it is left for a later
+        rebalance. Consumers are deleted only once they hold no entries
+        (deleting one drops its pending list) and have no heartbeat.
+        """
+        stream = work_stream_key(partition)
+        cursor = "0-0"
+        while True:
+            cursor, entries = (await self.redis.xautoclaim(
+                stream, WORK_GROUP, self.worker_id, int(GPS_WORK_LEASE_SEC * 1000), start_id=cursor, count=self.batch_size
+            ))[:2]
+            if entries:
+                self.retry_pending = True
+            if cursor == "0-0":
+                break
+
+        for consumer in await self.redis.xinfo_consumers(stream, WORK_GROUP):
+            name = consumer["name"]
+            if name == self.worker_id or consumer["pending"]:
+                continue
+            if await self.redis.zscore(WORKERS_KEY, name) is None:
+                await self.redis.xgroup_delconsumer(stream, WORK_GROUP, name)
+
+    async def process_once(self, block_ms: Optional[int] = None) -> int:
+        """Process one batch from the owned partitions; unacked (failed or reclaimed) entries go first"""
+        if self.retry_pending:
+            self.retry_pending = False
+            streams = {work_stream_key(p): "0" for p in self.owned}
+            res = await self.redis.xreadgroup(WORK_GROUP, self.worker_id, streams, count=self.batch_size)
+            if not any(entries for _, entries in res or []):
+                return await self.process_once(block_ms)
+            # A full batch may have left more unacked entries behind it
+            self.retry_pending = any(len(entries) >= self.batch_size for _, entries in res)
+        else:
+            streams = {work_stream_key(p): ">" for p in self.owned}
+            res = await self.redis.xreadgroup(WORK_GROUP, self.worker_id, streams, count=self.batch_size, block=block_ms)
+        processed = 0
+        for stream, entries in res or []:
+            if entries:
+                processed += await self._process(int(stream.rsplit(":", 1)[1]), entries)
+        return processed
+
+    async def _process(self, partition: int, entries: List[Tuple[str, Dict[str, str]]]) -> int:
+        stream = work_stream_key(partition)
+        by_session: "OrderedDict[str, List[Tuple[str, Dict[str, str]]]]" = OrderedDict()
+        acked: List[str] = []
+        for entry_id, fields in entries:
+            if not fields:
+                acked.append(entry_id)  # deleted after processing; nothing left to do
+                continue
+            by_session.setdefault(fields["session_id"], []).append((entry_id, fields))
+
+        # Per-session watermarks: the last entry whose points reached the trail
+        sessions = list(by_session)
+        watermarks = await self.redis.mget([work_done_key(sid) for sid in sessions]) if sessions else []
+        processed = 0
+        try:
+            for session_id, done in zip(sessions, watermarks):
+                items = by_session[session_id]
+                if done:
+                    fresh = [item for item in items if _stream_id(item[0]) > _stream_id(done)]
+                    self.duplicates += len(items) - len(fresh)
+                    acked.extend(entry_id for entry_id, _ in items[:len(items) - len(fresh)])
+                    items = fresh
+                if not items:
+                    continue
+                await self._process_session(session_id, items)
+                # Watermark before the ack: a crash in between must not replay these points
+                await self.redis.set(work_done_key(session_id), items[-1][0], ex=TRAIL_TTL_SEC)
+                acked.extend(entry_id for entry_id, _ in items)
+                processed += len(items)
+        except Exception as e:
+            self.failures += 1
+            self.retry_pending = True
+            print(f"Trail worker failed on session {session_id} (partition {partition}): {e}")
+            failed_id = items[0][0]
+            if self._give_up(failed_id):
+                # Poison entry: skip it so the session keeps moving
+                await self.redis.set(work_done_key(session_id), failed_id, ex=TRAIL_TTL_SEC)
+                acked.append(failed_id)
+        finally:
+            if acked:
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.xack(stream, WORK_GROUP, *acked)
+                pipe.xdel(stream, *acked)
+                await pipe.execute()
+        self.processed += processed
+        self.batches += 1
+        return processed
+
+    def _give_up(self, entry_id: str) -> bool:
+        self.attempts[entry_id] = self.attempts.get(entry_id, 0) + 1
+        if self.attempts[entry_id] < GPS_WORK_MAX_RETRIES:
+            return False
+        del self.attempts[entry_id]
+        self.dropped += 1
+        return True
+
+    async def _process_session(self, session_id: str, items: List[Tuple[str, Dict[str, str]]]) -> None:
+        user_id = items[-1][1]["user_id"]
+        city = next((f["city"] for _, f in reversed(items) if f.get("city")), None)
+        points = [
+            H3Point(
+                lat=float(f["lat"]),
+                lng=float(f["lng"]),
+                h3_index=f["h3_index"],
+                timestamp=datetime.fromisoformat(f["ts"]),
+                session_id=session_id,
+            )
+            for _, f in items
+        ]
+        pipe = self.redis.pipeline(transaction=False)
+        self.trail_processor.queue_tail_read(pipe, session_id)
+        tail_raw = (await pipe.execute())[0]
+        result = await thin_and_process(self.trail_processor, self.thinner, user_id, session_id, points, tail_raw, city)
+
+        pipe = self.redis.pipeline(transaction=False)
+        queue_publish(pipe, [user_channel(user_id)], {
+            "type": "trail_update",
+            "session_id": session_id,
+            "count": result["count"],
+            "thinned": result["thinned"],
+            "trail": result["trail"],
+            "events": result["events"],
+        })
+        await pipe.execute()
+
+    async def stop(self) -> None:
+        for partition in list(self.owned):
+            await self.release(partition)
+        await self.redis.zrem(WORKERS_KEY, self.worker_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "partitions": sorted(self.owned),
+            "processed": self.processed,
+            "duplicates_skipped": self.duplicates,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "partitions_adopted": self.adopted,
+        }
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from redis.exceptions import ResponseError
+from services.db import db_execute
+from config import WRITE_BEHIND_BATCH, WRITE_BEHIND_MAX_RETRIES, WRITE_BEHIND_CLAIM_IDLE_SEC
+
+# Tables that may be written behind; rows carry a server-assigned uuid `id`
+WRITE_BEHIND_TABLES = ("claims", "banked_results")
+
+
+class WriteBehindQueue:
+    """Durable write-behind for append-only inserts (claims, banked results).
+
+    `enqueue` assigns the row ID, appends the row to a Redis stream and
+    returns at once. `run` reads the stream through a consumer group and
+    bulk-upserts rows per table on `id`, so a redelivered batch cannot
+    insert twice. Rows are acked only after the insert succeeds; entries
+    left pending by a crashed worker are reclaimed after
+    WRITE_BEHIND_CLAIM_IDLE_SEC. Rows that keep failing go to a dead-letter
+    stream after WRITE_BEHIND_MAX_RETRIES deliveries.
+    """
+
+    stream_key = "writes:stream"
+    dead_key = "writes:dead"
+    group = "writers"
+
+    def __init__(self, redis_client, batch_size: int = WRITE_BEHIND_BATCH):
+        self.redis = redis_client
+        self.batch_size = batch_size
+        self.consumer = uuid.uuid4().hex
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.dead = 0
+        self.last_flush_lag_sec = 0.0
+        self.max_flush_lag_sec = 0.0
+
+    async def ensure_group(self) -> None:
+        try:
+            await self.redis.xgroup_create(self.stream_key, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def enqueue(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue an insert; returns the row with its server-assigned `id`"""
+        if table not in WRITE_BEHIND_TABLES:
+            raise ValueError(f"{table} is not a write-behind table")
+        row = {"id": str(uuid.uuid4()), **row}
+        await self.redis.xadd(self.stream_key, {"table": table, "row": json.dumps(row)})
+        return row
+
+    async def run(self, interval_sec: float) -> None:
+        """Background flusher; blocks on the stream for up to `interval_sec`"""
+        await self.ensure_group()
+        while True:
+            try:
+                await self.flush_once(block_ms=int(interval_sec * 1000))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Write-behind flush error: {e}")
+                await asyncio.sleep(interval_sec)
+
+    async def flush_once(self, block_ms: Optional[int] = None) -> int:
+        """Insert one batch (reclaimed stale entries first); returns rows written"""
+        entries = await self._reclaim_stale()
+        if not entries:
+            res = await self.redis.xreadgroup(
+                self.group, self.consumer, {self.stream_key: ">"}, count=self.batch_size, block=block_ms
+            )
+            entries = res[0][1] if res else []
+        if not entries:
+            return 0
+
+        by_table: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        for entry_id, fields in entries:
+            by_table.setdefault(fields.get("table", ""), []).append((entry_id, json.loads(fields.get("row", "{}"))))
+
+        written = 0
+        for table, items in by_table.items():
+            ids = [entry_id for entry_id, _ in items]
+            try:
+                await db_execute(self._table(table).upsert([row for _, row in items], on_conflict="id"))
+            except Exception as e:
+                self.failures += 1
+                print(f"Write-behind insert into {table} failed ({len(items)} rows): {e}")
+                continue  # left pending; retried when reclaimed
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.xack(self.stream_key, self.group, *ids)
+            pipe.xdel(self.stream_key, *ids)
+            await pipe.execute()
+            written += len(items)
+            self._record_lag(ids[0])
+
+        self.flushed += written
+        self.batches += 1
+        return written
+
+    async def _reclaim_stale(self) -> List[Tuple[str, Dict[str, str]]]:
+        """Take over entries idle in any consumer's pending list; dead-letter those retried too often"""
+        idle_ms = int(WRITE_BEHIND_CLAIM_IDLE_SEC * 1000)
+        pending = await self.redis.xpending_range(
+            self.stream_key, self.group, min="-", max="+", count=self.batch_size, idle=idle_ms
+        )
+        if not pending:
+            return []
+
+        dead_ids = [p["message_id"] for p in pending if p["times_delivered"] >= WRITE_BEHIND_MAX_RETRIES]
+        retry_ids = [p["message_id"] for p in pending if p["times_delivered"] < WRITE_BEHIND_MAX_RETRIES]
+        if dead_ids:
+            await self._dead_letter(dead_ids)
+        if not retry_ids:
+            return []
+        claimed = await self.redis.xclaim(self.stream_key, self.group, self.consumer, idle_ms, retry_ids)
+        return [(entry_id, fields) for entry_id, fields in claimed if fields]
+
+    async def _dead_letter(self, ids: List[str]) -> None:
+        entries = await self.redis.xclaim(self.stream_key, self.group, self.consumer, 0, ids)
+        pipe = self.redis.pipeline(transaction=True)
+        for entry_id, fields in entries:
+            if fields:
+                pipe.xadd(self.dead_key, {**fields, "source_id": entry_id})
+        pipe.xack(self.stream_key, self.group, *ids)
+        pipe.xdel(self.stream_key, *ids)
+        await pipe.execute()
+        self.dead += len(ids)
+
+    @staticmethod
+    def _table(table: str):
+        from utils import ensure_supabase
+        return ensure_supabase().table(table)
+
+    def _record_lag(self, entry_id: str) -> None:
+        # Stream IDs start with the enqueue time in ms
+        lag = max(0.0, time.time() - int(entry_id.split("-")[0]) / 1000)
+        self.last_flush_lag_sec = lag
+        self.max_flush_lag_sec = max(self.max_flush_lag_sec, lag)
+
+    async def stats(self) -> Dict[str, Any]:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xlen(self.stream_key)
+        pipe.xrange(self.stream_key, count=1)
+        pipe.xlen(self.dead_key)
+        depth, oldest, dead_depth = await pipe.execute()
+        try:
+            pending = (await self.redis.xpending(self.stream_key, self.group))["pending"]
+        except ResponseError:
+            pending = 0
+        oldest_age = time.time() - int(oldest[0][0].split("-")[0]) / 1000 if oldest else 0.0
+        return {
+            "depth": depth,
+            "pending": pending,
+            "oldest_age_sec": max(0.0, oldest_age),
+            "dead_letter_depth": dead_depth,
+            "flushed_rows": self.flushed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dead_lettered": self.dead,
+            "last_flush_lag_sec": self.last_flush_lag_sec,
+            "max_flush_lag_sec": self.max_flush_lag_sec,
+        }
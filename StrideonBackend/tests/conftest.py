@@ -0,0 +1,36 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import h3
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import H3Point  # noqa: E402
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture
+def redis():
+    # A server per test; clients created without one share state
+    return fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=True)
+
+
+@pytest.fixture
+def track():
+    """Point factory: step `k` is k*55 m north of the start and k seconds later"""
+    start = datetime.now(timezone.utc).replace(microsecond=0)  # stored points keep milliseconds
+
+    def point(k: int, session_id: str = "s1", lng: float = 77.59) -> H3Point:
+        lat = 12.97 + k * 0.0005
+        return H3Point(
+            lat=lat,
+            lng=lng,
+            h3_index=h3.latlng_to_cell(lat, lng, 9),
+            timestamp=start + timedelta(seconds=k),
+            session_id=session_id,
+        )
+
+    return point
@@ -0,0 +1,145 @@
+import time
+
+import httpx
+import pytest
+
+jwt = pytest.importorskip("jwt")
+rsa = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.rsa")
+ec = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.ec")
+
+import services.auth as auth
+from services.auth import TokenVerifier
+
+SECRET = "test-secret-long-enough-for-every-hmac-variant-0123"
+SUPABASE = "https://project.supabase.invalid"
+JWKS_URL = f"{SUPABASE}/auth/v1/.well-known/jwks.json"
+
+
+class AuthServer:
+    """MockTransport handler serving a JWKS and `/auth/v1/user`"""
+
+    def __init__(self):
+        self.keys = {}  # kid -> RSA private key
+        self.user_id = None
+        self.requests = []
+
+    def add_key(self, kid):
+        self.keys[kid] = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        return self.keys[kid]
+
+    def handler(self, request):
+        self.requests.append(request.url.path)
+        if str(request.url) == JWKS_URL:
+            keys = []
+            for kid, private_key in self.keys.items():
+                jwk = jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+                keys.append({**jwk, "kid": kid, "alg": "RS256", "use": "sig"})
+            return httpx.Response(200, json={"keys": keys})
+        if request.url.path == "/auth/v1/user" and self.user_id:
+            return httpx.Response(200, json={"id": self.user_id})
+        return httpx.Response(401, json={"msg": "invalid token"})
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = AuthServer()
+    client = httpx.AsyncClient(transport=httpx.MockTransport(server.handler))
+    monkeypatch.setattr(auth, "get_http_client", lambda: client)
+    monkeypatch.setattr(auth, "SUPABASE_URL", SUPABASE)
+    monkeypatch.setattr(auth, "SUPABASE_JWT_SECRET", SECRET)
+    monkeypatch.setattr(auth, "SUPABASE_JWKS_URL", JWKS_URL)
+    monkeypatch.setattr(auth, "JWT_AUDIENCE", "authenticated")
+    return server
+
+
+def token(key=SECRET, alg="HS256", sub="u1", ttl=300, aud="authenticated", kid=None):
+    claims = {"sub": sub, "exp": int(time.time()) + ttl, "aud": aud}
+    return jwt.encode(claims, key, algorithm=alg, headers={"kid": kid} if kid else None)
+
+
+@pytest.mark.asyncio
+async def test_valid_hs256_token_is_verified_locally_and_cached(server):
+    verifier = TokenVerifier()
+    t = token()
+
+    assert await verifier.verify(t) == "u1"
+    assert await verifier.verify(t) == "u1"
+    assert (verifier.local, verifier.hits, verifier.remote) == (1, 1, 0)
+    assert server.requests == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("bad", [
+    token(ttl=-10),
+    token(aud="someone-else"),
+    token(key="another-secret-long-enough-for-every-hmac-variant"),
+])
+async def test_invalid_tokens_are_rejected_without_the_remote_check(server, bad):
+    server.user_id = "u1"  # the remote check would accept anything
+    verifier = TokenVerifier()
+
+    assert await verifier.verify(bad) is None
+    assert verifier.rejected == 1
+    assert server.requests == []
+
+
+@pytest.mark.asyncio
+async def test_algorithm_outside_the_allow_list_is_rejected(server):
+    server.user_id = "u1"
+    verifier = TokenVerifier()
+
+    assert await verifier.verify(token(alg="HS384")) is None
+    assert await verifier.verify(jwt.encode({"sub": "u1", "exp": int(time.time()) + 60}, None, algorithm="none")) is None
+    assert verifier.rejected == 2
+    assert server.requests == []
+
+
+@pytest.mark.asyncio
+async def test_unknown_kid_refreshes_the_jwks(server):
+    verifier = TokenVerifier()
+    old = server.add_key("k1")
+    assert await verifier.verify(token(old, "RS256", kid="k1")) == "u1"
+
+    # Key rotation: the new kid is fetched once the refetch throttle has passed
+    new = server.add_key("k2")
+    verifier.jwks_fetched_at -= 61
+    assert await verifier.verify(token(new, "RS256", sub="u2", kid="k2")) == "u2"
+    assert server.requests.count("/auth/v1/.well-known/jwks.json") == 2
+    assert verifier.local == 2
+
+
+@pytest.mark.asyncio
+async def test_jwks_token_must_use_the_keys_algorithm(server):
+    server.add_key("k1")
+    verifier = TokenVerifier()
+    await verifier._refresh_jwks()
+
+    # k1 is published as RS256; an ES256 token claiming that kid is refused
+    other = ec.generate_private_key(ec.SECP256R1())
+    assert await verifier.verify(token(other, "ES256", kid="k1")) is None
+    assert verifier.rejected == 1 and verifier.remote == 0
+
+
+@pytest.mark.asyncio
+async def test_remote_fallback_caches_until_exp(server, monkeypatch):
+    monkeypatch.setattr(auth, "SUPABASE_JWT_SECRET", "")
+    server.user_id = "u9"
+    verifier = TokenVerifier()
+    t = token(ttl=120)
+
+    assert await verifier.verify(t) == "u9"
+    assert verifier.remote == 1
+    (user_id, exp), = verifier.tokens.values()
+    assert exp == jwt.decode(t, options={"verify_signature": False})["exp"]
+
+
+@pytest.mark.asyncio
+async def test_cache_never_outlives_exp(server, monkeypatch):
+    verifier = TokenVerifier()
+    t = token(ttl=120)
+    assert await verifier.verify(t) == "u1"
+    (_, exp), = verifier.tokens.values()
+
+    monkeypatch.setattr(auth.time, "time", lambda: exp + 1)
+    assert await verifier.verify(t) == "u1"  # PyJWT's own clock still accepts it
+    assert verifier.hits == 0 and verifier.local == 2
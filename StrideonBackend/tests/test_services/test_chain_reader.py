@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from services.chain_reader import ChainReader
+
+
+class StubReader(ChainReader):
+    """ChainReader whose JSON-RPC node is a dict; eth_call echoes the calldata"""
+
+    def __init__(self, block=100):
+        super().__init__("http://node.invalid", block_max_age_sec=60)
+        self.node_block = block
+        self.posts = []
+        self.gate = None
+        self.fail = None
+
+    async def _post(self, payload):
+        self.rpc_requests += 1
+        self.posts.append(payload)
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail is not None:
+            raise self.fail
+        if isinstance(payload, dict):
+            return self._answer(payload)
+        return [self._answer(item) for item in payload]
+
+    def _answer(self, item):
+        if item["method"] == "eth_blockNumber":
+            result = hex(self.node_block)
+        else:
+            call, block = item["params"]
+            result = f"{call['data']}@{int(block, 16)}"
+        return {"jsonrpc": "2.0", "id": item["id"], "result": result}
+
+    def eth_calls(self):
+        calls = 0
+        for payload in self.posts:
+            items = payload if isinstance(payload, list) else [payload]
+            calls += sum(1 for item in items if item["method"] == "eth_call")
+        return calls
+
+
+@pytest.mark.asyncio
+async def test_repeat_calls_within_a_block_hit_the_cache():
+    chain = StubReader()
+    first = await chain.call_many("0xc", ["0x01", "0x02", "0x01"])
+    second = await chain.call_many("0xc", ["0x02", "0x01"])
+
+    assert first == ["0x01@100", "0x02@100", "0x01@100"]
+    assert second == ["0x02@100", "0x01@100"]
+    assert chain.eth_calls() == 2
+    assert chain.hits == 2 and chain.misses == 2
+
+
+@pytest.mark.asyncio
+async def test_new_block_misses_the_cache():
+    chain = StubReader()
+    assert await chain.call_many("0xc", ["0x01"]) == ["0x01@100"]
+
+    chain.node_block = 101
+    await chain.refresh_block()
+    assert await chain.call_many("0xc", ["0x01"]) == ["0x01@101"]
+    assert chain.eth_calls() == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_request():
+    chain = StubReader()
+    await chain.refresh_block()
+    chain.gate = asyncio.Event()
+
+    leader = asyncio.create_task(chain.call_many("0xc", ["0x01", "0x02"]))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(chain.call_many("0xc", ["0x02", "0x01"]))
+    await asyncio.sleep(0)
+    chain.gate.set()
+
+    assert await leader == ["0x01@100", "0x02@100"]
+    assert await waiter == ["0x02@100", "0x01@100"]
+    assert chain.eth_calls() == 2 and len(chain.posts) == 2  # eth_blockNumber + one batch
+    assert not chain.inflight
+
+
+@pytest.mark.asyncio
+async def test_waiter_sees_the_leaders_error():
+    chain = StubReader()
+    await chain.refresh_block()
+    chain.gate = asyncio.Event()
+    chain.fail = RuntimeError("node down")
+
+    leader = asyncio.create_task(chain.call_many("0xc", ["0x01"]))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(chain.call_many("0xc", ["0x01"]))
+    await asyncio.sleep(0)
+    chain.gate.set()
+
+    for task in (leader, waiter):
+        with pytest.raises(RuntimeError, match="node down"):
+            await task
+    assert not chain.inflight
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_does_not_strand_its_waiters():
+    chain = StubReader()
+    await chain.refresh_block()
+    chain.gate = asyncio.Event()
+
+    leader = asyncio.create_task(chain.call_many("0xc", ["0x01"]))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(chain.call_many("0xc", ["0x01"]))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(waiter, 1)
+    assert not chain.inflight
+
+    # The key is fetchable again once the failed request is gone
+    chain.gate.set()
+    assert await chain.call_many("0xc", ["0x01"]) == ["0x01@100"]
+
+
+@pytest.mark.asyncio
+async def test_short_batch_response_fails_instead_of_caching_partial_results():
+    chain = StubReader()
+    await chain.refresh_block()
+
+    async def short_batch(calls):
+        return ["0x01@100"]
+
+    chain.rpc_batch = short_batch
+    with pytest.raises(RuntimeError, match="1 results for 2 calls"):
+        await chain.call_many("0xc", ["0x01", "0x02"])
+    assert not chain.cache and not chain.inflight
@@ -0,0 +1,105 @@
+import pytest
+
+import services.geo as geo
+from services.geo import H3GeoProcessor, cells_to_ints, h3i
+
+ORIGIN = h3i.latlng_to_cell(12.97, 77.59, 9)
+
+
+def ij(i, j):
+    return h3i.local_ij_to_cell(ORIGIN, i, j)
+
+
+def walk(*corners):
+    """IJ cells along straight runs between consecutive corners"""
+    out = [corners[0]]
+    for (ti, tj) in corners[1:]:
+        i, j = out[-1]
+        while (i, j) != (ti, tj):
+            i += (ti > i) - (ti < i)
+            j += (tj > j) - (tj < j)
+            out.append((i, j))
+    return out
+
+
+def square(i0, j0, i1, j1):
+    return {(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)}
+
+
+def cells(ijs):
+    return {ij(i, j) for i, j in ijs}
+
+
+@pytest.fixture
+def geo_processor():
+    return H3GeoProcessor()
+
+
+def test_closed_ring_encloses_its_interior(geo_processor):
+    # Territory is the bottom edge; the runner goes up, across and back down
+    territory = cells(walk((0, 0), (6, 0)))
+    path = walk((0, 0), (0, 6), (6, 6), (6, 0))
+
+    claimed = geo_processor.detect_loop_closure([ij(*c) for c in path], cells_to_ints(territory))
+
+    assert claimed == cells(path) - territory | cells(square(1, 1, 5, 5))
+
+
+def test_owned_cells_inside_the_ring_are_not_claimed_again(geo_processor):
+    owned = square(2, 2, 3, 3)
+    territory = cells(walk((0, 0), (6, 0))) | cells(owned)
+    path = walk((0, 0), (0, 6), (6, 6), (6, 0))
+
+    claimed = geo_processor.detect_loop_closure([ij(*c) for c in path], cells_to_ints(territory))
+
+    assert claimed == cells(path) - territory | cells(square(1, 1, 5, 5) - owned)
+    assert not claimed & territory
+
+
+def test_open_path_does_not_close(geo_processor):
+    territory = cells(walk((0, 0), (6, 0)))
+    path = walk((0, 0), (0, 6), (6, 6), (6, 2))
+
+    assert geo_processor.detect_loop_closure([ij(*c) for c in path], cells_to_ints(territory)) is None
+
+
+def test_ring_larger_than_the_bbox_limit_is_rejected(geo_processor, monkeypatch):
+    territory = cells(walk((0, 0), (6, 0)))
+    path = [ij(*c) for c in walk((0, 0), (0, 6), (6, 6), (6, 0))]
+    monkeypatch.setattr(geo, "MAX_LOOP_BBOX_CELLS", 8 * 8)  # the box is 9x9 with its border ring
+
+    assert geo_processor.detect_loop_closure(path, cells_to_ints(territory)) is None
+    assert geo_processor.loop_lookup_cells(path) == []
+
+
+def test_figure_eight_encloses_both_lobes(geo_processor):
+    # Two rings touching at (4, 4); the pinch must not let either lobe leak
+    territory = cells([(0, 0)])
+    path = walk((0, 0), (4, 0), (4, 8), (8, 8), (8, 4), (0, 4), (0, 0))
+
+    claimed = geo_processor.detect_loop_closure([ij(*c) for c in path], cells_to_ints(territory))
+
+    lobes = square(1, 1, 3, 3) | square(5, 5, 7, 7)
+    assert claimed == cells(path) - territory | cells(lobes)
+    assert not claimed & cells([(3, 5), (5, 3)])  # outside, between the lobes
+
+
+def test_connect_cells_fills_gaps(geo_processor):
+    path = geo_processor._connect_cells([ij(0, 0), ij(0, 0), ij(0, 4)])
+    assert path == [ij(0, j) for j in range(5)]
+
+
+def test_lookup_cells_cover_everything_the_check_reads(geo_processor, monkeypatch):
+    territory = cells(walk((0, 0), (6, 0)))
+    path = [ij(*c) for c in walk((0, 0), (0, 6), (6, 6), (6, 0))]
+    lookup = set(geo_processor.loop_lookup_cells(path))
+
+    read = []
+    real_contain = geo.cells_contain
+    monkeypatch.setattr(geo, "cells_contain", lambda sorted_cells, query: read.extend(query) or real_contain(sorted_cells, query))
+    geo_processor.detect_loop_closure(path, cells_to_ints(territory))
+
+    assert set(read) <= lookup
+    # Owned cells limited to the lookup give the same answer as the whole territory
+    assert geo_processor.detect_loop_closure(path, cells_to_ints(territory & lookup)) == \
+        geo_processor.detect_loop_closure(path, cells_to_ints(territory | cells(square(20, 20, 22, 22))))
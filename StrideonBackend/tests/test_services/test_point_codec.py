@@ -0,0 +1,81 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import h3
+import pytest
+
+import services.trail as trail_module
+from models import H3Point
+from services.trail import TrailProcessor
+
+encode = TrailProcessor._encode_point
+decode = TrailProcessor._decode_point
+
+
+def fields(p):
+    return round(p.lat, 7), round(p.lng, 7), p.h3_index, p.timestamp, p.session_id
+
+
+def point(lat, lng, timestamp, session_id="s1"):
+    return H3Point(lat=lat, lng=lng, h3_index=h3.latlng_to_cell(lat, lng, 9), timestamp=timestamp, session_id=session_id)
+
+
+@pytest.mark.parametrize("lat,lng", [(12.9716, 77.5946), (-33.8688, 151.2093), (40.7128, -74.006), (-22.9068, -43.1729)])
+def test_round_trip_keeps_coordinates_to_1e7_degrees(lat, lng):
+    p = point(lat, lng, datetime(2024, 5, 1, 6, 30, tzinfo=timezone.utc))
+    raw = encode(p)
+    back = decode(raw, "s1")
+
+    assert raw.startswith("1")
+    assert abs(back.lat - lat) < 1e-7 and abs(back.lng - lng) < 1e-7
+    assert back.h3_index == p.h3_index
+    assert back.timestamp == p.timestamp
+    assert back.session_id == "s1"
+
+
+def test_naive_timestamps_are_read_as_utc():
+    naive = datetime(2024, 5, 1, 6, 30, 15)
+    aware = naive.replace(tzinfo=timezone.utc)
+    shifted = aware.astimezone(timezone(timedelta(hours=5, minutes=30)))
+
+    assert encode(point(1.0, 2.0, naive)) == encode(point(1.0, 2.0, aware)) == encode(point(1.0, 2.0, shifted))
+    assert decode(encode(point(1.0, 2.0, naive)), "s1").timestamp == aware
+
+
+@pytest.mark.parametrize("micros,millis", [(0, 0), (999, 0), (1000, 1000), (123456, 123000), (999999, 999000)])
+def test_microseconds_are_truncated_to_milliseconds(micros, millis):
+    ts = datetime(2024, 5, 1, 6, 30, 15, micros, tzinfo=timezone.utc)
+    assert decode(encode(point(1.0, 2.0, ts)), "s1").timestamp == ts.replace(microsecond=millis)
+
+
+def test_json_format_is_still_written_when_configured(monkeypatch):
+    monkeypatch.setattr(trail_module, "TRAIL_POINT_FORMAT", "json")
+    p = point(-1.5, -2.5, datetime(2024, 5, 1, tzinfo=timezone.utc))
+    raw = encode(p)
+
+    assert raw.startswith("{")
+    assert decode(raw, "other") == p
+
+
+def test_unknown_tag_is_rejected():
+    with pytest.raises(ValueError, match="Unknown trail point format"):
+        decode("2AAAA", "s1")
+
+
+@pytest.mark.asyncio
+async def test_trail_with_legacy_and_compact_points_reads_in_order(redis, track):
+    processor = TrailProcessor(redis)
+    await processor.add_points_to_trail("s1", "u1", [track(k) for k in range(2)])
+    legacy = [
+        json.dumps({
+            "lat": p.lat, "lng": p.lng, "h3_index": p.h3_index,
+            "timestamp": p.timestamp.isoformat(), "session_id": p.session_id,
+        })
+        for p in (track(2), track(3))
+    ]
+    await redis.rpush("trail:s1:points", *legacy)
+    await redis.rpush("trail:s1:points", encode(track(4)))
+
+    raws = await redis.lrange("trail:s1:points", 0, -1)
+    assert [raw[:1] for raw in raws] == ["1", "1", "{", "{", "1"]
+    assert [fields(decode(raw, "s1")) for raw in raws] == [fields(track(k)) for k in range(5)]
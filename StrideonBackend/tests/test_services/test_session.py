@@ -0,0 +1,20 @@
+import pytest
+
+from services.session import SessionManager
+from services.trail import TrailProcessor
+
+
+@pytest.mark.asyncio
+async def test_end_session_removes_every_trail_key(redis, track):
+    sessions = SessionManager(redis)
+    await sessions.create_session_state("s1", "u1", "blr")
+    await TrailProcessor(redis).add_points_to_trail("s1", "u1", [track(k) for k in range(3)], city="blr")
+    await redis.set("trail:s1:owner", "worker-a", px=10000)
+    await redis.set("gps:work:done:s1", "1-0")
+
+    await sessions.end_session("s1")
+
+    assert await redis.keys("trail:s1*") == []
+    assert await redis.keys("gps:work:done:s1") == []
+    assert await redis.hget("session:s1", "status") == "ended"
+    assert await redis.smembers("user:u1:sessions") == set()
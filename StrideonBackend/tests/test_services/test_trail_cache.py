@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import services.trail as trail_module
+from services.trail import TrailProcessor
+from services.trail_cache import TrailCache
+
+
+async def stored_points(processor, session_id="s1"):
+    state = await processor.get_trail_state(session_id)
+    return [p.timestamp for p in state.points]
+
+
+@pytest.mark.asyncio
+async def test_alternating_processors_keep_every_point_in_order(redis, track):
+    a = TrailProcessor(redis, cache=TrailCache(10, 5))
+    b = TrailProcessor(redis, cache=TrailCache(10, 5))
+    flushers = [asyncio.create_task(p.run_flusher(0.05)) for p in (a, b)]
+    try:
+        for k in range(20):
+            # Runs of three pings per processor, as with a non-sticky load balancer
+            processor = a if (k // 3) % 2 == 0 else b
+            await processor.add_points_to_trail("s1", "u1", [track(k)])
+    finally:
+        for task in flushers:
+            task.cancel()
+    await a.flush_all()
+    await b.flush_all()
+
+    timestamps = await stored_points(a)
+    assert timestamps == sorted(timestamps)
+    assert len(timestamps) == 20
+    assert await redis.hget("trail:s1", "points_count") == "20"
+
+
+@pytest.mark.asyncio
+async def test_owner_lease_is_renewed_while_points_are_buffered(redis, track, monkeypatch):
+    monkeypatch.setattr(trail_module, "TRAIL_CACHE_LEASE_SEC", 0.3)
+    a = TrailProcessor(redis, cache=TrailCache(10, 100))
+    await a.add_points_to_trail("s1", "u1", [track(0)])  # new trails flush at once
+
+    owners = []
+    for k in range(1, 9):
+        await a.add_points_to_trail("s1", "u1", [track(k)])
+        await asyncio.sleep(0.1)
+        owners.append(await redis.get("trail:s1:owner"))
+
+    assert owners == [a.worker_id] * len(owners)
+    assert a.cache.lease_renewals > 0
+
+
+@pytest.mark.asyncio
+async def test_stale_owner_drops_buffer_instead_of_appending_older_points(redis, track, monkeypatch):
+    monkeypatch.setattr(trail_module, "TRAIL_CACHE_LEASE_SEC", 0.2)
+    monkeypatch.setattr(trail_module, "TRAIL_OWNER_POLL_SEC", 0.01)
+    a = TrailProcessor(redis, cache=TrailCache(10, 100))
+    b = TrailProcessor(redis, cache=TrailCache(10, 100))
+    await a.add_points_to_trail("s1", "u1", [track(0)])
+    await a.add_points_to_trail("s1", "u1", [track(1), track(2)])
+
+    await asyncio.sleep(0.3)  # A never flushes and its lease lapses
+    await b.add_points_to_trail("s1", "u1", [track(3)])
+    await b.flush_all()
+    await a.flush_all()
+
+    timestamps = await stored_points(a)
+    assert timestamps == sorted(timestamps)
+    assert len(timestamps) == 2
+    assert a.cache.dropped_points == 2
+
+
+@pytest.mark.asyncio
+async def test_writer_gives_up_while_owner_keeps_its_lease(redis, track, monkeypatch):
+    monkeypatch.setattr(trail_module, "TRAIL_CACHE_LEASE_SEC", 0.3)
+    monkeypatch.setattr(trail_module, "TRAIL_OWNER_POLL_SEC", 0.01)
+    a = TrailProcessor(redis, cache=TrailCache(10, 100))
+    b = TrailProcessor(redis, cache=TrailCache(10, 100))
+    await a.add_points_to_trail("s1", "u1", [track(0)])
+    await a.add_points_to_trail("s1", "u1", [track(1)])
+
+    async def keep_appending():
+        for k in range(2, 10):
+            await asyncio.sleep(0.05)
+            await a.add_points_to_trail("s1", "u1", [track(k)])
+
+    appender = asyncio.create_task(keep_appending())
+    with pytest.raises(RuntimeError, match="another worker"):
+        await b.add_points_to_trail("s1", "u1", [track(20)])
+    await appender
+    await a.flush_all()
+
+    timestamps = await stored_points(a)
+    assert timestamps == sorted(timestamps)
+    assert len(timestamps) == 10
@@ -0,0 +1,156 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import h3
+import pytest
+
+from models import H3Point
+
+import services.trail as trail_module
+from services.trail import TrailProcessor
+
+
+async def stored_timestamps(processor, session_id="s1"):
+    state = await processor.get_trail_state(session_id)
+    return [p.timestamp for p in state.points]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_are_coalesced_in_call_order(redis, track):
+    processor = TrailProcessor(redis)
+    results = await asyncio.gather(*[
+        processor.add_points_to_trail("s1", "u1", [track(k)]) for k in range(30)
+    ])
+
+    assert processor.coalesced_calls > 0
+    assert await stored_timestamps(processor) == [track(k).timestamp for k in range(30)]
+    assert await redis.hget("trail:s1", "points_count") == "30"
+    assert all(r["ok"] for r in results)
+
+
+@pytest.mark.asyncio
+async def test_two_processors_lose_no_points(redis, track):
+    a, b = TrailProcessor(redis), TrailProcessor(redis)
+    await asyncio.gather(*[
+        (a if k % 2 else b).add_points_to_trail("s1", "u1", [track(k)]) for k in range(40)
+    ])
+
+    timestamps = await stored_timestamps(a)
+    assert sorted(timestamps) == [track(k).timestamp for k in range(40)]
+    assert await redis.hget("trail:s1", "points_count") == "40"
+
+
+@pytest.mark.asyncio
+async def test_events_go_back_to_the_caller_whose_point_raised_them(redis, track):
+    processor = TrailProcessor(redis)
+    await processor.add_points_to_trail("v1", "u2", [track(k, "v1") for k in (10, 11, 12)], city="blr")
+
+    results = await asyncio.gather(
+        processor.add_points_to_trail("s1", "u1", [track(0)], city="blr"),
+        processor.add_points_to_trail("s1", "u1", [track(1), track(2)], city="blr"),
+        processor.add_points_to_trail("s1", "u1", [track(3)], city="blr"),
+        processor.add_points_to_trail("s1", "u1", [track(4), track(11)], city="blr"),
+    )
+
+    assert processor.coalesced_calls > 0
+    assert [r["events"] for r in results[:3]] == [[], [], []]
+    (event,) = results[3]["events"]
+    assert event["index"] == 1
+    assert event["h3_index"] == track(11).h3_index
+    assert event["cut_detected"]["victim_id"] == "u2"
+    assert await redis.hget("trail:v1", "status") == "cut"
+
+
+@pytest.mark.asyncio
+async def test_lost_version_race_is_retried(redis, track):
+    processor = TrailProcessor(redis)
+    await processor.add_points_to_trail("s1", "u1", [track(0)])
+    write_points = processor._write_points
+    races = {"left": 1}
+
+    async def racing_write(*args, **kwargs):
+        if races["left"]:
+            races["left"] -= 1
+            await redis.hincrby("trail:s1", "version", 1)  # another worker got there first
+        return await write_points(*args, **kwargs)
+
+    processor._write_points = racing_write
+    await processor.add_points_to_trail("s1", "u1", [track(1)])
+
+    assert processor.write_conflicts == 1
+    assert len(await stored_timestamps(processor)) == 2
+
+
+@pytest.mark.asyncio
+async def test_write_fails_instead_of_overwriting_after_retries(redis, track, monkeypatch):
+    monkeypatch.setattr(trail_module, "TRAIL_WRITE_RETRIES", 2)
+    processor = TrailProcessor(redis)
+    await processor.add_points_to_trail("s1", "u1", [track(0)])
+    write_points = processor._write_points
+
+    async def always_racing(*args, **kwargs):
+        await redis.hincrby("trail:s1", "version", 1)
+        return await write_points(*args, **kwargs)
+
+    processor._write_points = always_racing
+    with pytest.raises(RuntimeError, match="kept changing"):
+        await processor.add_points_to_trail("s1", "u1", [track(1)])
+
+    assert processor.write_conflicts == 3
+    assert len(await stored_timestamps(processor)) == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_fails_the_callers_it_coalesced(redis, track):
+    processor = TrailProcessor(redis)
+    gates = [asyncio.Event(), asyncio.Event()]
+    applied = []
+
+    async def slow_apply(session_id, user_id, points, city=None, attempt=0):
+        applied.append(len(points))
+        await gates[len(applied) - 1].wait()
+        return {"ok": True, "events": [], "trail": {}}
+
+    processor._apply_points = slow_apply
+    leader = asyncio.create_task(processor.add_points_to_trail("s1", "u1", [track(0)]))
+    await asyncio.sleep(0)
+    waiters = [asyncio.create_task(processor.add_points_to_trail("s1", "u1", [track(k)])) for k in (1, 2)]
+    await asyncio.sleep(0)
+
+    # Finish the first apply; the leader takes both waiters into its next batch and is cancelled there
+    gates[0].set()
+    await asyncio.sleep(0.01)
+    assert applied == [1, 2]
+    leader.cancel()
+
+    for waiter in waiters:
+        with pytest.raises(RuntimeError, match="cancelled"):
+            await asyncio.wait_for(waiter, 1.0)
+    assert "s1" not in processor.session_queues
+
+
+@pytest.mark.asyncio
+async def test_loop_back_into_territory_claims_the_enclosed_area(redis):
+    processor = TrailProcessor(redis)
+    base = h3.latlng_to_cell(12.97, 77.59, 9)
+    lat0, lng0 = h3.cell_to_latlng(base)
+    start = datetime.now(timezone.utc).replace(microsecond=0)
+    # Out north, east, south and back west into the territory seeded below
+    path = [(lat0 + k * 0.0012, lng0) for k in range(8)]
+    path += [(lat0 + 7 * 0.0012, lng0 + k * 0.0012) for k in range(1, 8)]
+    path += [(lat0 + k * 0.0012, lng0 + 7 * 0.0012) for k in range(6, -1, -1)]
+    path += [(lat0, lng0 + k * 0.0012) for k in range(6, -1, -1)]
+    points = [
+        H3Point(lat=lat, lng=lng, h3_index=h3.latlng_to_cell(lat, lng, 9), timestamp=start + timedelta(seconds=k), session_id="s1")
+        for k, (lat, lng) in enumerate(path)
+    ]
+
+    await processor.add_points_to_trail("s1", "u1", points[:1], city="blr")
+    far_away = h3.grid_disk(h3.latlng_to_cell(13.2, 77.8, 9), 20)  # never looked at by the loop check
+    await redis.sadd("trail:s1:territory", *[h3.str_to_int(c) for c in h3.grid_disk(base, 2) + far_away])
+    result = await processor.add_points_to_trail("s1", "u1", points[1:], city="blr")
+
+    (event,) = [e for e in result["events"] if "loop_closure" in e]
+    assert event["h3_index"] in h3.grid_disk(base, 2)  # raised on re-entering the territory
+    assert len(event["loop_closure"]["cells"]) == 8
+    assert round(event["loop_closure"]["area_m2"]) == 868046
@@ -0,0 +1,178 @@
+import asyncio
+
+import pytest
+
+import services.trail_worker as trail_worker_module
+from services.point_filter import PointThinner
+from services.trail import TrailProcessor
+from services.trail_worker import TrailWorker, queue_work, work_stream_key, WORK_GROUP, WORKERS_KEY
+
+
+async def enqueue(redis, track, sessions, steps):
+    pipe = redis.pipeline(transaction=False)
+    for k in range(steps):
+        for session_id in sessions:
+            queue_work(pipe, session_id, f"u_{session_id}", "blr", track(k, session_id))
+    await pipe.execute()
+
+
+async def drain(*workers, rounds=20):
+    for _ in range(rounds):
+        for worker in workers:
+            await worker.process_once(10)
+
+
+async def stored_timestamps(processor, session_id):
+    state = await processor.get_trail_state(session_id)
+    return [p.timestamp for p in state.points] if state else []
+
+
+class CrashAfterWatermark:
+    """Redis proxy that dies right after a session's done-watermark is written (before the ack)"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.crashed = False
+
+    def __getattr__(self, name):
+        return getattr(self.redis, name)
+
+    async def set(self, key, *args, **kwargs):
+        result = await self.redis.set(key, *args, **kwargs)
+        if key.startswith("gps:work:done:") and not self.crashed:
+            self.crashed = True
+            raise asyncio.CancelledError()
+        return result
+
+
+def make_worker(redis, processor, **kwargs):
+    return TrailWorker(redis, processor, PointThinner(0, 0), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_workers_split_partitions_without_overlap(redis):
+    processor = TrailProcessor(redis)
+    w1, w2 = make_worker(redis, processor), make_worker(redis, processor)
+    await w1.rebalance()
+    await w2.rebalance()
+    await w1.rebalance()  # gives up its surplus now that w2 is live
+    await w2.rebalance()
+
+    assert not w1.owned & w2.owned
+    assert w1.owned | w2.owned == set(range(w1.partitions))
+    assert abs(len(w1.owned) - len(w2.owned)) <= 1
+
+
+async def crash_first_worker(redis, track, processor):
+    """Run a worker that dies after applying a batch of s1 but before acking it"""
+    await enqueue(redis, track, ["s1"], 5)
+    crashing = CrashAfterWatermark(redis)
+    w1 = make_worker(crashing, processor)
+    await w1.rebalance()
+    with pytest.raises(asyncio.CancelledError):
+        await w1.process_once(10)
+    assert len(await stored_timestamps(processor, "s1")) == 5
+
+    # Its heartbeat and leases lapse
+    await redis.zrem(WORKERS_KEY, w1.worker_id)
+    for partition in w1.owned:
+        await redis.delete(TrailWorker._lease_key(partition))
+    return w1
+
+
+async def consumers(redis, session_id="s1"):
+    stream = work_stream_key(trail_worker_module.work_partition(session_id))
+    return {c["name"]: c["pending"] for c in await redis.xinfo_consumers(stream, WORK_GROUP)}
+
+
+@pytest.mark.asyncio
+async def test_redelivery_after_crash_does_not_apply_points_twice(redis, track, monkeypatch):
+    monkeypatch.setattr(trail_worker_module, "GPS_WORK_LEASE_SEC", 0.05)
+    processor = TrailProcessor(redis)
+    w1 = await crash_first_worker(redis, track, processor)
+    await asyncio.sleep(0.06)  # the unacked entries have been idle a full lease
+
+    w2 = make_worker(redis, processor)
+    await w2.rebalance()
+    await drain(w2)
+
+    assert len(await stored_timestamps(processor, "s1")) == 5
+    assert await redis.hget("trail:s1", "points_count") == "5"
+    assert w2.duplicates == 5
+    pending = await redis.xpending(work_stream_key(trail_worker_module.work_partition("s1")), WORK_GROUP)
+    assert pending["pending"] == 0
+    assert w1.worker_id not in await consumers(redis)  # dead consumer removed once its entries moved
+
+
+@pytest.mark.asyncio
+async def test_recent_unacked_entries_wait_a_lease_before_adoption(redis, track, monkeypatch):
+    monkeypatch.setattr(trail_worker_module, "GPS_WORK_LEASE_SEC", 0.2)
+    processor = TrailProcessor(redis)
+    w1 = await crash_first_worker(redis, track, processor)
+
+    # Lease gone early, but the batch may still be running: not claimed yet
+    w2 = make_worker(redis, processor)
+    await w2.rebalance()
+    await drain(w2, rounds=2)
+    assert w2.duplicates == 0
+    assert (await consumers(redis))[w1.worker_id] == 5
+
+    await asyncio.sleep(0.25)
+    await w2.rebalance()
+    await drain(w2, rounds=2)
+    assert w2.duplicates == 5
+    assert w1.worker_id not in await consumers(redis)
+    assert len(await stored_timestamps(processor, "s1")) == 5
+
+
+@pytest.mark.asyncio
+async def test_failed_session_is_retried_first_and_stays_in_order(redis, track):
+    processor = TrailProcessor(redis)
+    sessions = [f"s{i}" for i in range(4)]
+    await enqueue(redis, track, sessions, 10)
+
+    original = processor.add_points_to_trail
+    failures = {"s2": 1}
+
+    async def flaky(session_id, *args, **kwargs):
+        if failures.get(session_id):
+            failures[session_id] -= 1
+            raise RuntimeError("redis hiccup")
+        return await original(session_id, *args, **kwargs)
+
+    processor.add_points_to_trail = flaky
+    worker = make_worker(redis, processor, batch_size=7)
+    await worker.rebalance()
+    await drain(worker)
+
+    assert worker.failures == 1
+    for session_id in sessions:
+        timestamps = await stored_timestamps(processor, session_id)
+        assert len(timestamps) == 10
+        assert timestamps == sorted(timestamps)
+
+
+@pytest.mark.asyncio
+async def test_poison_entry_is_skipped_after_max_retries(redis, track, monkeypatch):
+    monkeypatch.setattr(trail_worker_module, "GPS_WORK_MAX_RETRIES", 2)
+    processor = TrailProcessor(redis)
+    await enqueue(redis, track, ["s1"], 1)
+    await enqueue(redis, track, ["s2"], 1)
+
+    original = processor.add_points_to_trail
+
+    async def poison(session_id, *args, **kwargs):
+        if session_id == "s1":
+            raise ValueError("bad point")
+        return await original(session_id, *args, **kwargs)
+
+    processor.add_points_to_trail = poison
+    worker = make_worker(redis, processor)
+    await worker.rebalance()
+    await drain(worker)
+
+    assert worker.dropped == 1
+    assert await stored_timestamps(processor, "s1") == []
+    assert len(await stored_timestamps(processor, "s2")) == 1
+    for partition in range(worker.partitions):
+        assert (await redis.xpending(work_stream_key(partition), WORK_GROUP))["pending"] == 0
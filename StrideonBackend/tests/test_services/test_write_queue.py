@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+import services.write_queue as write_queue_module
+from services.write_queue import WriteBehindQueue
+
+
+class FakeTable:
+    """Records upserts per table; fails the first `fail_times` calls"""
+
+    def __init__(self, fail_times: int = 0):
+        self.fail_times = fail_times
+        self.calls = []
+
+    def __call__(self, table: str) -> "FakeTable":
+        self.table = table
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        table = self.table
+        owner = self
+
+        class Query:
+            def execute(self):
+                owner.calls.append((table, [row["id"] for row in rows], on_conflict))
+                if owner.fail_times > 0:
+                    owner.fail_times -= 1
+                    raise RuntimeError("insert failed")
+
+        return Query()
+
+
+@pytest.fixture
+def queue(redis, monkeypatch):
+    monkeypatch.setattr(write_queue_module, "WRITE_BEHIND_CLAIM_IDLE_SEC", 0.001)
+    monkeypatch.setattr(write_queue_module, "WRITE_BEHIND_MAX_RETRIES", 3)
+    return WriteBehindQueue(redis)
+
+
+@pytest.mark.asyncio
+async def test_flush_upserts_each_table_on_id_and_acks(queue, redis, monkeypatch):
+    table = FakeTable()
+    monkeypatch.setattr(WriteBehindQueue, "_table", staticmethod(table))
+    await queue.ensure_group()
+    claim_a = await queue.enqueue("claims", {"user_id": "u1"})
+    claim_b = await queue.enqueue("claims", {"user_id": "u2"})
+    banked = await queue.enqueue("banked_results", {"user_id": "u1"})
+
+    assert await queue.flush_once() == 3
+    assert sorted(table.calls) == [
+        ("banked_results", [banked["id"]], "id"),
+        ("claims", [claim_a["id"], claim_b["id"]], "id"),
+    ]
+    stats = await queue.stats()
+    assert (stats["depth"], stats["pending"], stats["dead_letter_depth"]) == (0, 0, 0)
+
+
+@pytest.mark.asyncio
+async def test_failed_insert_stays_pending_and_is_retried(queue, monkeypatch):
+    table = FakeTable(fail_times=1)
+    monkeypatch.setattr(WriteBehindQueue, "_table", staticmethod(table))
+    await queue.ensure_group()
+    row = await queue.enqueue("claims", {"user_id": "u1"})
+
+    assert await queue.flush_once() == 0
+    assert (await queue.stats())["pending"] == 1
+
+    await asyncio.sleep(0.01)  # past the claim idle time
+    assert await queue.flush_once() == 1
+    # Same row ID both times, so the retry cannot insert a duplicate
+    assert [ids for _, ids, _ in table.calls] == [[row["id"]], [row["id"]]]
+    stats = await queue.stats()
+    assert (stats["depth"], stats["pending"], stats["failures"]) == (0, 0, 1)
+
+
+@pytest.mark.asyncio
+async def test_rows_that_keep_failing_are_dead_lettered(queue, redis, monkeypatch):
+    table = FakeTable(fail_times=100)
+    monkeypatch.setattr(WriteBehindQueue, "_table", staticmethod(table))
+    await queue.ensure_group()
+    row = await queue.enqueue("claims", {"user_id": "u1"})
+
+    for _ in range(5):
+        await queue.flush_once()
+        await asyncio.sleep(0.01)
+
+    assert len(table.calls) == 3  # WRITE_BEHIND_MAX_RETRIES deliveries
+    dead = await redis.xrange(WriteBehindQueue.dead_key)
+    assert len(dead) == 1
+    assert dead[0][1]["table"] == "claims"
+    assert row["id"] in dead[0][1]["row"]
+    stats = await queue.stats()
+    assert (stats["depth"], stats["pending"], stats["dead_lettered"]) == (0, 0, 1)
@@ -1,17 +1,26 @@
 from datetime import datetime, timezone
 from typing import Optional
-import httpx
 from fastapi import HTTPException, Header
 from supabase import create_client, Client
-from config import SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, SUPABASE_ANON_KEY, DEBUG_USER_ID
+from config import SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, DEBUG_USER_ID
+from services.auth import TokenVerifier
+from services.db import db_execute
+from services.profile_cache import KnownProfileCache
 
 
 # Global Supabase client
 sb: Optional[Client] = None
 
+# Verified-token cache shared by all requests in this worker
+token_verifier = TokenVerifier()
+
+# User IDs whose profiles row exists; lets ensure_profile skip the DB
+known_profiles = KnownProfileCache()
+
 
 async def get_user_id(authorization: str = Header(default="")) -> str:
     """Resolve user_id from Supabase JWT. Falls back to DEBUG_USER_ID if set.
+    Tokens are verified locally (secret/JWKS) and cached until expiry; see TokenVerifier.
     Accepts header in formats: "Bearer <jwt>" or the raw token.
     """
     token = ""
@@ -20,18 +29,10 @@ async def get_user_id(authorization: str = Header(default="")) -> str:
             token = authorization.split(" ", 1)[1].strip()
         else:
             token = authorization.strip()
-    if token and SUPABASE_URL:
-        try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                headers = {"Authorization": f"Bearer {token}", "apikey": SUPABASE_ANON_KEY}
-                resp = await client.get(f"{SUPABASE_URL}/auth/v1/user", headers=headers)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    uid = data.get("id") or (data.get("user") or {}).get("id")
-                    if uid:
-                        return uid
-        except Exception:
-            pass
+    if token:
+        uid = await token_verifier.verify(token)
+        if uid:
+            return uid
     if DEBUG_USER_ID:
         return DEBUG_USER_ID
     raise HTTPException(status_code=401, detail="Unauthorized: supply valid Supabase JWT or set DEBUG_USER_ID")
@@ -52,12 +53,16 @@ def ensure_supabase() -> Client:
 
 
 async def ensure_profile(user_id: str) -> None:
+    from main import redis
+    if await known_profiles.is_known(user_id, redis):
+        return
     s = ensure_supabase()
     try:
         # Try fetch
-        got = s.table("profiles").select("user_id").eq("user_id", user_id).limit(1).execute()
+        got = await db_execute(s.table("profiles").select("user_id").eq("user_id", user_id).limit(1))
         if not got.data:
-            s.table("profiles").upsert({"user_id": user_id}, on_conflict="user_id").execute()
+            await db_execute(s.table("profiles").upsert({"user_id": user_id}, on_conflict="user_id"))
+        await known_profiles.mark(user_id, redis)
     except Exception:
         # ignore; RLS/service role might differ across envs
         pass
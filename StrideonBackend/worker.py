@@ -0,0 +1,42 @@
+"""Standalone trail-processing worker for GPS_ASYNC_INGEST mode.
+
+Run as many as needed (`python worker.py`); they split the GPS work-stream
+partitions between them. Set GPS_WORKERS_INPROC=0 to keep the API
+processes from processing trails themselves.
+"""
+import asyncio
+import signal
+import redis.asyncio as aioredis
+from config import REDIS_URL, TRAIL_CACHE_SIZE, TRAIL_CACHE_FLUSH_EVERY, TRAIL_CACHE_FLUSH_INTERVAL_SEC, GPS_WORK_BLOCK_MS
+from services.trail import TrailProcessor
+from services.trail_cache import TrailCache
+from services.trail_worker import TrailWorker
+
+
+async def main() -> None:
+    redis = aioredis.from_url(REDIS_URL, decode_responses=True)
+    await redis.ping()
+    trail_cache = TrailCache(TRAIL_CACHE_SIZE, TRAIL_CACHE_FLUSH_EVERY) if TRAIL_CACHE_SIZE > 0 else None
+    trail_processor = TrailProcessor(redis, cache=trail_cache)
+    worker = TrailWorker(redis, trail_processor)
+    tasks = [asyncio.create_task(worker.run(GPS_WORK_BLOCK_MS))]
+    if trail_cache:
+        tasks.append(asyncio.create_task(trail_processor.run_flusher(TRAIL_CACHE_FLUSH_INTERVAL_SEC)))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    print(f"Trail worker {worker.worker_id} started")
+    await stop.wait()
+
+    for task in tasks:
+        task.cancel()
+    await trail_processor.flush_all()
+    await worker.stop()
+    await redis.aclose()
+    print(f"Trail worker {worker.worker_id} stopped: {worker.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())